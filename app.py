@@ -4,7 +4,7 @@ TradingRoad - Plataforma de Trading Profesional
 Flask Backend sin análisis AI
 """
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
 import sys
@@ -20,10 +20,17 @@ from modules.market.marketService import MarketService
 from modules.news.news import NewsService
 from modules.calendar.calendar import CalendarService
 from modules.volatility.volatility import VolatilityService
+from modules.replay.http import replay_status, reset_replay
+from modules.api.conditional import since_param, versioned
+from modules.api.events import default_event_bus, sse_stream
+from modules.api.mount import mount_sentiment_backend
+from modules.api.json_provider import NumpyJSONProvider
 
 # Configurar la aplicación Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
+# JSON con orjson: arrays de NumPy y columnas de pandas sin conversión valor a valor
+app.json = NumpyJSONProvider(app)
 
 # Configurar CORS
 CORS(app, origins=["*"])
@@ -33,7 +40,18 @@ config_service = ConfigService()
 market_service = MarketService()
 news_service = NewsService()
 calendar_service = CalendarService()
-volatility_service = VolatilityService()
+volatility_service = VolatilityService(market_service)
+
+# Recolección en segundo plano del sentimiento de Binance, escáner de funding
+# y detector de anomalías (desactivable con TRADINGROAD_BACKGROUND_JOBS=0)
+if os.environ.get('TRADINGROAD_BACKGROUND_JOBS', '1') != '0':
+    volatility_service.start_background_jobs()
+    market_service.funding_scanner.start()
+    market_service.anomaly_detector.start()
+
+# Backend del módulo de sentimiento en el mismo proceso: una sola caché de datos de derivados
+# (desactivable con TRADINGROAD_MOUNT_SENTIMENT=0)
+mount_sentiment_backend(app)
 
 print("🚀 TradingRoad Backend iniciado")
 print("📊 Servicios disponibles: Market, News, Calendar, Volatility, Config")
@@ -140,6 +158,64 @@ def get_market_price(symbol):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/market/funding')
+def get_funding_scan():
+    """Obtener funding, spreads entre exchanges y carry anualizado de todos los perpetuos"""
+    try:
+        symbols = request.args.get('symbols')
+        symbols = symbols.split(',') if symbols else None
+        min_venues = request.args.get('min_venues', 1, type=int)
+        limit = request.args.get('limit', None, type=int)
+        
+        data = market_service.get_funding_scan(symbols, min_venues, limit)
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/market/anomalies')
+def get_market_anomalies():
+    """Obtener las anomalías recientes de OI, funding y precio de los perpetuos"""
+    try:
+        symbols = request.args.get('symbols')
+        symbols = symbols.split(',') if symbols else None
+        kinds = request.args.get('kinds')
+        kinds = kinds.split(',') if kinds else None
+        since = request.args.get('since', 0, type=int)
+        limit = request.args.get('limit', 100, type=int)
+        
+        data = market_service.get_anomalies(symbols, kinds, since, limit)
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/events/stream')
+def stream_events():
+    """Stream SSE de alertas (canales separados por comas; por defecto, todos)"""
+    channels = request.args.get('channels')
+    channels = channels.split(',') if channels else None
+    # El navegador reenvía el último id al reconectar
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({"success": False, "error": f"last_id no válido: {last_id}"}), 400
+    
+    stream = sse_stream(default_event_bus(), last_id, channels)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/market/orderbook/consolidated/<base>')
+def get_consolidated_order_book(base):
+    """Obtener el libro consolidado de varios exchanges con desglose por venue"""
+    try:
+        levels = request.args.get('levels', 50, type=int)
+        step = request.args.get('step', 0, type=float)
+        
+        data = market_service.get_consolidated_order_book(base.upper(), levels, step)
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/market/historical/<symbol>')
 def get_historical_data(symbol):
     """Obtener datos históricos de un símbolo"""
@@ -253,6 +329,37 @@ def get_volatility_analysis(symbol):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/volatility/realized')
+def get_realized_volatility():
+    """Obtener volatilidad realizada (close-to-close, Parkinson, Garman-Klass, Yang-Zhang) de varios símbolos"""
+    try:
+        symbols = [s for s in request.args.get('symbols', 'BTC,ETH').split(',') if s]
+        timeframe = request.args.get('timeframe', '1d')
+        
+        realized = volatility_service.get_realized_volatility(symbols, timeframe)
+        return jsonify({"success": True, "data": realized})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/volatility/vrp/<currency>')
+@versioned()
+def get_volatility_risk_premium(currency):
+    """Obtener la prima de riesgo de volatilidad (DVOL - realizada) con z-scores y percentiles"""
+    try:
+        timeframe = request.args.get('timeframe', '1d')
+        estimator = request.args.get('estimator', 'close_to_close')
+        points = request.args.get('points', 90, type=int)
+        labels = request.args.get('labels', '1') != '0'
+        
+        data = volatility_service.get_volatility_risk_premium(
+            currency.upper(), timeframe, estimator, points, labels, since_param()
+        )
+        return jsonify({"success": True, "data": data})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/volatility/expirations')
 def get_expirations():
     """Obtener vencimientos de derivados"""
@@ -267,6 +374,7 @@ def get_expirations():
 # ==================== NUEVOS ENDPOINTS PARA VENCIMIENTOS AVANZADOS ====================
 
 @app.route('/api/expirations/<currency>')
+@versioned(lambda currency: volatility_service.data_version('chain', currency))
 def get_expirations_by_currency(currency):
     """Obtener fechas de vencimiento disponibles para una moneda específica"""
     try:
@@ -277,6 +385,7 @@ def get_expirations_by_currency(currency):
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/derivatives/options/<currency>')
+@versioned(lambda currency: volatility_service.data_version('chain', currency))
 def get_options_data(currency):
     """Obtener datos de opciones de Deribit"""
     try:
@@ -286,7 +395,44 @@ def get_options_data(currency):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/derivatives/chain/<currency>')
+@versioned(lambda currency: volatility_service.data_version('chain', currency))
+def get_chain_query(currency):
+    """
+    Consultar la cadena de opciones con filtros (expiry_from, expiry_to, strike_min,
+    strike_max, moneyness_min, moneyness_max, delta_min, delta_max, type, min_oi),
+    paginación (offset, limit) y columnas (fields=strike,mark_iv,...)
+    """
+    try:
+        filters = {key: request.args.get(key) for key in (
+            'expiry_from', 'expiry_to', 'strike_min', 'strike_max', 'moneyness_min', 'moneyness_max',
+            'delta_min', 'delta_max', 'type', 'min_oi'
+        )}
+        fields = request.args.get('fields')
+        fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', 100, type=int)
+        
+        data = volatility_service.get_chain_query(currency.upper(), filters, fields, offset, limit)
+        return jsonify({"success": True, "data": data})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/derivatives/summary')
+@versioned(lambda: volatility_service.data_version('chains', request.args.get('currencies', '')))
+def get_options_summary():
+    """Resumen de opciones de varias monedas (?currencies=BTC,ETH,SOL,XRP; por defecto, las configuradas)"""
+    try:
+        currencies = [c.strip().upper() for c in request.args.get('currencies', '').split(',') if c.strip()]
+        data = volatility_service.get_options_summary(currencies or None)
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/derivatives/metrics/<currency>')
+@versioned(lambda currency: volatility_service.data_version('metrics', currency))
 def get_derivatives_metrics(currency):
     """Obtener métricas de derivados"""
     try:
@@ -298,7 +444,93 @@ def get_derivatives_metrics(currency):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/derivatives/gex/<currency>')
+@versioned(lambda currency: volatility_service.data_version('chain', currency))
+def get_gex_profile(currency):
+    """Obtener perfil de exposición gamma (GEX) por strike y vencimiento"""
+    try:
+        currency = currency.upper()
+        expiry_date = request.args.get('expiry_date')
+        
+        profile = volatility_service.get_gex_profile(currency, expiry_date)
+        return jsonify({"success": True, "data": profile})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/derivatives/iv-surface/<currency>')
+@versioned(lambda currency: volatility_service.data_version('chain', currency))
+def get_iv_surface(currency):
+    """Obtener superficie de volatilidad implícita (rejilla, punto, corte o estructura temporal)"""
+    try:
+        currency = currency.upper()
+        view = request.args.get('view', 'grid')
+        moneyness = request.args.get('moneyness', 1.0, type=float)
+        days = request.args.get('days', None, type=float)
+        expiry_date = request.args.get('expiry_date')
+        
+        surface = volatility_service.get_iv_surface(currency, view, moneyness, days, expiry_date)
+        return jsonify({"success": True, "data": surface})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/derivatives/scenario/<currency>', methods=['POST'])
+def post_scenario(currency):
+    """P&L y griegas de una cartera de opciones en una rejilla de precio, IV y tiempo"""
+    try:
+        body = request.get_json(silent=True) or {}
+        positions = body.get('positions')
+        if not isinstance(positions, list) or not positions:
+            return jsonify({"success": False, "error": "positions debe ser una lista no vacía"}), 400
+        fields = body.get('fields') or ['delta', 'gamma', 'vega', 'theta']
+        
+        data = volatility_service.get_scenario(currency.upper(), positions, body.get('grid'), fields)
+        return jsonify({"success": True, "data": data})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/derivatives/term-structure/<currency>')
+@versioned(lambda currency: volatility_service.data_version('futures', currency))
+def get_term_structure(currency):
+    """Obtener la curva de futuros con basis anualizado alineada con los vencimientos de opciones"""
+    try:
+        data = volatility_service.get_futures_term_structure(currency.upper())
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/derivatives/archive/<currency>')
+@versioned()
+def get_archived_chain(currency):
+    """Obtener un snapshot archivado de la cadena de opciones (at=ISO o ms)"""
+    try:
+        at = request.args.get('at')
+        columns = request.args.get('columns')
+        columns = columns.split(',') if columns else None
+        
+        snapshot = volatility_service.get_archived_snapshot(currency.upper(), at, columns)
+        return jsonify({"success": True, "data": snapshot})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/derivatives/archive/instrument/<instrument_name>')
+@versioned()
+def get_archived_instrument(instrument_name):
+    """Obtener la serie temporal archivada de un instrumento"""
+    try:
+        columns = request.args.get('columns')
+        columns = columns.split(',') if columns else None
+        
+        history = volatility_service.get_instrument_history(
+            instrument_name.upper(), request.args.get('start'), request.args.get('end'), columns
+        )
+        return jsonify({"success": True, "data": history})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/derivatives/orderbook/<currency>')
+@versioned(lambda currency: volatility_service.data_version('book', currency))
 def get_derivatives_orderbook(currency):
     """Obtener libro de órdenes de derivados"""
     try:
@@ -310,27 +542,65 @@ def get_derivatives_orderbook(currency):
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/derivatives/book/<instrument>')
+@versioned(lambda instrument: volatility_service.data_version('book', instrument))
+def get_derivatives_book(instrument):
+    """Consultar el libro local de un instrumento (top N, cantidad y profundidad hasta un precio)"""
+    try:
+        levels = int(request.args.get('levels', 20))
+        price = request.args.get('price', type=float)
+        side = request.args.get('side', 'bids')
+        if side not in ('bids', 'asks'):
+            return jsonify({"success": False, "error": "side debe ser bids o asks"}), 400
+        
+        book = volatility_service.get_book_query(instrument.upper(), levels, price, side)
+        return jsonify({"success": True, "data": book})
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/api/derivatives/volatility-history/<currency>')
+@versioned(lambda currency: volatility_service.data_version(
+    'dvol', currency, resolution=request.args.get('resolution', '1D'), days=int(request.args.get('days', 90))
+))
 def get_volatility_history(currency):
     """Obtener historial de volatilidad"""
     try:
         currency = currency.upper()
         days = int(request.args.get('days', 90))
+        resolution = request.args.get('resolution', '1D')
+        labels = request.args.get('labels', '1') != '0'
         
-        history = volatility_service.get_volatility_history(currency, days)
+        history = volatility_service.get_volatility_history(currency, days, resolution, labels, since_param())
         return jsonify({"success": True, "data": history})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
 @app.route('/api/derivatives/binance-metrics/<symbol>')
+@versioned(lambda symbol: volatility_service.data_version('binance', symbol))
 def get_binance_metrics(symbol):
     """Obtener métricas de Binance (Open Interest, Long/Short ratio, etc.)"""
     try:
-        metrics = volatility_service.get_binance_metrics(symbol)
+        labels = request.args.get('labels', '1') != '0'
+        metrics = volatility_service.get_binance_metrics(symbol, labels=labels, since=since_param())
         return jsonify({"success": True, "data": metrics})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/api/derivatives/binance-series/<symbol>')
+@versioned(lambda symbol: volatility_service.data_version('binance', symbol))
+def get_binance_series(symbol):
+    """Obtener una ventana de OI, ratio long/short o funding de Binance desde el histórico local"""
+    try:
+        series = request.args.get('series', 'open_interest')
+        days = request.args.get('days', 7, type=float)
+        
+        data = volatility_service.get_binance_series(symbol.upper(), series, days, since_param())
+        return jsonify({"success": True, "data": data})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # Config APIs
 @app.route('/api/config', methods=['GET'])
 def get_config():
@@ -354,6 +624,28 @@ def update_config():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Replay APIs
+@app.route('/api/replay/status', methods=['GET'])
+def get_replay_status():
+    """Obtener modo HTTP (live/record/replay), reloj simulado y uso de las grabaciones"""
+    try:
+        return jsonify({"success": True, "data": replay_status()})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/replay/reset', methods=['POST'])
+def post_replay_reset():
+    """Reiniciar el reloj del replay (JSON opcional: start, speed)"""
+    try:
+        options = request.get_json(silent=True) or {}
+        speed = options.get('speed')
+        status = reset_replay(options.get('start'), float(speed) if speed is not None else None)
+        if status is None:
+            return jsonify({"success": False, "error": "La aplicación no está en modo replay"}), 400
+        return jsonify({"success": True, "data": status})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # ==================== HEALTH CHECK ====================
 
 @app.route('/api/health')
@@ -0,0 +1,21 @@
+"""
+Rutas de los datos locales, compartidas por los almacenes y el modo replay
+"""
+import os
+
+# Directorio base de datos locales (se puede cambiar con TRADINGROAD_DATA_DIR)
+DATA_DIR = os.environ.get(
+    'TRADINGROAD_DATA_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+)
+
+# Directorio de los almacenes que se rellenan desde la red (DVOL, sentimiento,
+# archivo de cadenas). En modo replay tienen uno propio (TRADINGROAD_REPLAY_STORE_DIR)
+# para que lo reproducido no se mezcle con el histórico grabado en vivo.
+if os.environ.get('TRADINGROAD_HTTP_MODE', 'live').lower() == 'replay':
+    STORE_DIR = os.environ.get('TRADINGROAD_REPLAY_STORE_DIR', os.path.join(DATA_DIR, 'replay_stores'))
+else:
+    STORE_DIR = DATA_DIR
+
+# Grabaciones HTTP del modo record/replay
+REPLAY_DIR = os.environ.get('TRADINGROAD_REPLAY_DIR', os.path.join(DATA_DIR, 'replay'))
@@ -1,230 +1,146 @@
 # backend/app.py - VERSIÓN FINAL CORREGIDA
 
 import os
-import json
-import requests
+import sys
 import pandas as pd
-import numpy
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from flask.json.provider import JSONProvider
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 import traceback
-from collections import defaultdict
-from decimal import Decimal
+
+# Raíz del repositorio principal: la capa HTTP (grabación / replay) es compartida
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+if REPO_ROOT not in sys.path: sys.path.insert(0, REPO_ROOT)
+from modules.replay.clock import now_ms
+from modules.volatility.analytics import chain_metrics
+from modules.volatility.data import default_derivatives_data
+from modules.volatility.sentiment_store import default_sentiment_store
+from modules.volatility.volatility import get_deribit_dvol_history as get_shared_dvol_history
+from modules.orderbook.feeds import default_book_manager
+from modules.api.conditional import since_param, versioned
+from modules.api.json_provider import NumpyJSONProvider
 
 # ==============================================================================
-# SECCIÓN 1: LÓGICA DE DERIBIT
+# SECCIÓN 1: LÓGICA DE DERIBIT (capa de datos compartida con VolatilityService)
 # ==============================================================================
-def calculate_max_pain(df):
-    if df.empty or 'strike' not in df or df['strike'].nunique() == 0: return 0
-    strikes = sorted(df['strike'].unique()); total_losses = []
-    for expiry_strike in strikes:
-        loss = 0
-        calls_df = df[df['type'] == 'C'].copy(); calls_df['loss'] = (expiry_strike - calls_df['strike']) * calls_df['open_interest']; calls_df.loc[calls_df['loss'] < 0, 'loss'] = 0; loss += calls_df['loss'].sum()
-        puts_df = df[df['type'] == 'P'].copy(); puts_df['loss'] = (puts_df['strike'] - expiry_strike) * puts_df['open_interest']; puts_df.loc[puts_df['loss'] < 0, 'loss'] = 0; loss += puts_df['loss'].sum()
-        total_losses.append(loss)
-    min_loss_index = total_losses.index(min(total_losses))
-    return strikes[min_loss_index]
-
-def get_deribit_option_data(currency='BTC'):
-    url = f"https://www.deribit.com/api/v2/public/get_book_summary_by_currency?currency={currency}&kind=option"
-    try:
-        response = requests.get(url, timeout=10); response.raise_for_status(); data = response.json()['result']
-        df = pd.DataFrame(data)
-        if df.empty: return df
-        if 'greeks' not in df.columns:
-            df['greeks'] = [{'delta': 0, 'gamma': 0, 'vega': 0, 'theta': 0} for _ in range(len(df))]
-        else:
-            df['greeks'] = df['greeks'].apply(lambda x: x if isinstance(x, dict) else {'delta': 0, 'gamma': 0, 'vega': 0, 'theta': 0})
-        df['expiration_date'] = pd.to_datetime(df['instrument_name'].str.split('-').str[1], format='%d%b%y').dt.normalize()
-        df['strike'] = df['instrument_name'].str.split('-').str[2]
-        df['type'] = df['instrument_name'].str.split('-').str[3]
-        numeric_cols = ['mark_iv', 'underlying_price', 'strike', 'open_interest', 'volume']
-        df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
-        df.dropna(subset=['strike'], inplace=True)
-        df['strike'] = df['strike'].astype(int)
-        return df
-    except Exception as e:
-        print(f"Error en get_deribit_option_data: {e}"); traceback.print_exc(); return None
-
-def calculate_deribit_metrics(df):
-    if df is None or df.empty:
-        return {
-            "call_oi": 0, "put_oi": 0, "total_oi": 0, "pc_ratio": 0, 
-            "notional_value_usd": 0, "max_pain": 0, "pc_ratio_volume": 0,
-            "notional_value_asset": 0
-        }
-    
-    call_oi = df[df['type'] == 'C']['open_interest'].sum()
-    put_oi = df[df['type'] == 'P']['open_interest'].sum()
-    total_oi = call_oi + put_oi
-    pc_ratio = put_oi / call_oi if call_oi > 0 else 0
-    call_volume = df[df['type'] == 'C']['volume'].sum()
-    put_volume = df[df['type'] == 'P']['volume'].sum()
-    pc_ratio_volume = put_volume / call_volume if call_volume > 0 else 0
-    notional_value_usd = (df['open_interest'] * df['underlying_price']).sum()
-    notional_value_asset = df['open_interest'].sum()
-
-    # Max Pain se calcula sobre una sola fecha de vencimiento.
-    # Si el DataFrame contiene múltiples fechas, usamos la más cercana para el cálculo.
-    unique_expirations = df['expiration_date'].unique()
-    max_pain_df = df
-    if len(unique_expirations) > 1:
-        today = pd.to_datetime('today').normalize()
-        future_expirations = [d for d in unique_expirations if d >= today]
-        if future_expirations:
-            closest_expiration = min(future_expirations)
-            max_pain_df = df[df['expiration_date'] == closest_expiration].copy()
+def calculate_deribit_metrics(chain, aggregates=None):
+    # Métricas vectorizadas (analytics.chain_metrics) con los nombres que espera el frontend
+    m = chain_metrics(chain, nearest_expiry=True, aggregates=aggregates)
+    return {"call_oi": m['call_oi'], "put_oi": m['put_oi'], "total_oi": m['total_oi'], "pc_ratio": m['put_call_ratio_oi'],
+            "notional_value_usd": m['notional_value_usd'], "max_pain": m['max_pain'], "pc_ratio_volume": m['put_call_ratio_volume'],
+            "notional_value_asset": m['notional_value_asset']}
+
+def get_deribit_dvol_history(currency='BTC', days=90, since=None):
+    # Almacén local de DVOL (solo se descargan los puntos que faltan)
+    df = get_shared_dvol_history(currency.upper(), days, '1D')
+    if df is None or df.empty: return None
+    # since= (ms): solo los puntos nuevos; last_timestamp es el valor a pasar en la siguiente consulta
+    last_ms = int(df['timestamp'].iloc[-1].value // 10**6)
+    if since is not None: df = df[df['timestamp'] > pd.to_datetime(since, unit='ms')]
+    return {"timestamps": df['timestamp'].dt.strftime('%Y-%m-%d').tolist(), "values": df['sma_7'].to_numpy(), "last_timestamp": last_ms}
 
-    max_pain = calculate_max_pain(max_pain_df)
+# ==============================================================================
+# SECCIÓN 2: LÓGICA DE BINANCE Y OTRAS (almacén local de sentimiento)
+# ==============================================================================
+HOUR_MS = 3600 * 1000
 
-    return {
-        "call_oi": call_oi, "put_oi": put_oi, "total_oi": total_oi, "pc_ratio": pc_ratio,
-        "notional_value_usd": notional_value_usd, "max_pain": max_pain, "pc_ratio_volume": pc_ratio_volume,
-        "notional_value_asset": notional_value_asset
-    }
+def series_since(df, column, since):
+    # since= (ms): filas posteriores y último timestamp (para la siguiente consulta)
+    last_ms = int(df[column].max()) if not df.empty else since
+    df = df[df[column] > since] if since is not None else df
+    return df, last_ms
 
-def get_deribit_dvol_history(currency='BTC', days=90):
-    instrument = currency.upper()
-    end_time = int(datetime.now().timestamp() * 1000)
-    start_time = int((datetime.now() - timedelta(days=days)).timestamp() * 1000)
-    url = f"https://www.deribit.com/api/v2/public/get_volatility_index_data?currency={instrument}&start_timestamp={start_time}&end_timestamp={end_time}&resolution=D"
-    try:
-        response = requests.get(url, timeout=10); response.raise_for_status(); data = response.json().get('result', {}).get('data', [])
-        if not data: return None
-        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df['close'] = pd.to_numeric(df['close'])
-        df['sma_7'] = df['close'].rolling(window=7).mean()
-        df.dropna(subset=['sma_7'], inplace=True)
-        return {"timestamps": df['timestamp'].dt.strftime('%Y-%m-%d').tolist(), "values": df['sma_7'].tolist()}
-    except Exception as e:
-        print(f"Error al obtener historial de DVOL para {instrument}: {e}"); return None
+def store_points(symbol, name, period_ms, limit):
+    # Puntos de la serie de 5m alineados al periodo (4h, 1h) que servía la API de Binance, como DataFrame
+    records = default_sentiment_store().window(symbol, name, now_ms() - (limit + 1) * period_ms)
+    df = pd.DataFrame({field: records[field] for field in records.dtype.names})
+    return df[df['timestamp'] % period_ms == 0].tail(limit)
 
-# ==============================================================================
-# SECCIÓN 2: LÓGICA DE BINANCE Y OTRAS
-# ==============================================================================
-def get_binance_klines(symbol='BTC', interval='1d', days=7):
-    ticker = f"{symbol.upper()}USDT"; url = f"https://fapi.binance.com/fapi/v1/klines?symbol={ticker}&interval={interval}&limit={days}"
-    try:
-        response=requests.get(url, timeout=10); response.raise_for_status(); klines=response.json()
-        if not klines: return None
-        df=pd.DataFrame(klines, columns=['open_time','open','high','low','close','volume','close_time','quote_asset_volume','number_of_trades','taker_buy_base_asset_volume','taker_buy_quote_asset_volume','ignore'])
-        for col in ['high','low']: df[col]=pd.to_numeric(df[col])
-        week_high_row=df.loc[df['high'].idxmax()]; week_low_row=df.loc[df['low'].idxmin()]
-        return {"week_high":week_high_row['high'], "week_high_timestamp":week_high_row['open_time'], "week_low":week_low_row['low'], "week_low_timestamp":week_low_row['open_time']}
-    except Exception as e:
-        print(f"Error al obtener klines para {ticker}: {e}"); return None
+def series_rows(df, column, since):
+    df, last_ms = series_since(df, 'timestamp', since)
+    return {"timestamps": pd.to_datetime(df['timestamp'], unit='ms').dt.strftime('%d-%b %H:%M').tolist(), "values": df[column].to_numpy(), "last_timestamp": last_ms}
 
-def get_binance_sentiment_data(symbol='BTC', limit_oi=48, limit_ls=48):
-    ticker, period_oi, period_ls = f"{symbol.upper()}USDT", "4h", "1h"
+def get_binance_sentiment_data(symbol='BTC', limit_oi=48, limit_ls=48, since=None):
     sentiment_data={"open_interest_history":None, "long_short_ratio":None, "current_oi_binance":None, "oi_change_4h_percent":None}
     try:
-        oi_change_url=f"https://fapi.binance.com/futures/data/openInterestHist?symbol={ticker}&period={period_oi}&limit=2"
-        df=pd.DataFrame(requests.get(oi_change_url, timeout=10).json())
-        if not df.empty:
-            sentiment_data["current_oi_binance"]=float(df['sumOpenInterestValue'].iloc[-1])
-            if len(df)>=2:
-                current, prev=float(df['sumOpenInterestValue'].iloc[-1]), float(df['sumOpenInterestValue'].iloc[-2])
+        oi = default_sentiment_store().last(symbol, 'open_interest', 49)
+        if len(oi):
+            current=float(oi['sum_open_interest_value'][-1]); sentiment_data["current_oi_binance"]=current
+            if len(oi)>=49:
+                prev=float(oi['sum_open_interest_value'][-49])
                 sentiment_data["oi_change_4h_percent"]=((current-prev)/prev)*100 if prev!=0 else 0
     except Exception as e: print(f"Error fetching OI change data: {e}")
     try:
-        oi_hist_url = f"https://fapi.binance.com/futures/data/openInterestHist?symbol={ticker}&period={period_oi}&limit={limit_oi}"
-        df = pd.DataFrame(requests.get(oi_hist_url, timeout=10).json())
-        if not df.empty:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            sentiment_data["open_interest_history"] = {"timestamps": df['timestamp'].dt.strftime('%d-%b %H:%M').tolist(), "values": pd.to_numeric(df['sumOpenInterestValue']).tolist()}
+        df = store_points(symbol, 'open_interest', 4 * HOUR_MS, limit_oi)
+        if not df.empty: sentiment_data["open_interest_history"] = series_rows(df, 'sum_open_interest_value', since)
     except Exception as e: print(f"Error fetching OI history: {e}")
     try:
-        ls_url = f"https://fapi.binance.com/futures/data/globalLongShortAccountRatio?symbol={ticker}&period={period_ls}&limit={limit_ls}"
-        df = pd.DataFrame(requests.get(ls_url, timeout=10).json())
-        if not df.empty:
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            sentiment_data["long_short_ratio"] = {"timestamps": df['timestamp'].dt.strftime('%d-%b %H:%M').tolist(), "values": pd.to_numeric(df['longShortRatio']).tolist()}
+        df = store_points(symbol, 'long_short', HOUR_MS, limit_ls)
+        if not df.empty: sentiment_data["long_short_ratio"] = series_rows(df, 'long_short_ratio', since)
     except Exception as e: print(f"Error fetching Long/Short ratio: {e}")
     return sentiment_data
 
-def get_binance_funding_info(symbol='BTC'):
-    ticker=f"{symbol.upper()}USDT"; url=f"https://fapi.binance.com/fapi/v1/premiumIndex?symbol={ticker}"
+def get_binance_funding_rate_history(symbol='BTC', limit=100, since=None):
     try:
-        data=requests.get(url, timeout=5).json()
-        return {"current_funding_rate":float(data.get('lastFundingRate',0.0)), "next_funding_time_ms":int(data.get('nextFundingTime',0)), "mark_price":float(data.get('markPrice',0.0))}
-    except Exception: return None
-
-def get_binance_funding_rate_history(symbol='BTC', limit=100):
-    ticker = f"{symbol.upper()}USDT"
-    url = f"https://fapi.binance.com/fapi/v1/fundingRate?symbol={ticker}&limit={limit}"
-    try:
-        df = pd.DataFrame(requests.get(url, timeout=10).json()).sort_values('fundingTime')
-        df['fundingTime'] = pd.to_datetime(df['fundingTime'], unit='ms')
-        return {"timestamps": df['fundingTime'].dt.strftime('%d-%b %H:%M').tolist(), "funding_rates": pd.to_numeric(df['fundingRate']).tolist()}
+        funding = default_sentiment_store().last(symbol, 'funding', limit)
+        df, last_ms = series_since(pd.DataFrame({'timestamp': funding['timestamp'], 'funding_rate': funding['funding_rate']}), 'timestamp', since)
+        return {"timestamps": pd.to_datetime(df['timestamp'], unit='ms').dt.strftime('%d-%b %H:%M').tolist(), "funding_rates": df['funding_rate'].to_numpy(), "last_timestamp": last_ms}
     except Exception as e: print(f"Error funding history: {e}"); return None
 
 def get_deribit_order_book(currency='BTC', depth=1000, step=0):
-    instrument_name=f"{currency.upper()}-PERPETUAL"; url=f"https://www.deribit.com/api/v2/public/get_order_book?instrument_name={instrument_name}&depth={depth}"
+    # Libro local en memoria (snapshot + cambios incrementales) en lugar de un snapshot REST por petición
+    instrument_name=f"{currency.upper()}-PERPETUAL"
     try:
-        response=requests.get(url, timeout=10); response.raise_for_status(); data=response.json().get('result',{})
-        bids_raw, asks_raw=data.get('bids',[]), data.get('asks',[])
-        if step<=0:
-            return {"bids":[{"price":p,"quantity":q} for p,q in bids_raw], "asks":[{"price":p,"quantity":q} for p,q in asks_raw]}
-        def aggregate_orders(orders, step_size):
-            step_dec, aggregated=Decimal(str(step_size)), defaultdict(Decimal)
-            for price, quantity in orders:
-                price_dec, quantity_dec=Decimal(str(price)), Decimal(str(quantity))
-                bucket_price_dec=(price_dec//step_dec)*step_dec
-                aggregated[bucket_price_dec]+=quantity_dec
-            return [{"price":float(p),"quantity":float(q)} for p,q in aggregated.items()]
-        bids_agg=sorted(aggregate_orders(bids_raw,step), key=lambda i:i['price'], reverse=True)
-        asks_agg=sorted(aggregate_orders(asks_raw,step), key=lambda i:i['price'])
-        return {"bids":bids_agg, "asks":asks_agg}
+        # Escalera precalculada por versión del libro: cambiar de step no recalcula nada
+        ladder=default_book_manager().book(instrument_name).aggregated(step if step>0 else 0, round_up_asks=False)
+        def side_rows(side):
+            prices, amounts, cumulative=(side[k][:depth].tolist() for k in ('price','amount','cumulative'))
+            return [{"price":p,"quantity":q,"cumulative":c} for p,q,c in zip(prices, amounts, cumulative)]
+        return {"bids":side_rows(ladder['bids']), "asks":side_rows(ladder['asks'])}
     except Exception as e:
         print(f"Error al obtener Libro de Órdenes de Deribit: {e}"); traceback.print_exc(); return None
 
 # ==============================================================================
 # SECCIÓN 4: CONFIGURACIÓN DE FLASK Y RUTAS API
 # ==============================================================================
-class NumpyJSONProvider(JSONProvider):
-    def dumps(self, obj, **kwargs):
-        kwargs.setdefault("default",self.default); return json.dumps(obj, **kwargs)
-    def default(self, obj):
-        if isinstance(obj, (numpy.integer, numpy.int64)): return int(obj)
-        if isinstance(obj, (numpy.floating, numpy.float64)): return float(obj)
-        if isinstance(obj, numpy.ndarray): return obj.tolist()
-        if isinstance(obj, Decimal): return float(obj)
-        return super(NumpyJSONProvider, self).default(obj)
-
 app=Flask(__name__); app.json=NumpyJSONProvider(app); CORS(app);
 
-DATA_CACHE = {}
-CACHE_EXPIRY_SECONDS = 300 # Expiración de 5 minutos
+# Caché única (thread-safe, acotada y de una sola descarga por clave) compartida con VolatilityService
+DATA = default_derivatives_data()
 
-def get_data(currency):
-    now = datetime.now(timezone.utc)
-    cache_entry = DATA_CACHE.get(currency)
+def get_data(currency, chain=None):
+    # Cadena como DataFrame con los tipos de siempre ('C'/'P' y strike entero), calculado una vez por snapshot
+    chain = chain if chain is not None else DATA.options_chain(currency)
+    if chain is None: return None
+    def frame():
+        df = chain.memoize(('frame',), chain.to_frame).astype({'type': str, 'mark_iv': 'float64'})
+        df['strike'] = df['strike'].astype(int); return df
+    return chain.memoize(('sentiment_frame',), frame)
 
-    # Si no hay entrada en caché o si la entrada ha expirado, obtener nuevos datos
-    if not cache_entry or (now - cache_entry['timestamp']).total_seconds() > CACHE_EXPIRY_SECONDS:
-        print(f"Cache para {currency} expirada o no existente. Obteniendo nuevos datos de Deribit...")
-        df = get_deribit_option_data(currency)
-        if df is not None:
-            DATA_CACHE[currency] = {'data': df, 'timestamp': now}
-        return df 
-    
-    print(f"Usando datos de la caché para {currency}.")
-    return cache_entry['data']
+def data_version(currency):
+    # Versión de la cadena compartida (cambia con cada snapshot descargado)
+    chain = DATA.options_chain(currency.upper())
+    return chain.version if chain is not None else None
+
+def book_version(symbol):
+    # Solo libros ya abiertos: la comprobación del ETag no arranca feeds (None = ETag por contenido)
+    book = default_book_manager().peek(f"{symbol.upper()}-PERPETUAL")
+    return book.version if book is not None else None
 
 @app.route("/api/data/<currency>", methods=["GET"])
+@versioned(data_version)
 def get_filtered_data(currency):
     exp_date_str = request.args.get('expiration', None)
-    full_df = get_data(currency.upper())
+    chain = DATA.options_chain(currency.upper()); full_df = get_data(currency.upper(), chain)
     if full_df is None: return jsonify({"error":"No se pudieron obtener datos"}), 500
-    df = full_df[full_df['expiration_date'] == pd.to_datetime(exp_date_str)].copy() if exp_date_str and exp_date_str != 'all' else full_df.copy()
-    metrics = calculate_deribit_metrics(df)
-    oi_by_strike=df.groupby(['strike','type'])['open_interest'].sum().unstack(fill_value=0)
-    oi_by_strike.rename(columns={'C':'Calls','P':'Puts'}, inplace=True); strike_chart=oi_by_strike.reset_index().to_dict('records')
-    oi_by_exp=full_df.groupby('expiration_date')['open_interest'].sum().sort_index()
-    exp_chart=pd.DataFrame({'date':oi_by_exp.index.strftime('%d-%b-%Y'),'open_interest':oi_by_exp.values}).to_dict('records')
+    # Las filas de cada vencimiento son un rango contiguo de la cadena: se recorta sin máscara
+    df = full_df.iloc[chain.expiry_slice(exp_date_str)] if exp_date_str and exp_date_str != 'all' else full_df
+    # OI y volumen por strike/vencimiento y max pain: agregados que solo se actualizan en las filas que cambian entre snapshots
+    aggregates = DATA.chain_aggregates(chain); view = chain.for_expiry(exp_date_str) if exp_date_str and exp_date_str != 'all' else chain
+    metrics = calculate_deribit_metrics(view, aggregates); by_strike = aggregates.by_strike(view)
+    strike_chart = pd.DataFrame({'strike': by_strike['strike'], 'Calls': by_strike['call_oi'], 'Puts': by_strike['put_oi']}).to_dict('records')
+    exp_dates, exp_oi = aggregates.by_expiry()
+    exp_chart=pd.DataFrame({'date':pd.DatetimeIndex(exp_dates).strftime('%d-%b-%Y'),'open_interest':exp_oi}).to_dict('records')
     volatility_smile_data=[]
     if exp_date_str and exp_date_str!='all' and not df.empty:
         calls_iv = df[df['type'] == 'C'][['strike', 'mark_iv']].rename(columns={'mark_iv': 'call_iv'})
@@ -232,21 +148,21 @@ def get_filtered_data(currency):
         iv_data = pd.merge(calls_iv, puts_iv, on='strike', how='outer').sort_values(by='strike')
         iv_data = iv_data.where(pd.notnull(iv_data), None)
         volatility_smile_data = iv_data.to_dict('records')
-    volume_by_strike = df.groupby(['strike', 'type'])['volume'].sum().unstack(fill_value=0)
-    volume_by_strike.rename(columns={'C':'Calls_Volume', 'P':'Puts_Volume'}, inplace=True)
-    volume_chart_data = volume_by_strike.reset_index().to_dict('records')
+    volume_chart_data = pd.DataFrame({'strike': by_strike['strike'], 'Calls_Volume': by_strike['call_volume'], 'Puts_Volume': by_strike['put_volume']}).to_dict('records')
     return jsonify({"metrics":metrics, "strike_chart_data":strike_chart, "expiration_chart_data":exp_chart, "volatility_smile_data":volatility_smile_data, "volume_chart_data": volume_chart_data})
 
 @app.route("/api/dvol-history/<currency>", methods=["GET"])
+@versioned()
 def get_dvol_history_endpoint(currency):
     days = request.args.get('days', 90, type=int)
-    data = get_deribit_dvol_history(currency.upper(), days=days)
+    data = get_deribit_dvol_history(currency.upper(), days=days, since=since_param())
     return jsonify(data) if data else (jsonify({"error": "No se pudieron obtener datos de DVOL"}), 500)
     
 @app.route("/api/consolidated-metrics/<symbol>", methods=["GET"])
+@versioned()
 def get_consolidated_metrics(symbol):
-    deribit_df, binance_sentiment, binance_funding_info, weekly_stats = get_data(symbol.upper()), get_binance_sentiment_data(symbol.upper()), get_binance_funding_info(symbol.upper()), get_binance_klines(symbol.upper())
-    deribit_metrics = calculate_deribit_metrics(deribit_df) if deribit_df is not None else {}
+    chain, binance_sentiment, binance_funding_info, weekly_stats = DATA.options_chain(symbol.upper()), get_binance_sentiment_data(symbol.upper()), DATA.funding_info(symbol.upper()), DATA.weekly_stats(symbol.upper())
+    deribit_metrics = calculate_deribit_metrics(chain) if chain is not None else {}
     oi_deribit_usd = deribit_metrics.get("notional_value_usd", 0)
     oi_binance_usd = binance_sentiment.get("current_oi_binance", 0) if binance_sentiment else 0
     total_oi_avg = (oi_deribit_usd + oi_binance_usd) / 2 if (oi_deribit_usd or oi_binance_usd) else 0
@@ -254,24 +170,28 @@ def get_consolidated_metrics(symbol):
     return jsonify({"oi_total_average":total_oi_avg, "oi_change_4h_percent":binance_sentiment.get("oi_change_4h_percent") if binance_sentiment else None, "funding_rate_average":binance_funding_info.get("current_funding_rate", 0.0) if binance_funding_info else 0.0, "next_funding_time_ms":binance_funding_info.get("next_funding_time_ms", 0) if binance_funding_info else 0, "deribit_max_pain":deribit_metrics.get("max_pain", 0), "current_price":binance_funding_info.get("mark_price", 0.0) if binance_funding_info else 0.0, "week_high":weekly_stats.get("week_high", 0) if weekly_stats else 0, "week_high_date":format_timestamp(weekly_stats.get("week_high_timestamp")) if weekly_stats else None, "week_low":weekly_stats.get("week_low", 0) if weekly_stats else 0, "week_low_date":format_timestamp(weekly_stats.get("week_low_timestamp")) if weekly_stats else None})
 
 @app.route("/api/order-book/<symbol>", methods=["GET"])
+@versioned(book_version)
 def get_order_book_endpoint(symbol):
     depth, step = request.args.get('depth', 1000, type=int), request.args.get('step', 0, type=float)
     data = get_deribit_order_book(symbol.upper(), depth, step)
     return jsonify(data) if data else (jsonify({"error":"No se pudo obtener el Libro de Órdenes de Deribit"}), 500)
 
 @app.route("/api/sentiment/<symbol>", methods=["GET"])
+@versioned()
 def get_sentiment_data_endpoint(symbol):
     limit = request.args.get('limit', 48, type=int)
-    data = get_binance_sentiment_data(symbol.upper(), limit_oi=limit, limit_ls=limit)
+    data = get_binance_sentiment_data(symbol.upper(), limit_oi=limit, limit_ls=limit, since=since_param())
     return jsonify(data) if data else (jsonify({"error": "No se pudieron obtener datos"}), 500)
     
 @app.route("/api/funding-rate-history/<symbol>", methods=["GET"])
+@versioned()
 def get_funding_rate_history_endpoint(symbol):
     limit = request.args.get('limit', 100, type=int)
-    data = get_binance_funding_rate_history(symbol.upper(), limit=limit)
+    data = get_binance_funding_rate_history(symbol.upper(), limit=limit, since=since_param())
     return jsonify(data) if data else (jsonify({"error": "No se pudieron obtener datos"}), 500)
 
 @app.route("/api/expirations/<currency>", methods=["GET"])
+@versioned(data_version)
 def get_expirations(currency):
     df = get_data(currency.upper());
     if df is None: return jsonify({"error":"No se pudieron obtener datos"}), 500
@@ -0,0 +1,71 @@
+"""
+Respuestas condicionales para los endpoints que se consultan periódicamente:
+ETag a partir de la versión de los datos, 304 con If-None-Match y since= en series
+"""
+import hashlib
+from functools import wraps
+
+import pandas as pd
+from flask import make_response, request
+
+
+def etag_for(*parts):
+    """ETag estable a partir de la ruta, los parámetros y la versión de los datos"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+
+
+def versioned(version_fn=None):
+    """
+    Decorador de rutas JSON con ETag e If-None-Match.
+
+    Si se da version_fn (recibe los mismos argumentos que la vista y devuelve la
+    versión de los datos, o None si no se conoce), el 304 se responde sin llegar
+    a construir ni serializar la respuesta. Sin versión, el ETag es el hash del
+    cuerpo: se ahorra el envío pero no el cálculo.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = None
+            if version_fn is not None:
+                try:
+                    version = version_fn(*args, **kwargs)
+                    if version is not None:
+                        tag = etag_for(request.full_path, version)
+                except Exception as e:
+                    print(f"Error obteniendo la versión de {request.path}: {e}")
+            if tag is not None and request.if_none_match.contains(tag):
+                response = make_response('', 304)
+                response.set_etag(tag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or not response.is_json:
+                return response
+            if tag is not None:
+                response.set_etag(tag)
+            else:
+                response.add_etag()
+            # El navegador puede guardar la respuesta pero debe revalidarla siempre
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def since_param(name='since'):
+    """
+    Parámetro since= de la petición en ms epoch (acepta ms o fecha ISO)
+
+    Returns:
+        int o None si no se indicó
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return int(ts.timestamp() * 1000)
@@ -0,0 +1,115 @@
+"""
+Canal de eventos en memoria (alertas) y su difusión por Server-Sent Events
+"""
+import threading
+import time
+from collections import deque
+
+from modules.api.json_provider import dumps_bytes
+from modules.replay.clock import now_ms as clock_ms
+
+DEFAULT_HISTORY = 1000
+# Segundos sin eventos antes de enviar un comentario que mantiene viva la conexión
+HEARTBEAT_SECONDS = 15
+# Milisegundos que espera el navegador antes de reconectar
+RETRY_MS = 5000
+
+
+class EventBus:
+    """
+    Historial acotado de eventos con ids consecutivos. Los suscriptores no
+    tienen cola propia: recuerdan el último id recibido y esperan en una
+    Condition a que se publique uno posterior, así un cliente lento o
+    desconectado no retiene memoria y al reconectar recupera lo que siga en
+    el historial (cabecera Last-Event-ID).
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY):
+        self._events = deque(maxlen=history)
+        self._next_id = 1
+        self._condition = threading.Condition()
+
+    @property
+    def last_id(self):
+        return self._next_id - 1
+
+    def publish(self, channel, data):
+        """Publica un evento y despierta a los suscriptores"""
+        with self._condition:
+            event = {'id': self._next_id, 'channel': channel, 'timestamp': clock_ms(), 'data': data}
+            self._next_id += 1
+            self._events.append(event)
+            self._condition.notify_all()
+        return event
+
+    def _after(self, last_id, channels=None):
+        # Ids consecutivos: la posición en el historial se calcula sin recorrerlo
+        if not self._events:
+            return []
+        start = max(0, int(last_id) + 1 - self._events[0]['id'])
+        events = [self._events[i] for i in range(start, len(self._events))]
+        if channels:
+            events = [event for event in events if event['channel'] in channels]
+        return events
+
+    def since(self, last_id=0, channels=None, limit=None):
+        """Eventos del historial posteriores a last_id (los más recientes si hay limit)"""
+        with self._condition:
+            events = self._after(last_id, channels)
+        return events[-limit:] if limit else events
+
+    def wait(self, last_id, timeout=None, channels=None):
+        """
+        Bloquea hasta que haya eventos posteriores a last_id (o vence timeout)
+
+        Returns:
+            (eventos de los canales pedidos, id hasta el que se ha leído)
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.last_id > last_id, timeout)
+            return self._after(last_id, channels), max(int(last_id), self.last_id)
+
+
+def sse_message(event):
+    """Evento en formato text/event-stream"""
+    return (f"id: {event['id']}\nevent: {event['channel']}\n"
+            f"data: {dumps_bytes(event).decode('utf-8')}\n\n")
+
+
+def sse_stream(bus, last_id=None, channels=None, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Generador de la respuesta SSE de un suscriptor
+
+    Args:
+        bus: EventBus
+        last_id: Último id recibido por el cliente (None = solo eventos nuevos)
+        channels: Canales a enviar (por defecto, todos)
+        heartbeat: Segundos entre comentarios de keepalive
+    """
+    channels = set(channels) if channels else None
+    # Un id mayor que el último publicado (p.ej. tras reiniciar el servidor) se trata como nuevo
+    cursor = bus.last_id if last_id is None else min(int(last_id), bus.last_id)
+    yield f"retry: {RETRY_MS}\n\n"
+    idle_since = time.monotonic()
+    while True:
+        events, cursor = bus.wait(cursor, heartbeat, channels)
+        for event in events:
+            yield sse_message(event)
+        if events:
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since >= heartbeat:
+            yield ": keepalive\n\n"
+            idle_since = time.monotonic()
+
+
+_default_bus = None
+_default_bus_lock = threading.Lock()
+
+
+def default_event_bus():
+    """Canal de eventos compartido por los servicios y las rutas SSE"""
+    global _default_bus
+    with _default_bus_lock:
+        if _default_bus is None:
+            _default_bus = EventBus()
+        return _default_bus
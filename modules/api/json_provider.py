@@ -0,0 +1,102 @@
+"""
+Serialización JSON de las dos apps Flask con orjson: arrays y escalares de
+NumPy, columnas de pandas y fechas se escriben en C, sin pasar valor a valor
+por Python
+"""
+import dataclasses
+from datetime import date
+from decimal import Decimal
+
+import numpy as np
+import orjson
+import pandas as pd
+from flask.json.provider import JSONProvider
+
+# Arrays y escalares de NumPy nativos; NaN e inf se escriben como null
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _array(values):
+    """Array que orjson no escribe directamente (no contiguo, float16, objetos...)"""
+    if values.dtype.kind in 'biuf' and values.dtype != np.float16 and not values.flags.c_contiguous:
+        return np.ascontiguousarray(values)
+    if values.dtype.kind == 'f':
+        values = values.astype(np.float64)
+        return np.where(np.isnan(values), None, values).tolist()
+    if values.dtype.kind == 'M':
+        return np.datetime_as_string(values).tolist()
+    return values.tolist()
+
+
+def to_json_value(obj):
+    """
+    Conversión de los tipos que orjson no admite (se llama una vez por objeto,
+    no por elemento: una columna de pandas se entrega como array)
+    """
+    if isinstance(obj, np.ndarray):
+        return _array(obj)
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return _array(obj.to_numpy())
+    if isinstance(obj, pd.DataFrame):
+        return obj.to_dict('records')
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (pd.Timestamp, date)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _plain_keys(obj):
+    """Copia de dicts/listas anidados con las claves convertidas (escalares de NumPy, Timestamps...)"""
+    if isinstance(obj, dict):
+        return {(key if isinstance(key, (str, int, float, bool)) or key is None else to_json_value(key)): _plain_keys(value)
+                for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain_keys(value) for value in obj]
+    return obj
+
+
+def dumps_bytes(obj, option=0):
+    """
+    JSON en bytes (option: opciones de orjson añadidas a ORJSON_OPTIONS). Si
+    orjson rechaza alguna clave de dict (p.ej. un escalar de NumPy) se reintenta
+    una vez con las claves convertidas.
+    """
+    option |= ORJSON_OPTIONS
+    try:
+        return orjson.dumps(obj, default=to_json_value, option=option)
+    except orjson.JSONEncodeError:
+        return orjson.dumps(_plain_keys(obj), default=to_json_value, option=option)
+
+
+def orjson_option(indent=None, sort_keys=False, **kwargs):
+    """Opciones de orjson equivalentes a los argumentos de json.dumps (orjson solo indenta a 2)"""
+    option = 0
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return option
+
+
+class NumpyJSONProvider(JSONProvider):
+    """Proveedor JSON de Flask basado en orjson (jsonify, request.get_json...)"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj, orjson_option(**kwargs)).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # El cuerpo se entrega en bytes, sin decodificar y volver a codificar
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
@@ -0,0 +1,66 @@
+"""
+Montaje del backend del módulo de sentimiento dentro de la app principal, para
+que las dos apps compartan proceso y, con él, la capa de datos de derivados
+"""
+import importlib.util
+import os
+
+from werkzeug.exceptions import NotFound
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+SENTIMENT_BACKEND = os.path.join(REPO_ROOT, 'modules', 'Sentimiento-de-Mercado-y-Vencimientos 0.07.40',
+                                 'backend', 'app.py')
+
+
+def _matches(url_map, environ):
+    """True si la ruta existe en url_map (aunque sea con otro método o redirección)"""
+    try:
+        url_map.bind_to_environ(environ).match()
+        return True
+    except NotFound:
+        return False
+    except Exception:
+        return True
+
+
+class FallbackDispatcher:
+    """
+    WSGI: las rutas de la app principal tienen prioridad; lo que no existe en
+    ella pero sí en la secundaria lo atiende la secundaria
+    """
+
+    def __init__(self, app, fallback):
+        self.app = app
+        self.fallback = fallback
+        self.wsgi_app = app.wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not _matches(self.app.url_map, environ) and _matches(self.fallback.url_map, environ):
+            return self.fallback.wsgi_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def load_sentiment_app(path=SENTIMENT_BACKEND):
+    """Carga la app Flask del módulo de sentimiento (su ruta tiene espacios: no es un paquete importable)"""
+    spec = importlib.util.spec_from_file_location('sentiment_backend', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.app
+
+
+def mount_sentiment_backend(app):
+    """
+    Sirve las rutas del backend de sentimiento (/api/data, /api/sentiment...)
+    desde la app principal. Desactivable con TRADINGROAD_MOUNT_SENTIMENT=0.
+
+    Returns:
+        True si se ha montado
+    """
+    if os.getenv('TRADINGROAD_MOUNT_SENTIMENT', '1') == '0':
+        return False
+    try:
+        app.wsgi_app = FallbackDispatcher(app, load_sentiment_app())
+        return True
+    except Exception as e:
+        print(f"Error montando el backend de sentimiento: {e}")
+        return False
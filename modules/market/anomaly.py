@@ -0,0 +1,358 @@
+"""
+Detector de anomalías (picos de open interest, funding y precio, y
+liquidaciones en cascada) sobre todos los perpetuos USDT, alimentado con
+consultas masivas: una por fuente y ciclo, no una por símbolo
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+from modules.api.events import default_event_bus
+from modules.replay.clock import now_ms as clock_ms
+from modules.replay.http import http_session
+from modules.volatility.sentiment_store import BINANCE_FUTURES_URL
+
+BYBIT_URL = "https://api.bybit.com"
+SETTLE_CURRENCY = 'USDT'
+ANOMALY_CHANNEL = 'anomaly'
+
+# Métrica -> desviación típica mínima de su cambio por ciclo (evita z enormes
+# en series casi planas: funding que no se mueve, OI de contratos ilíquidos...)
+ANOMALY_METRICS = {
+    'price': 2e-4,          # rendimiento logarítmico
+    'funding': 2e-5,        # diferencia del funding por periodo
+    'open_interest': 5e-4,  # cambio logarítmico del OI en contratos
+}
+DEFAULT_Z_THRESHOLD = 4.0
+# Vida media (en ciclos) de la media y la varianza exponenciales
+DEFAULT_HALF_LIFE = 60
+# Ciclos con datos antes de poder marcar anomalías en un símbolo
+WARMUP_CYCLES = 30
+# Ciclos sin volver a avisar de la misma métrica en el mismo símbolo
+COOLDOWN_CYCLES = 5
+# Un hueco de más de estos intervalos entre consultas no se compara con la anterior
+MAX_GAP_INTERVALS = 3
+
+
+def fetch_binance_premium_index():
+    """
+    Precio de marca y funding actual de todos los perpetuos USDT de Binance
+    (premiumIndex sin símbolo: una sola llamada)
+
+    Returns:
+        Dict símbolo base -> (mark_price, funding_rate)
+    """
+    response = http_session().get(f"{BINANCE_FUTURES_URL}/fapi/v1/premiumIndex", timeout=10)
+    response.raise_for_status()
+    result = {}
+    for item in response.json():
+        symbol = item.get('symbol', '')
+        # Los contratos con vencimiento llevan sufijo (BTCUSDT_250328) y no tienen funding
+        if not symbol.endswith(SETTLE_CURRENCY) or '_' in symbol or item.get('lastFundingRate') in (None, ''):
+            continue
+        result[symbol[:-len(SETTLE_CURRENCY)]] = (float(item['markPrice']), float(item['lastFundingRate']))
+    return result
+
+
+def fetch_bybit_open_interest():
+    """
+    Open interest (en contratos) de todos los perpetuos lineales USDT de Bybit.
+    Binance solo publica el OI símbolo a símbolo; los tickers de Bybit lo
+    incluyen para todo el universo en una llamada.
+
+    Returns:
+        Dict símbolo base -> open interest
+    """
+    response = http_session().get(f"{BYBIT_URL}/v5/market/tickers", params={'category': 'linear'}, timeout=10)
+    response.raise_for_status()
+    payload = response.json()
+    if payload.get('retCode') not in (0, None):
+        raise ValueError(f"Bybit: {payload.get('retMsg')}")
+    result = {}
+    for item in payload.get('result', {}).get('list', []):
+        symbol = item.get('symbol', '')
+        # Los futuros con vencimiento de Bybit llevan guion (BTCUSDT-27DEC24)
+        if not symbol.endswith(SETTLE_CURRENCY) or '-' in symbol or not item.get('openInterest'):
+            continue
+        result[symbol[:-len(SETTLE_CURRENCY)]] = float(item['openInterest'])
+    return result
+
+
+def build_snapshot(premium, open_interest, timestamp=None):
+    """
+    Snapshot del universo alineado por símbolo (NaN donde una fuente no lo cotiza)
+
+    Args:
+        premium: Dict símbolo -> (mark_price, funding_rate)
+        open_interest: Dict símbolo -> open interest
+    """
+    symbols = sorted(set(premium) | set(open_interest))
+    price = np.full(len(symbols), np.nan)
+    funding = np.full(len(symbols), np.nan)
+    oi = np.full(len(symbols), np.nan)
+    for i, symbol in enumerate(symbols):
+        if symbol in premium:
+            price[i], funding[i] = premium[symbol]
+        oi[i] = open_interest.get(symbol, np.nan)
+    price[price <= 0] = np.nan
+    oi[oi <= 0] = np.nan
+    return {
+        'timestamp': clock_ms() if timestamp is None else int(timestamp),
+        'symbols': symbols,
+        'price': price,
+        'funding': funding,
+        'open_interest': oi,
+    }
+
+
+class EwmaMoments:
+    """
+    Media y varianza exponenciales de muchas series a la vez (una por slot).
+    Cada actualización es O(1) por serie: no se guarda ninguna ventana.
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, floor=0.0, warmup=WARMUP_CYCLES):
+        self.alpha = 1.0 - 0.5 ** (1.0 / half_life)
+        self.floor = floor
+        self.warmup = warmup
+        self.mean = np.zeros(0)
+        self.var = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+
+    def grow(self, size):
+        extra = size - len(self.mean)
+        if extra > 0:
+            self.mean = np.r_[self.mean, np.zeros(extra)]
+            self.var = np.r_[self.var, np.zeros(extra)]
+            self.count = np.r_[self.count, np.zeros(extra, dtype=np.int64)]
+
+    def update(self, slots, values, clip=None):
+        """
+        Añade un valor a cada serie de slots (los NaN se ignoran)
+
+        Args:
+            slots: Posiciones de las series (sin repetidos)
+            values: Valores alineados con slots
+            clip: Si se indica, el valor entra en las estadísticas recortado a
+                ±clip desviaciones para que un pico no insensibilice la serie
+
+        Returns:
+            z-score de cada valor frente a las estadísticas previas
+            (NaN si no es finito o la serie no ha completado el calentamiento)
+        """
+        z = np.full(len(values), np.nan)
+        valid = np.isfinite(values)
+        if not valid.any():
+            return z
+        s, x = slots[valid], values[valid]
+        n, mean, var = self.count[s], self.mean[s], self.var[s]
+        std = np.maximum(np.sqrt(var), self.floor)
+        ready = n >= self.warmup
+        z[valid] = np.where(ready, (x - mean) / std, np.nan)
+
+        if clip is not None:
+            x = np.where(ready, np.clip(x, mean - clip * std, mean + clip * std), x)
+        # Hasta acumular ~1/alpha valores el peso es 1/(n+1): media y varianza
+        # exactas de lo visto (sin el sesgo hacia cero de arrancar en 0)
+        weight = np.maximum(self.alpha, 1.0 / (n + 1))
+        diff = x - mean
+        increment = weight * diff
+        self.mean[s] = mean + increment
+        self.var[s] = (1.0 - weight) * (var + diff * increment)
+        self.count[s] = n + 1
+        return z
+
+
+class AnomalyDetector:
+    """
+    En cada ciclo consulta el universo completo (premiumIndex de Binance y
+    tickers lineales de Bybit), calcula por símbolo el cambio de precio, de
+    funding y de OI desde el ciclo anterior y lo compara con la media y la
+    varianza exponenciales de ese símbolo. Los cambios con |z| por encima del
+    umbral se publican en el canal 'anomaly' del bus de eventos; una caída
+    fuerte de OI con un movimiento brusco de precio se publica como
+    liquidación (de largos si el precio cae, de cortos si sube).
+    """
+
+    def __init__(self, bus=None, z_threshold=DEFAULT_Z_THRESHOLD, half_life=DEFAULT_HALF_LIFE,
+                 warmup=WARMUP_CYCLES, cooldown=COOLDOWN_CYCLES):
+        self.bus = bus or default_event_bus()
+        self.z_threshold = z_threshold
+        self.cooldown = cooldown
+        self.interval_seconds = 60
+        self.symbols = []
+        self._slots = {}
+        self._stats = {metric: EwmaMoments(half_life, floor, warmup) for metric, floor in ANOMALY_METRICS.items()}
+        self._levels = {metric: np.zeros(0) for metric in ANOMALY_METRICS}
+        self._last_alert = {metric: np.zeros(0, dtype=np.int64) for metric in ANOMALY_METRICS}
+        self.cycles = 0
+        self.last_poll = None
+        self.last_errors = {}
+        self.elapsed_ms = None
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stop = threading.Event()
+
+    def _slots_for(self, symbols):
+        """Posición de cada símbolo en los arrays de estado (se amplían con los nuevos listados)"""
+        for symbol in symbols:
+            if symbol not in self._slots:
+                self._slots[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        size = len(self.symbols)
+        for metric in ANOMALY_METRICS:
+            self._stats[metric].grow(size)
+            extra = size - len(self._levels[metric])
+            if extra > 0:
+                self._levels[metric] = np.r_[self._levels[metric], np.full(extra, np.nan)]
+                self._last_alert[metric] = np.r_[self._last_alert[metric], np.full(extra, -self.cooldown - 1)]
+        return np.fromiter((self._slots[symbol] for symbol in symbols), dtype=np.intp, count=len(symbols))
+
+    def update(self, snapshot):
+        """
+        Procesa un snapshot del universo (ver build_snapshot)
+
+        Returns:
+            Lista de eventos publicados en el bus
+        """
+        with self._lock:
+            slots = self._slots_for(snapshot['symbols'])
+            gap = (self.last_poll is not None
+                   and snapshot['timestamp'] - self.last_poll > MAX_GAP_INTERVALS * self.interval_seconds * 1000)
+
+            current, previous, changes = {}, {}, {}
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for metric in ANOMALY_METRICS:
+                    current[metric] = np.asarray(snapshot[metric], dtype=np.float64)
+                    previous[metric] = self._levels[metric][slots]
+                    if metric == 'funding':
+                        changes[metric] = current[metric] - previous[metric]
+                    else:
+                        changes[metric] = np.log(current[metric] / previous[metric])
+                    if gap:
+                        changes[metric][:] = np.nan
+                    # Si una fuente falta en este ciclo se conserva el último nivel conocido
+                    known = np.isfinite(current[metric])
+                    self._levels[metric][slots[known]] = current[metric][known]
+
+            z = {metric: self._stats[metric].update(slots, changes[metric], clip=self.z_threshold)
+                 for metric in ANOMALY_METRICS}
+            self.cycles += 1
+            self.last_poll = snapshot['timestamp']
+
+            cycle = self.cycles
+            flagged = {}
+            for metric in ANOMALY_METRICS:
+                cooled = cycle - self._last_alert[metric][slots] > self.cooldown
+                flagged[metric] = (np.abs(np.nan_to_num(z[metric])) >= self.z_threshold) & cooled
+
+            # Caída de OI con movimiento de precio de al menos medio umbral: cierre forzoso de posiciones
+            price_z = np.nan_to_num(z['price'])
+            liquidation = flagged['open_interest'] & (z['open_interest'] < 0) & (np.abs(price_z) >= self.z_threshold / 2)
+
+            events = []
+            for i in np.nonzero(liquidation)[0]:
+                events.append(self._event('liquidation', snapshot, i, 'open_interest', z, changes, current, previous))
+            for metric in ANOMALY_METRICS:
+                mask = flagged[metric] & ~liquidation
+                for i in np.nonzero(mask)[0]:
+                    events.append(self._event(metric, snapshot, i, metric, z, changes, current, previous))
+                self._last_alert[metric][slots[flagged[metric]]] = cycle
+            self._last_alert['price'][slots[liquidation]] = cycle
+
+        events.sort(key=lambda event: -abs(event['z']))
+        return [self.bus.publish(ANOMALY_CHANNEL, event) for event in events]
+
+    def _event(self, kind, snapshot, i, metric, z, changes, current, previous):
+        event = {
+            'kind': kind,
+            'symbol': snapshot['symbols'][i],
+            'metric': metric,
+            'direction': 'up' if changes[metric][i] > 0 else 'down',
+            'z': round(float(z[metric][i]), 2),
+            'change': float(changes[metric][i]),
+            'value': float(current[metric][i]),
+            'previous': float(previous[metric][i]),
+            'threshold': self.z_threshold,
+            'mark_price': _finite(current['price'][i]),
+            'funding_rate': _finite(current['funding'][i]),
+            'open_interest': _finite(current['open_interest'][i]),
+            'snapshot_time': snapshot['timestamp'],
+        }
+        if kind == 'liquidation':
+            event['side'] = 'long' if changes['price'][i] < 0 else 'short'
+            event['price_z'] = round(float(z['price'][i]), 2)
+            event['price_change'] = float(changes['price'][i])
+        return event
+
+    def poll(self):
+        """Un ciclo: consulta masiva de cada fuente y actualización de todos los símbolos"""
+        started = time.time()
+        sources = {'binance': fetch_binance_premium_index, 'bybit': fetch_bybit_open_interest}
+        data, errors = {}, {}
+        for name, fetch in sources.items():
+            try:
+                data[name] = fetch()
+            except Exception as e:
+                print(f"Error obteniendo el universo de perpetuos de {name}: {e}")
+                errors[name] = str(e)
+                data[name] = {}
+
+        self.last_errors = errors
+        if len(errors) == len(sources):
+            return []
+        events = self.update(build_snapshot(data['binance'], data['bybit']))
+        self.elapsed_ms = round((time.time() - started) * 1000.0, 1)
+        return events
+
+    def status(self):
+        """Estado del detector (universo, ciclos, último sondeo, errores)"""
+        warm = self._stats['price'].count >= self._stats['price'].warmup
+        return {
+            'running': self._worker is not None and self._worker.is_alive(),
+            'symbols': len(self.symbols),
+            'warm_symbols': int(np.count_nonzero(warm)),
+            'cycles': self.cycles,
+            'last_poll': self.last_poll,
+            'interval_seconds': self.interval_seconds,
+            'z_threshold': self.z_threshold,
+            'elapsed_ms': self.elapsed_ms,
+            'errors': self.last_errors,
+        }
+
+    def recent(self, symbols=None, kinds=None, since=0, limit=None):
+        """Eventos de anomalía del historial del bus, filtrados por símbolo y tipo"""
+        events = self.bus.since(since, channels={ANOMALY_CHANNEL})
+        if symbols:
+            events = [event for event in events if event['data']['symbol'] in symbols]
+        if kinds:
+            events = [event for event in events if event['data']['kind'] in kinds]
+        return events[-limit:] if limit else events
+
+    def start(self, interval_seconds=60):
+        """Arranca el sondeo periódico en segundo plano"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self.interval_seconds = interval_seconds
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"Error en el detector de anomalías: {e}")
+                self._stop.wait(interval_seconds)
+
+        self._stop.clear()
+        self._worker = threading.Thread(target=run, name='anomaly-detector', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _finite(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
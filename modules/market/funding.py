@@ -0,0 +1,300 @@
+"""
+Escáner de funding de perpetuos en varios exchanges (spreads y carry anualizado)
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ccxt
+import numpy as np
+
+from modules.replay.clock import now_ms as clock_ms
+from modules.replay.http import configure_session
+
+# Venue -> (clase de ccxt para perpetuos, opciones)
+FUNDING_VENUES = {
+    'binance': ('binanceusdm', {}),
+    'bybit': ('bybit', {'defaultType': 'swap'}),
+    'kucoin': ('kucoinfutures', {}),
+    'bingx': ('bingx', {'defaultType': 'swap'}),
+}
+# Intervalo estándar de Binance: /fapi/v1/fundingInfo solo lista los símbolos ajustados
+BINANCE_DEFAULT_INTERVAL_HOURS = 8.0
+# Segundos que se reutilizan los intervalos de funding cargados de un venue
+INTERVALS_TTL = 3600
+SETTLE_CURRENCY = 'USDT'
+
+
+def annualize(rate, interval_hours):
+    """Funding por periodo -> carry anualizado (en tanto por uno); None si no se conoce el intervalo"""
+    if interval_hours is None:
+        return None
+    return rate * (24.0 / interval_hours) * 365.0
+
+
+def configured_venues():
+    """Venues activos (TRADINGROAD_FUNDING_EXCHANGES=binance,bybit,...)"""
+    names = os.getenv('TRADINGROAD_FUNDING_EXCHANGES')
+    if not names:
+        return list(FUNDING_VENUES)
+    return [name.strip() for name in names.split(',') if name.strip() in FUNDING_VENUES]
+
+
+class FundingScanner:
+    """
+    Recoge en paralelo el funding actual y previsto de todos los perpetuos
+    lineales en USDT de cada venue, y calcula por símbolo el spread entre venues
+    y el carry anualizado. El resultado se cachea y puede refrescarse en segundo plano.
+    """
+
+    def __init__(self, venues=None, max_age=60):
+        self.venues = venues or configured_venues()
+        self.max_age = max_age
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._result = None
+        # venue -> (cargado en ms, {id de mercado: horas})
+        self._intervals = {}
+        self._worker = None
+        self._stop = threading.Event()
+
+    def _client(self, venue):
+        with self._clients_lock:
+            exchange = self._clients.get(venue)
+            if exchange is None:
+                class_name, options = FUNDING_VENUES[venue]
+                exchange = getattr(ccxt, class_name)({'enableRateLimit': True, 'timeout': 20000, 'options': options})
+                configure_session(exchange.session)
+                self._clients[venue] = exchange
+        exchange.load_markets()
+        return exchange
+
+    @staticmethod
+    def _row(venue, market, funding_rate, predicted_rate, interval_hours, next_time, mark_price):
+        return {
+            'venue': venue,
+            'symbol': market['base'],
+            'funding_rate': funding_rate,
+            'predicted_rate': predicted_rate,
+            # None si el venue no publica el intervalo: el carry anualizado queda sin calcular
+            'interval_hours': interval_hours or None,
+            'next_funding_time': next_time,
+            'mark_price': mark_price,
+        }
+
+    @staticmethod
+    def _is_usdt_perpetual(market):
+        return bool(market and market.get('swap') and market.get('linear') and market.get('settle') == SETTLE_CURRENCY)
+
+    def _binance_intervals(self, exchange):
+        """
+        Intervalo de funding por id de mercado de Binance (una llamada para
+        todos los símbolos, reutilizada INTERVALS_TTL segundos); None si falla
+        """
+        cached = self._intervals.get('binance')
+        if cached is not None and clock_ms() - cached[0] < INTERVALS_TTL * 1000:
+            return cached[1]
+        try:
+            intervals = {item['symbol']: float(item['fundingIntervalHours'])
+                         for item in exchange.fapiPublicGetFundingInfo() if item.get('fundingIntervalHours')}
+        except Exception as e:
+            print(f"Error obteniendo los intervalos de funding de Binance: {e}")
+            return cached[1] if cached is not None else None
+        self._intervals['binance'] = (clock_ms(), intervals)
+        return intervals
+
+    def _fetch_unified(self, venue, exchange):
+        binance_intervals = self._binance_intervals(exchange) if venue == 'binance' else None
+        rows = []
+        for symbol, item in exchange.fetch_funding_rates().items():
+            market = exchange.markets.get(symbol)
+            if not self._is_usdt_perpetual(market) or item.get('fundingRate') is None:
+                continue
+            if venue == 'binance':
+                interval_hours = (binance_intervals.get(market['id'], BINANCE_DEFAULT_INTERVAL_HOURS)
+                                  if binance_intervals is not None else None)
+            else:
+                # Bybit publica el intervalo en minutos en la definición del mercado
+                interval = market.get('info', {}).get('fundingInterval')
+                interval_hours = float(interval) / 60.0 if interval else None
+            rows.append(self._row(
+                venue, market, item['fundingRate'], item.get('nextFundingRate'), interval_hours,
+                item.get('fundingTimestamp') or item.get('nextFundingTimestamp'), item.get('markPrice')
+            ))
+        return rows
+
+    def _fetch_bingx(self, venue, exchange):
+        # premiumIndex sin símbolo devuelve todos los contratos en una sola llamada
+        response = exchange.swapV2PublicGetQuotePremiumIndex()
+        rows = []
+        for raw in response.get('data', []):
+            item = exchange.parse_funding_rate(raw)
+            market = exchange.markets.get(item['symbol'])
+            if not self._is_usdt_perpetual(market) or item.get('fundingRate') is None:
+                continue
+            # Intervalo del índice o de la definición del contrato (cargada con
+            # load_markets en una sola llamada); sin él, desconocido
+            interval = raw.get('fundingIntervalHours') or market.get('info', {}).get('fundingIntervalHours')
+            rows.append(self._row(venue, market, item['fundingRate'], None, float(interval) if interval else None,
+                                  item.get('nextFundingTimestamp'), item.get('markPrice')))
+        return rows
+
+    def _fetch_kucoin(self, venue, exchange):
+        # contracts/active incluye el funding actual y el previsto de todos los contratos
+        response = exchange.futuresPublicGetContractsActive()
+        now_ms = clock_ms()
+        rows = []
+        for raw in response.get('data', []):
+            market = exchange.markets_by_id.get(raw.get('symbol'))
+            market = market[0] if isinstance(market, list) else market
+            if not self._is_usdt_perpetual(market) or raw.get('fundingFeeRate') is None:
+                continue
+            granularity = raw.get('fundingRateGranularity')
+            next_in = raw.get('nextFundingRateTime')
+            rows.append(self._row(
+                venue, market, float(raw['fundingFeeRate']),
+                float(raw['predictedFundingFeeRate']) if raw.get('predictedFundingFeeRate') is not None else None,
+                float(granularity) / 3600000.0 if granularity else None,
+                now_ms + int(next_in) if next_in is not None else None,
+                float(raw['markPrice']) if raw.get('markPrice') is not None else None
+            ))
+        return rows
+
+    def _fetch_venue(self, venue):
+        exchange = self._client(venue)
+        if venue == 'bingx':
+            return self._fetch_bingx(venue, exchange)
+        if venue == 'kucoin':
+            return self._fetch_kucoin(venue, exchange)
+        return self._fetch_unified(venue, exchange)
+
+    def _fresh(self, max_age):
+        result = self._result
+        if result is not None and clock_ms() - result['timestamp'] <= max_age * 1000:
+            return result
+        return None
+
+    def refresh(self, max_age=None):
+        """
+        Consulta todos los venues en paralelo y recalcula el ranking. Con max_age,
+        si otra petición ha refrescado mientras se esperaba el lock se devuelve su resultado.
+        """
+        with self._refresh_lock:
+            if max_age is not None:
+                result = self._fresh(max_age)
+                if result is not None:
+                    return result
+            started = time.time()
+            rows, errors = [], {}
+            with ThreadPoolExecutor(max_workers=max(len(self.venues), 1)) as pool:
+                futures = {venue: pool.submit(self._fetch_venue, venue) for venue in self.venues}
+                for venue, future in futures.items():
+                    try:
+                        rows.extend(future.result())
+                    except Exception as e:
+                        print(f"Error obteniendo funding de {venue}: {e}")
+                        errors[venue] = str(e)
+
+            result = build_funding_table(rows, self.venues)
+            result.update({
+                'errors': errors,
+                'timestamp': clock_ms(),
+                'elapsed_ms': round((time.time() - started) * 1000.0, 1)
+            })
+            self._result = result
+            return result
+
+    def scan(self, max_age=None):
+        """Último escaneo, refrescándolo si es más antiguo que max_age segundos"""
+        max_age = self.max_age if max_age is None else max_age
+        result = self._fresh(max_age)
+        if result is None:
+            result = self.refresh(max_age)
+        return result
+
+    def start(self, interval_seconds=60):
+        """Arranca el refresco periódico en segundo plano"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Error refrescando el escáner de funding: {e}")
+                self._stop.wait(interval_seconds)
+
+        self._stop.clear()
+        self._worker = threading.Thread(target=run, name='funding-scanner', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def build_funding_table(rows, venues):
+    """
+    Matriz símbolo x venue del carry anualizado y ranking por spread entre venues
+
+    Returns:
+        Dict con venues y la lista de símbolos ordenada por spread anualizado
+        (los símbolos con un solo venue van al final, por carry absoluto)
+    """
+    if not rows:
+        return {'venues': list(venues), 'symbols': []}
+
+    symbols = sorted({row['symbol'] for row in rows})
+    sym_index = {symbol: i for i, symbol in enumerate(symbols)}
+    venue_index = {venue: j for j, venue in enumerate(venues)}
+    shape = (len(symbols), len(venues))
+    rate = np.full(shape, np.nan)
+    interval = np.full(shape, np.nan)
+    for row in rows:
+        i, j = sym_index[row['symbol']], venue_index[row['venue']]
+        rate[i, j] = row['funding_rate']
+        # Intervalo desconocido: NaN, la fila no entra en el spread ni en la media
+        interval[i, j] = row['interval_hours'] if row['interval_hours'] is not None else np.nan
+
+    listed = np.isfinite(rate).sum(axis=1)
+    annual = annualize(rate, interval)
+    present = np.isfinite(annual)
+    count = present.sum(axis=1)
+    with np.errstate(all='ignore'):
+        high = np.where(present, annual, -np.inf).argmax(axis=1)
+        low = np.where(present, annual, np.inf).argmin(axis=1)
+        spread = np.where(count > 1, annual[np.arange(len(symbols)), high] - annual[np.arange(len(symbols)), low], np.nan)
+        mean = np.where(count > 0, np.nansum(annual, axis=1) / np.maximum(count, 1), np.nan)
+
+    # Primero por spread (símbolos en varios venues) y después por carry absoluto
+    order = np.lexsort((-np.abs(np.nan_to_num(mean)), -np.nan_to_num(spread, nan=-np.inf), count < 2))
+
+    by_symbol = {}
+    for row in rows:
+        by_symbol.setdefault(row['symbol'], {})[row['venue']] = {
+            'funding_rate': row['funding_rate'],
+            'predicted_rate': row['predicted_rate'],
+            'interval_hours': row['interval_hours'],
+            'annualized': annualize(row['funding_rate'], row['interval_hours']),
+            'next_funding_time': row['next_funding_time'],
+            'mark_price': row['mark_price'],
+        }
+
+    ranked = []
+    for i in order.tolist():
+        multi = count[i] > 1
+        ranked.append({
+            'symbol': symbols[i],
+            'venues': by_symbol[symbols[i]],
+            'venue_count': int(listed[i]),
+            # Venues con intervalo conocido (los únicos que entran en el carry)
+            'annualized_venues': int(count[i]),
+            'mean_annualized': float(mean[i]) if count[i] else None,
+            # Carry: largo en el venue que menos paga y corto en el que más cobra
+            'long_venue': venues[low[i]] if multi else None,
+            'short_venue': venues[high[i]] if multi else None,
+            'annualized_spread': float(spread[i]) if multi else None,
+        })
+    return {'venues': list(venues), 'symbols': ranked}
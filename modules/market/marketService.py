@@ -2,12 +2,16 @@
 Servicio para obtener datos de mercados financieros usando CCXT y otras APIs
 """
 import ccxt
-import requests
 import pandas as pd
 from datetime import datetime, timedelta
 import json
 from typing import Dict, List, Any, Optional, Union
 
+from modules.replay.http import configure_session, http_session
+from modules.market.funding import FundingScanner
+from modules.market.anomaly import AnomalyDetector
+from modules.orderbook.consolidated import ConsolidatedBooks
+
 class MarketService:
     """
     Servicio para obtener datos de mercados financieros
@@ -24,6 +28,15 @@ class MarketService:
         # Inicializar exchanges
         self.exchanges = {}
         self._initialize_exchanges()
+        
+        # Funding de perpetuos en varios exchanges (clientes de futuros propios)
+        self.funding_scanner = FundingScanner()
+        
+        # Anomalías de OI, funding y precio de todo el universo de perpetuos
+        self.anomaly_detector = AnomalyDetector()
+        
+        # Libro consolidado (Deribit + clientes spot de self.exchanges)
+        self.consolidated_books = ConsolidatedBooks(self.exchanges)
     
     def _initialize_exchanges(self):
         """
@@ -63,6 +76,8 @@ class MarketService:
             for name, exchange_class in exchange_classes.items():
                 try:
                     self.exchanges[name] = exchange_class(config)
+                    # Grabación / replay de las peticiones HTTP de ccxt
+                    configure_session(self.exchanges[name].session)
                     print(f"Exchange {name} inicializado correctamente")
                 except Exception as e:
                     print(f"Error al inicializar {name}: {e}")
@@ -187,7 +202,7 @@ class MarketService:
                 'apikey': self.twelve_api_key
             }
             
-            response = requests.get(url, params=params)
+            response = http_session().get(url, params=params)
             data = response.json()
             
             if 'values' not in data:
@@ -232,7 +247,7 @@ class MarketService:
                 'limit': limit
             }
             
-            response = requests.get(url, params=params)
+            response = http_session().get(url, params=params)
             data = response.json()
             
             if 'data' not in data:
@@ -292,7 +307,7 @@ class MarketService:
                 'limit': limit
             }
             
-            response = requests.get(url, params=params)
+            response = http_session().get(url, params=params)
             data = response.json()
             
             if not data or not isinstance(data, list):
@@ -565,6 +580,117 @@ class MarketService:
             # Retornar datos mock en caso de error
             return self.generate_sample_data(symbol, limit)
 
+    def get_ohlcv_arrays(self, symbol, timeframe='1d', limit=500, source='binance', since=None):
+        """
+        Obtiene velas OHLCV en formato columnar, sin datos de ejemplo como respaldo
+        
+        Args:
+            symbol: Símbolo a consultar (ej: 'BTC/USDT')
+            timeframe: Temporalidad (1m, 5m, 1h, 1d, etc.)
+            limit: Número máximo de velas
+            source: Exchange de CCXT
+            since: Timestamp en ms desde el que pedir velas (opcional)
+            
+        Returns:
+            Dict de arrays numpy (timestamp, open, high, low, close, volume) o None si falla
+        """
+        import numpy as np
+        
+        try:
+            if source not in self.exchanges:
+                return None
+            
+            ohlcv = self.exchanges[source].fetch_ohlcv(symbol, timeframe, since=since, limit=limit)
+            data = np.asarray(ohlcv, dtype=np.float64).reshape(-1, 6)
+            return {
+                'timestamp': data[:, 0].astype(np.int64),
+                'open': data[:, 1],
+                'high': data[:, 2],
+                'low': data[:, 3],
+                'close': data[:, 4],
+                'volume': data[:, 5]
+            }
+            
+        except Exception as e:
+            print(f"Error obteniendo velas de {symbol} en {source}: {e}")
+            return None
+
+    def get_funding_scan(self, symbols=None, min_venues=1, limit=None, max_age=None):
+        """
+        Ranking de funding de todos los perpetuos USDT de los exchanges configurados
+        
+        Args:
+            symbols: Lista de símbolos base a incluir (por defecto, todos)
+            min_venues: Mínimo de exchanges en los que cotiza el símbolo
+            limit: Número máximo de resultados
+            max_age: Antigüedad máxima del escaneo cacheado en segundos
+            
+        Returns:
+            Dict con venues, símbolos ordenados por spread anualizado y errores por venue
+        """
+        try:
+            scan = self.funding_scanner.scan(max_age)
+            ranked = scan['symbols']
+            if symbols:
+                wanted = {s.upper() for s in symbols}
+                ranked = [item for item in ranked if item['symbol'] in wanted]
+            if min_venues > 1:
+                ranked = [item for item in ranked if item['venue_count'] >= min_venues]
+            if limit:
+                ranked = ranked[:limit]
+            return dict(scan, symbols=ranked, count=len(ranked))
+            
+        except Exception as e:
+            print(f"Error obteniendo escáner de funding: {e}")
+            return {}
+
+    def get_anomalies(self, symbols=None, kinds=None, since=0, limit=100):
+        """
+        Anomalías recientes de OI, funding y precio de los perpetuos USDT
+        
+        Args:
+            symbols: Lista de símbolos base a incluir (por defecto, todos)
+            kinds: Tipos de evento (open_interest, funding, price, liquidation)
+            since: Id del último evento ya recibido
+            limit: Número máximo de eventos (los más recientes)
+            
+        Returns:
+            Dict con los eventos, el último id publicado y el estado del detector
+        """
+        try:
+            detector = self.anomaly_detector
+            wanted = {s.upper() for s in symbols} if symbols else None
+            events = detector.recent(wanted, set(kinds) if kinds else None, since, limit)
+            return {
+                'events': events,
+                'count': len(events),
+                'last_id': detector.bus.last_id,
+                'detector': detector.status()
+            }
+            
+        except Exception as e:
+            print(f"Error obteniendo anomalías de perpetuos: {e}")
+            return {}
+
+    def get_consolidated_order_book(self, base='BTC', levels=50, step=0, max_age=None):
+        """
+        Libro de órdenes consolidado de Deribit, Binance, Bybit y Kraken
+        
+        Args:
+            base: Moneda base (BTC, ETH...)
+            levels: Niveles por lado
+            step: Escalón de agregación de precios (0 = sin agregar)
+            max_age: Antigüedad máxima de los libros en segundos
+            
+        Returns:
+            Dict con precios, cantidades en moneda base, acumulado y desglose por venue
+        """
+        try:
+            return self.consolidated_books.book(base).query(levels, step, max_age)
+        except Exception as e:
+            print(f"Error obteniendo libro consolidado de {base}: {e}")
+            return {}
+
     def get_available_symbols(self, exchange='binance'):
         """
         Obtiene símbolos disponibles de un exchange
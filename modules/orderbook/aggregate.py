@@ -0,0 +1,68 @@
+"""
+Agregación vectorizada de niveles del libro por tamaño de escalón
+"""
+import os
+from decimal import Decimal
+
+import numpy as np
+
+# Escalones precalculados en cada versión del libro (los del selector de la UI)
+DEFAULT_STEPS = tuple(
+    float(step) for step in os.getenv('TRADINGROAD_BOOK_STEPS', '1,10,100,1000,5000,10000').split(',') if step.strip()
+)
+# Tolerancia para que 0.3 / 0.1 caiga en el escalón 3 y no en el 2
+EPSILON = 1e-9
+
+
+def step_decimals(step):
+    """Decimales con los que redondear los precios de un escalón (0.5 -> 1, 100 -> 0)"""
+    return max(0, -Decimal(str(step)).normalize().as_tuple().exponent)
+
+
+def bucket_levels(prices, amounts, step, round_up=False):
+    """
+    Agrupa niveles por escalón de precio en una sola pasada
+
+    Args:
+        prices, amounts: Arrays ordenados desde el mejor precio (monótonos);
+            amounts puede ser 2D con una columna por venue
+        step: Tamaño del escalón; <= 0 devuelve los niveles tal cual
+        round_up: False agrupa hacia abajo (floor), True en el escalón superior
+            (como los asks de aggregate_orderbook_level)
+
+    Returns:
+        (precios, cantidades, acumulado) en el mismo orden de entrada
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    if step <= 0 or len(prices) == 0:
+        return prices, amounts, np.cumsum(amounts, axis=0)
+
+    index = np.floor(prices / step + EPSILON)
+    if round_up:
+        index += 1
+    # Al estar ordenados, cada escalón es un tramo contiguo: basta con sumar tramos
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    totals = np.add.reduceat(amounts, starts)
+    bucket_prices = np.round(index[starts] * step, step_decimals(step))
+    return bucket_prices, totals, np.cumsum(totals, axis=0)
+
+
+def aggregate_book(bid_prices, bid_amounts, ask_prices, ask_amounts, step, round_up_asks=True):
+    """
+    Ambos lados agregados con su profundidad acumulada
+
+    Returns:
+        {'bids': {'price', 'amount', 'cumulative'}, 'asks': {...}} con arrays
+    """
+    ladder = {}
+    for name, prices, amounts, round_up in (('bids', bid_prices, bid_amounts, False),
+                                            ('asks', ask_prices, ask_amounts, round_up_asks)):
+        price, amount, cumulative = bucket_levels(prices, amounts, step, round_up)
+        ladder[name] = {'price': price, 'amount': amount, 'cumulative': cumulative}
+    return ladder
+
+
+def ladder_pairs(side, levels=None):
+    """Lado de una escalera -> [[precio, cantidad], ...] con los `levels` primeros"""
+    return np.column_stack([side['price'][:levels], side['amount'][:levels]]).tolist()
@@ -0,0 +1,218 @@
+"""
+Libro de órdenes local mantenido a partir de un snapshot y actualizaciones incrementales
+"""
+import threading
+
+import numpy as np
+
+from modules.orderbook.aggregate import DEFAULT_STEPS, aggregate_book
+
+BID, ASK = 'bids', 'asks'
+
+
+class SequenceGap(Exception):
+    """La actualización no enlaza con el último change_id aplicado: hay que resincronizar"""
+
+
+class BookSide:
+    """
+    Un lado del libro como dos arrays paralelos (precio, cantidad) ordenados por
+    precio ascendente. Las actualizaciones se aplican por lotes con searchsorted.
+    """
+
+    def __init__(self, descending):
+        self.descending = descending
+        self.prices = np.empty(0, dtype=np.float64)
+        self.amounts = np.empty(0, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.prices)
+
+    def replace(self, prices, amounts):
+        prices = np.asarray(prices, dtype=np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        order = np.argsort(prices, kind='stable')
+        keep = amounts[order] > 0
+        self.prices, self.amounts = prices[order][keep], amounts[order][keep]
+
+    def apply(self, prices, amounts):
+        """
+        Aplica un lote de cambios (cantidad 0 = borrar el nivel); si un precio
+        aparece varias veces en el lote gana el último
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if len(prices) == 0:
+            return
+        # Último cambio por precio, ordenado
+        rev_unique, rev_index = np.unique(prices[::-1], return_index=True)
+        prices, amounts = rev_unique, amounts[::-1][rev_index]
+
+        idx = np.searchsorted(self.prices, prices)
+        exists = idx < len(self.prices)
+        exists[exists] = self.prices[idx[exists]] == prices[exists]
+
+        self.amounts[idx[exists]] = amounts[exists]
+        new = ~exists & (amounts > 0)
+        if new.any():
+            self.prices = np.insert(self.prices, idx[new], prices[new])
+            self.amounts = np.insert(self.amounts, idx[new], amounts[new])
+        if (amounts[exists] <= 0).any():
+            keep = self.amounts > 0
+            self.prices, self.amounts = self.prices[keep], self.amounts[keep]
+
+    def best_first(self):
+        """Vistas (precio, cantidad) empezando por el mejor precio"""
+        if self.descending:
+            return self.prices[::-1], self.amounts[::-1]
+        return self.prices, self.amounts
+
+
+class OrderBook:
+    """
+    Libro de un instrumento. Cada actualización debe traer prev_change_id igual
+    al change_id aplicado por última vez; si no, se lanza SequenceGap y el libro
+    queda fuera de sincronía hasta el siguiente snapshot.
+    """
+
+    def __init__(self, instrument):
+        self.instrument = instrument
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.change_id = None
+        self.timestamp = None
+        self.in_sync = False
+        # Número de versión local (sube con cada snapshot o actualización aplicada)
+        self.version = 0
+        self.lock = threading.RLock()
+        self.steps = DEFAULT_STEPS
+        # Escaleras agregadas de la versión actual: {(step, round_up_asks): escalera}
+        self._ladders = {}
+        self._ladders_version = None
+
+    def apply_snapshot(self, bids, asks, change_id=None, timestamp=None):
+        """
+        Sustituye el libro completo
+
+        Args:
+            bids, asks: Listas [[precio, cantidad], ...]
+        """
+        bids = np.asarray(bids, dtype=np.float64).reshape(-1, 2)
+        asks = np.asarray(asks, dtype=np.float64).reshape(-1, 2)
+        with self.lock:
+            self.bids.replace(bids[:, 0], bids[:, 1])
+            self.asks.replace(asks[:, 0], asks[:, 1])
+            self.change_id = change_id
+            self.timestamp = timestamp
+            self.in_sync = True
+            self.version += 1
+
+    def apply_update(self, bids, asks, change_id, prev_change_id=None, timestamp=None):
+        """
+        Aplica un lote de cambios de Deribit ([acción, precio, cantidad], con
+        acción new/change/delete) o pares [precio, cantidad]
+
+        Raises:
+            SequenceGap si prev_change_id no coincide con el último change_id
+        """
+        with self.lock:
+            if not self.in_sync:
+                raise SequenceGap(f"{self.instrument}: libro sin snapshot")
+            if prev_change_id is not None and self.change_id is not None and prev_change_id != self.change_id:
+                self.in_sync = False
+                raise SequenceGap(f"{self.instrument}: se esperaba {self.change_id} y llegó {prev_change_id}")
+            for side, changes in ((self.bids, bids), (self.asks, asks)):
+                prices, amounts = _parse_changes(changes)
+                side.apply(prices, amounts)
+            self.change_id = change_id
+            self.timestamp = timestamp
+            self.version += 1
+
+    def top(self, levels=20):
+        """Mejores `levels` niveles de cada lado como listas [[precio, cantidad], ...]"""
+        with self.lock:
+            result = {}
+            for name, side in ((BID, self.bids), (ASK, self.asks)):
+                prices, amounts = side.best_first()
+                result[name] = np.column_stack([prices[:levels], amounts[:levels]]).tolist()
+            result.update({'change_id': self.change_id, 'timestamp': self.timestamp, 'in_sync': self.in_sync})
+            return result
+
+    def best(self):
+        """(mejor bid, mejor ask) o None en los lados vacíos"""
+        with self.lock:
+            bid = float(self.bids.prices[-1]) if len(self.bids) else None
+            ask = float(self.asks.prices[0]) if len(self.asks) else None
+            return bid, ask
+
+    def mid(self):
+        bid, ask = self.best()
+        return (bid + ask) / 2.0 if bid is not None and ask is not None else None
+
+    def depth_at(self, price, side=BID):
+        """Cantidad en un precio exacto (0 si no hay nivel)"""
+        book_side = self.bids if side == BID else self.asks
+        with self.lock:
+            pos = int(np.searchsorted(book_side.prices, price))
+            if pos < len(book_side) and book_side.prices[pos] == price:
+                return float(book_side.amounts[pos])
+            return 0.0
+
+    def cumulative_depth(self, side=BID, limit_price=None):
+        """
+        Profundidad acumulada desde el mejor precio
+
+        Args:
+            side: 'bids' o 'asks'
+            limit_price: Si se indica, cantidad total hasta ese precio (inclusive)
+
+        Returns:
+            float con el total si hay limit_price; si no, dict con precios y acumulados
+        """
+        book_side = self.bids if side == BID else self.asks
+        with self.lock:
+            if limit_price is not None:
+                if side == BID:
+                    start = int(np.searchsorted(book_side.prices, limit_price, side='left'))
+                    return float(book_side.amounts[start:].sum())
+                stop = int(np.searchsorted(book_side.prices, limit_price, side='right'))
+                return float(book_side.amounts[:stop].sum())
+            prices, amounts = book_side.best_first()
+            return {'prices': prices.tolist(), 'cumulative': np.cumsum(amounts).tolist()}
+
+    def aggregated(self, step=0, round_up_asks=True):
+        """
+        Escalera agregada por escalón con profundidad acumulada (ver aggregate_book).
+        Con cada versión nueva se calculan de una vez todos los escalones de
+        self.steps, así que cambiar de escalón no recalcula nada.
+        """
+        step = float(step or 0)
+        with self.lock:
+            if self._ladders_version != self.version:
+                self._ladders, self._ladders_version = {}, self.version
+            key = (step, round_up_asks)
+            if key not in self._ladders:
+                arrays = self.arrays()
+                for s in {0.0, step, *self.steps}:
+                    if (s, round_up_asks) not in self._ladders:
+                        self._ladders[(s, round_up_asks)] = aggregate_book(*arrays, s, round_up_asks)
+            return self._ladders[key]
+
+    def arrays(self):
+        """Copia consistente de los cuatro arrays (precios y cantidades, mejor precio primero)"""
+        with self.lock:
+            bid_prices, bid_amounts = self.bids.best_first()
+            ask_prices, ask_amounts = self.asks.best_first()
+            return bid_prices.copy(), bid_amounts.copy(), ask_prices.copy(), ask_amounts.copy()
+
+
+def _parse_changes(changes):
+    """[[acción, precio, cantidad]] o [[precio, cantidad]] -> (precios, cantidades), delete = 0"""
+    if not changes:
+        return np.empty(0), np.empty(0)
+    if len(changes[0]) == 3:
+        prices = np.array([c[1] for c in changes], dtype=np.float64)
+        amounts = np.array([0.0 if c[0] == 'delete' else c[2] for c in changes], dtype=np.float64)
+        return prices, amounts
+    pairs = np.asarray(changes, dtype=np.float64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
@@ -0,0 +1,260 @@
+"""
+Libro consolidado de varios exchanges: una sola escalera de precios con el
+desglose por venue, mantenida de forma incremental
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from modules.orderbook.aggregate import bucket_levels
+from modules.orderbook.feeds import default_book_manager
+from modules.replay.clock import now_ms
+
+# Venue -> origen del libro y unidad de las cantidades:
+#   base: ya en moneda base; quote: nocional en USD (se divide por el precio);
+#   contracts: contratos (se multiplica por contractSize del mercado de ccxt)
+CONSOLIDATED_VENUES = {
+    'deribit': {'source': 'local', 'instrument': '{base}-PERPETUAL', 'unit': 'quote'},
+    'binance': {'source': 'ccxt', 'exchange': 'binance', 'symbol': '{base}/USDT', 'unit': 'base', 'limit': 1000},
+    'bybit': {'source': 'ccxt', 'exchange': 'bybit', 'symbol': '{base}/USDT', 'unit': 'base', 'limit': 200},
+    'kraken': {'source': 'ccxt', 'exchange': 'kraken', 'symbol': '{base}/USD', 'unit': 'base', 'limit': 500},
+}
+
+
+# Segundos tras los que el libro de un venue deja de consolidarse (su timestamp
+# es el del exchange: un libro sin cambios no es necesariamente viejo, por eso
+# el margen es mayor que el max_age del refresco)
+STALE_SECONDS = 30.0
+
+
+def normalize_amounts(prices, amounts, unit, contract_size=1.0):
+    """Cantidades de un venue -> moneda base"""
+    if unit == 'quote':
+        return amounts / prices
+    if unit == 'contracts':
+        return amounts * contract_size
+    return amounts
+
+
+class LadderSide:
+    """
+    Un lado del libro consolidado: rejilla de precios ordenada (ascendente) y
+    matriz precio x venue. Al actualizar un venue solo se rehace su columna.
+    """
+
+    def __init__(self, venues, descending):
+        self.venues = list(venues)
+        self.descending = descending
+        self.prices = np.empty(0, dtype=np.float64)
+        self.matrix = np.zeros((0, len(self.venues)), dtype=np.float64)
+
+    def update_venue(self, venue, prices, amounts):
+        """Sustituye los niveles de un venue (precios en cualquier orden)"""
+        j = self.venues.index(venue)
+        prices = np.asarray(prices, dtype=np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)
+        self.matrix[:, j] = 0.0
+
+        grid = np.union1d(self.prices, prices)
+        if len(grid) != len(self.prices):
+            matrix = np.zeros((len(grid), len(self.venues)), dtype=np.float64)
+            matrix[np.searchsorted(grid, self.prices)] = self.matrix
+            self.prices, self.matrix = grid, matrix
+        # np.add.at por si un venue repite precio tras normalizar
+        np.add.at(self.matrix[:, j], np.searchsorted(self.prices, prices), amounts)
+
+        # Fuera los precios que ya no tiene ningún venue
+        alive = self.matrix.any(axis=1)
+        if not alive.all():
+            self.prices, self.matrix = self.prices[alive], self.matrix[alive]
+
+    def best_first(self):
+        if self.descending:
+            return self.prices[::-1], self.matrix[::-1]
+        return self.prices, self.matrix
+
+
+class ConsolidatedBook:
+    """
+    Libro consolidado de una moneda base. Los venues se consultan en paralelo
+    y cada uno solo actualiza su columna si su libro ha cambiado; las
+    escaleras listas para servir (por escalón) se cachean por versión.
+    """
+
+    def __init__(self, base, exchanges, venues=None, max_age=2.0, stale_seconds=STALE_SECONDS):
+        self.base = base
+        self.exchanges = exchanges
+        self.venues = [v for v in (venues or CONSOLIDATED_VENUES)
+                       if CONSOLIDATED_VENUES[v]['source'] == 'local' or CONSOLIDATED_VENUES[v]['exchange'] in exchanges]
+        self.max_age = max_age
+        self.stale_seconds = max(stale_seconds, max_age)
+        self.bids = LadderSide(self.venues, descending=True)
+        self.asks = LadderSide(self.venues, descending=False)
+        self.status = {venue: {'timestamp': None, 'levels': [0, 0], 'error': None, 'stale': False}
+                       for venue in self.venues}
+        self.version = 0
+        self.updated_at = None
+        self._marks = {}
+        self._ladders = {}
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+
+    def _fetch_venue(self, venue):
+        """
+        Libro de un venue en moneda base
+
+        Returns:
+            (marca de cambio, timestamp, bids, asks) con bids/asks como arrays Nx2
+        """
+        spec = CONSOLIDATED_VENUES[venue]
+        if spec['source'] == 'local':
+            book = default_book_manager().book(spec['instrument'].format(base=self.base))
+            bid_prices, bid_amounts, ask_prices, ask_amounts = book.arrays()
+            mark, timestamp, contract_size = book.version, book.timestamp, 1.0
+        else:
+            exchange = self.exchanges[spec['exchange']]
+            symbol = spec['symbol'].format(base=self.base)
+            data = exchange.fetch_order_book(symbol, spec.get('limit'))
+            # Algunos exchanges añaden campos por nivel (Kraken: timestamp): solo precio y cantidad
+            bids = np.array([level[:2] for level in data['bids']], dtype=np.float64).reshape(-1, 2)
+            asks = np.array([level[:2] for level in data['asks']], dtype=np.float64).reshape(-1, 2)
+            bid_prices, bid_amounts, ask_prices, ask_amounts = bids[:, 0], bids[:, 1], asks[:, 0], asks[:, 1]
+            timestamp = data.get('timestamp') or now_ms()
+            mark = data.get('nonce') or timestamp
+            contract_size = (exchange.market(symbol).get('contractSize') or 1.0) if spec['unit'] == 'contracts' else 1.0
+
+        unit = spec['unit']
+        bids = np.column_stack([bid_prices, normalize_amounts(bid_prices, bid_amounts, unit, contract_size)])
+        asks = np.column_stack([ask_prices, normalize_amounts(ask_prices, ask_amounts, unit, contract_size)])
+        return mark, timestamp, bids, asks
+
+    def _clear(self, venue):
+        """Retira la columna de un venue de la escalera (con el lock tomado)"""
+        self.status[venue].update({'levels': [0, 0], 'stale': True})
+        if venue not in self._marks:
+            return False
+        self.bids.update_venue(venue, [], [])
+        self.asks.update_venue(venue, [], [])
+        del self._marks[venue]
+        self.version += 1
+        self._ladders = {}
+        return True
+
+    def _apply(self, venue, mark, timestamp, bids, asks):
+        with self._lock:
+            status = self.status[venue]
+            status.update({'timestamp': timestamp, 'levels': [len(bids), len(asks)], 'error': None, 'stale': False})
+            # Un libro viejo no se mezcla con los demás (podría cruzar la escalera)
+            if timestamp is not None and now_ms() - timestamp > self.stale_seconds * 1000:
+                return self._clear(venue)
+            if self._marks.get(venue) == mark:
+                return False
+            self.bids.update_venue(venue, bids[:, 0], bids[:, 1])
+            self.asks.update_venue(venue, asks[:, 0], asks[:, 1])
+            self._marks[venue] = mark
+            self.version += 1
+            self._ladders = {}
+            return True
+
+    def refresh(self):
+        """Consulta todos los venues en paralelo; cada respuesta se aplica al llegar"""
+        with self._refresh_lock:
+            with ThreadPoolExecutor(max_workers=max(len(self.venues), 1)) as pool:
+                futures = {pool.submit(self._fetch_venue, venue): venue for venue in self.venues}
+                for future in as_completed(futures):
+                    venue = futures[future]
+                    try:
+                        self._apply(venue, *future.result())
+                    except Exception as e:
+                        print(f"Error obteniendo el libro de {venue} para {self.base}: {e}")
+                        with self._lock:
+                            self.status[venue]['error'] = str(e)
+                            self._clear(venue)
+            self.updated_at = now_ms()
+
+    def ladder(self, step=0, max_age=None):
+        """
+        Escalera consolidada (refrescada si tiene más de max_age segundos)
+
+        Returns:
+            {'bids'|'asks': (precios, cantidades por venue, totales, acumulado)}
+            con el mejor precio primero
+        """
+        max_age = self.max_age if max_age is None else max_age
+        if self.updated_at is None or now_ms() - self.updated_at > max_age * 1000:
+            self.refresh()
+        step = float(step or 0)
+        with self._lock:
+            ladder = self._ladders.get(step)
+            if ladder is None:
+                ladder = {}
+                for name, side in (('bids', self.bids), ('asks', self.asks)):
+                    prices, matrix = side.best_first()
+                    prices, matrix, cumulative = bucket_levels(prices, matrix, step, round_up=name == 'asks')
+                    ladder[name] = (prices, matrix, matrix.sum(axis=1), cumulative.sum(axis=1))
+                self._ladders[step] = ladder
+            return ladder
+
+    def query(self, levels=50, step=0, max_age=None):
+        """Los `levels` mejores niveles de cada lado con el desglose por venue"""
+        ladder = self.ladder(step, max_age)
+        result = {'base': self.base, 'venues': self.venues}
+        for name, (prices, matrix, totals, cumulative) in ladder.items():
+            result[name] = {
+                'price': prices[:levels].tolist(),
+                'amount': totals[:levels].tolist(),
+                'cumulative': cumulative[:levels].tolist(),
+                'by_venue': {venue: matrix[:levels, j].tolist() for j, venue in enumerate(self.venues)}
+            }
+        best_bid = result['bids']['price'][0] if result['bids']['price'] else None
+        best_ask = result['asks']['price'][0] if result['asks']['price'] else None
+        result.update({
+            # Con varios venues el mejor bid puede superar al mejor ask (arbitraje)
+            'crossed': best_bid is not None and best_ask is not None and best_bid >= best_ask,
+            'venue_status': {venue: dict(status) for venue, status in self.status.items()},
+            'version': self.version,
+            'timestamp': now_ms()
+        })
+        return result
+
+
+class ConsolidatedBooks:
+    """Libros consolidados por moneda base, con refresco opcional en segundo plano"""
+
+    def __init__(self, exchanges, venues=None):
+        self.exchanges = exchanges
+        self.venues = venues
+        self._books = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stop = threading.Event()
+
+    def book(self, base):
+        base = base.upper()
+        with self._lock:
+            book = self._books.get(base)
+            if book is None:
+                book = self._books[base] = ConsolidatedBook(base, self.exchanges, self.venues)
+            return book
+
+    def start(self, bases=('BTC',), interval_seconds=2.0):
+        """Mantiene refrescados los libros de `bases` en segundo plano"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                for base in bases:
+                    try:
+                        self.book(base).refresh()
+                    except Exception as e:
+                        print(f"Error refrescando el libro consolidado de {base}: {e}")
+                self._stop.wait(interval_seconds)
+
+        self._stop.clear()
+        self._worker = threading.Thread(target=run, name='consolidated-books', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,305 @@
+"""
+Fuentes de datos del libro local: websocket de Deribit o sondeo REST (sustituto local)
+"""
+import json
+import os
+import threading
+import time
+
+import websocket
+
+from modules.orderbook.book import OrderBook, SequenceGap
+from modules.replay.http import HTTP_MODE, http_session
+
+DERIBIT_WS_URL = "wss://www.deribit.com/ws/api/v2"
+DERIBIT_REST_URL = "https://www.deribit.com/api/v2/public/get_order_book"
+DERIBIT_INSTRUMENTS_URL = "https://www.deribit.com/api/v2/public/get_instruments"
+# Intervalo de agrupación de la suscripción de Deribit (100ms, agg2 o raw requiere auth)
+BOOK_INTERVAL = '100ms'
+SNAPSHOT_DEPTH = 1000
+# Segundos que se reutiliza la lista de instrumentos listados en Deribit
+INSTRUMENTS_TTL = 600
+# Libros con feed activo a la vez (al llegar al máximo se cierra el menos usado)
+MAX_LIVE_BOOKS = int(os.getenv('TRADINGROAD_MAX_BOOKS', '20'))
+# Segundos sin consultas tras los que se cierra el feed de un libro
+BOOK_IDLE_SECONDS = 300
+
+
+def fetch_deribit_snapshot(instrument, depth=SNAPSHOT_DEPTH):
+    """Snapshot REST del libro de un instrumento de Deribit"""
+    response = http_session().get(DERIBIT_REST_URL, params={'instrument_name': instrument, 'depth': depth}, timeout=10)
+    response.raise_for_status()
+    return response.json()['result']
+
+
+def fetch_deribit_instruments():
+    """Nombres de todos los instrumentos vivos de Deribit (todas las monedas y tipos)"""
+    response = http_session().get(DERIBIT_INSTRUMENTS_URL, params={'currency': 'any', 'expired': 'false'}, timeout=10)
+    response.raise_for_status()
+    return {item['instrument_name'] for item in response.json()['result']}
+
+
+def load_snapshot(book, depth=SNAPSHOT_DEPTH):
+    """Resincroniza un libro con un snapshot REST"""
+    data = fetch_deribit_snapshot(book.instrument, depth)
+    book.apply_snapshot(data.get('bids', []), data.get('asks', []), data.get('change_id'), data.get('timestamp'))
+    return book
+
+
+class PollingBookFeed:
+    """
+    Sustituto local del websocket: pide snapshots REST periódicamente (funciona
+    también en modo replay, con las respuestas grabadas)
+    """
+
+    def __init__(self, book, interval_seconds=2.0):
+        self.book = book
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    load_snapshot(self.book)
+                except Exception as e:
+                    print(f"Error sondeando el libro de {self.book.instrument}: {e}")
+                self._stop.wait(self.interval_seconds)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name=f"book-poll-{self.book.instrument}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class DeribitBookFeed:
+    """
+    Suscripción book.<instrumento>.100ms de Deribit. La primera notificación es
+    un snapshot y las siguientes cambios enlazados por prev_change_id; ante un
+    hueco se vuelve a suscribir para recibir un snapshot nuevo.
+    """
+
+    RECONNECT_SECONDS = 5
+
+    def __init__(self, book):
+        self.book = book
+        self.channel = f"book.{book.instrument}.{BOOK_INTERVAL}"
+        self.resyncs = 0
+        # Tras un hueco se ignoran los cambios hasta recibir el nuevo snapshot
+        self._awaiting_snapshot = True
+        self._ws = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._request_id = 0
+
+    def _send(self, method, params):
+        self._request_id += 1
+        self._ws.send(json.dumps({'jsonrpc': '2.0', 'id': self._request_id, 'method': method, 'params': params}))
+
+    def _subscribe(self):
+        self._send('public/subscribe', {'channels': [self.channel]})
+
+    def _resync(self):
+        self.resyncs += 1
+        self._awaiting_snapshot = True
+        self._send('public/unsubscribe', {'channels': [self.channel]})
+        self._subscribe()
+
+    def _on_open(self, ws):
+        self._awaiting_snapshot = True
+        self._subscribe()
+
+    def _on_message(self, ws, message):
+        payload = json.loads(message)
+        params = payload.get('params')
+        if payload.get('method') != 'subscription' or not params or params.get('channel') != self.channel:
+            return
+        data = params['data']
+        try:
+            if data.get('type') == 'snapshot':
+                self.book.apply_snapshot(
+                    [[price, amount] for _, price, amount in data.get('bids', [])],
+                    [[price, amount] for _, price, amount in data.get('asks', [])],
+                    data.get('change_id'), data.get('timestamp')
+                )
+                self._awaiting_snapshot = False
+            elif not self._awaiting_snapshot:
+                self.book.apply_update(data.get('bids', []), data.get('asks', []), data.get('change_id'),
+                                       data.get('prev_change_id'), data.get('timestamp'))
+        except SequenceGap as e:
+            print(f"Hueco de secuencia en {self.book.instrument}, resincronizando: {e}")
+            self._resync()
+
+    def _on_error(self, ws, error):
+        print(f"Error en el websocket de {self.book.instrument}: {error}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                self._ws = websocket.WebSocketApp(
+                    DERIBIT_WS_URL, on_open=self._on_open, on_message=self._on_message, on_error=self._on_error
+                )
+                self._ws.run_forever(ping_interval=30, ping_timeout=10)
+                # Conexión perdida: el libro deja de ser fiable hasta el próximo snapshot
+                self.book.in_sync = False
+                self._stop.wait(self.RECONNECT_SECONDS)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name=f"book-ws-{self.book.instrument}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._ws is not None:
+            self._ws.close()
+
+
+class BookManager:
+    """
+    Libros locales por instrumento, cada uno con su feed en segundo plano.
+
+    Solo se abren libros de instrumentos listados en Deribit, como mucho
+    max_books a la vez (se cierra el menos consultado) y el feed de un libro
+    que lleva idle_seconds sin consultas se detiene y el libro se descarta.
+
+    TRADINGROAD_BOOK_FEED elige la fuente: 'websocket' (por defecto en modo
+    live) o 'poll' (por defecto en record/replay, con las respuestas grabadas).
+    """
+
+    def __init__(self, feed=None, max_books=MAX_LIVE_BOOKS, idle_seconds=BOOK_IDLE_SECONDS):
+        self.feed = feed or os.getenv('TRADINGROAD_BOOK_FEED') or ('websocket' if HTTP_MODE == 'live' else 'poll')
+        self.max_books = max_books
+        self.idle_seconds = idle_seconds
+        self._books = {}
+        self._feeds = {}
+        self._last_access = {}
+        self._lock = threading.Lock()
+        self._instruments = None
+        self._instruments_time = 0.0
+        self._instruments_lock = threading.Lock()
+        self._janitor = None
+
+    def _check_instrument(self, instrument):
+        """
+        Raises:
+            ValueError: Si el instrumento no está listado en Deribit
+        """
+        with self._instruments_lock:
+            if self._instruments is None or time.time() - self._instruments_time > INSTRUMENTS_TTL:
+                try:
+                    self._instruments = fetch_deribit_instruments()
+                    self._instruments_time = time.time()
+                except Exception as e:
+                    # Sin lista no se puede validar: solo se sigue con la anterior
+                    if self._instruments is None:
+                        raise
+                    print(f"Error actualizando los instrumentos de Deribit: {e}")
+            listed = instrument in self._instruments
+        if not listed:
+            raise ValueError(f"Instrumento no listado en Deribit: {instrument}")
+
+    def _evict(self, instrument):
+        """Detiene el feed de un libro y lo descarta (con el lock tomado)"""
+        feed = self._feeds.pop(instrument, None)
+        if feed is not None:
+            feed.stop()
+        self._books.pop(instrument, None)
+        self._last_access.pop(instrument, None)
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_seconds
+        for instrument in [name for name, last in self._last_access.items() if last < cutoff]:
+            self._evict(instrument)
+
+    def _ensure_janitor(self):
+        """Hilo que cierra los libros inactivos; termina cuando no queda ninguno (con el lock tomado)"""
+        if self._janitor is not None and self._janitor.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(min(60.0, self.idle_seconds / 5.0))
+                with self._lock:
+                    self._evict_idle()
+                    if not self._books:
+                        self._janitor = None
+                        return
+
+        self._janitor = threading.Thread(target=run, name='book-janitor', daemon=True)
+        self._janitor.start()
+
+    def peek(self, instrument):
+        """Libro ya abierto de un instrumento o None (no arranca ningún feed)"""
+        with self._lock:
+            return self._books.get(instrument)
+
+    def book(self, instrument, wait_seconds=0.0):
+        """
+        Libro local de un instrumento; la primera vez arranca su feed y, si aún
+        no está sincronizado, se carga un snapshot REST para poder responder ya
+
+        Raises:
+            ValueError: Si el instrumento no está listado en Deribit
+        """
+        with self._lock:
+            book = self._books.get(instrument)
+            if book is not None:
+                self._last_access[instrument] = time.time()
+
+        if book is None:
+            self._check_instrument(instrument)
+            with self._lock:
+                book = self._books.get(instrument)
+                if book is None:
+                    self._evict_idle()
+                    while len(self._books) >= max(self.max_books, 1):
+                        self._evict(min(self._last_access, key=self._last_access.get))
+                    book = self._books[instrument] = OrderBook(instrument)
+                    feed = DeribitBookFeed(book) if self.feed == 'websocket' else PollingBookFeed(book)
+                    self._feeds[instrument] = feed
+                    feed.start()
+                    self._ensure_janitor()
+                self._last_access[instrument] = time.time()
+
+        deadline = time.time() + wait_seconds
+        while not book.in_sync and time.time() < deadline:
+            time.sleep(0.05)
+        if not book.in_sync:
+            load_snapshot(book)
+        return book
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            books = list(self._books.items())
+            last_access = dict(self._last_access)
+        return {
+            instrument: {
+                'in_sync': book.in_sync, 'change_id': book.change_id, 'version': book.version,
+                'levels': [len(book.bids), len(book.asks)],
+                'resyncs': getattr(self._feeds.get(instrument), 'resyncs', 0),
+                'idle_seconds': round(now - last_access.get(instrument, now), 1)
+            }
+            for instrument, book in books
+        }
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def default_book_manager():
+    """Gestor de libros compartido"""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = BookManager()
+        return _default_manager
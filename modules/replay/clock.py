@@ -0,0 +1,55 @@
+"""
+Reloj de la aplicación: tiempo real o tiempo simulado del modo replay
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class ReplayClock:
+    """
+    Reloj que avanza desde un instante grabado a `speed` veces la velocidad real
+    (speed=60 reproduce una hora de mercado en un minuto)
+    """
+
+    def __init__(self, start_ms, speed=1.0):
+        self.start_ms = int(start_ms)
+        self.speed = float(speed)
+        self._origin = time.monotonic()
+
+    def now_ms(self):
+        return self.start_ms + int((time.monotonic() - self._origin) * 1000 * self.speed)
+
+    def reset(self, start_ms=None, speed=None):
+        """Reinicia la reproducción (opcionalmente desde otro instante o a otra velocidad)"""
+        if start_ms is not None:
+            self.start_ms = int(start_ms)
+        if speed is not None:
+            self.speed = float(speed)
+        self._origin = time.monotonic()
+
+
+_clock = None
+_clock_lock = threading.Lock()
+
+
+def set_clock(clock):
+    """Instala un reloj simulado (None vuelve al tiempo real)"""
+    global _clock
+    with _clock_lock:
+        _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def now_ms():
+    """Timestamp actual en ms según el reloj de la aplicación"""
+    clock = _clock
+    return clock.now_ms() if clock is not None else int(time.time() * 1000)
+
+
+def utc_now():
+    """datetime UTC actual según el reloj de la aplicación"""
+    return datetime.fromtimestamp(now_ms() / 1000.0, tz=timezone.utc)
@@ -0,0 +1,278 @@
+"""
+Sesión HTTP compartida con modos de grabación y reproducción (replay)
+
+TRADINGROAD_HTTP_MODE:
+    live    -> peticiones reales (por defecto)
+    record  -> peticiones reales y se guarda cada respuesta en el archivo
+    replay  -> se sirven las respuestas grabadas según el reloj simulado
+TRADINGROAD_REPLAY_DIR:   directorio del archivo (por defecto data/replay)
+TRADINGROAD_REPLAY_SPEED: multiplicador de velocidad del reloj en replay
+TRADINGROAD_REPLAY_START: instante inicial (ISO o ms; por defecto, la primera grabación)
+"""
+import json
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from config.paths import REPLAY_DIR
+from modules.replay.clock import ReplayClock, get_clock, now_ms, set_clock
+
+HTTP_MODE = os.getenv('TRADINGROAD_HTTP_MODE', 'live').lower()
+REPLAY_SPEED = float(os.getenv('TRADINGROAD_REPLAY_SPEED', '1'))
+REPLAY_START = os.getenv('TRADINGROAD_REPLAY_START')
+
+# Parámetros que dependen del momento de la petición y no identifican el recurso
+VOLATILE_PARAMS = frozenset({'timestamp', 'nonce', 'signature', 'recvWindow', '_'})
+# Límites de rango en ms: no forman parte de la clave (se calculan desde "ahora"),
+# pero se graban relativos al instante de la petición para distinguir las páginas
+RANGE_PARAMS = frozenset({'start_timestamp', 'end_timestamp', 'startTime', 'endTime', 'since'})
+# Grabaciones anteriores al reloj entre las que se busca la del rango más parecido
+RANGE_CANDIDATES = 64
+# Credenciales que nunca se graban
+SECRET_PARAMS = frozenset({'apikey', 'api_key', 'apiKey', 'token', 'key'})
+
+
+def request_key(method, url):
+    """Clave canónica de una petición: método, URL sin parámetros volátiles y con el resto ordenados"""
+    parts = urlsplit(url)
+    ignored = VOLATILE_PARAMS | RANGE_PARAMS | SECRET_PARAMS
+    params = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in ignored)
+    query = f"?{urlencode(params)}" if params else ''
+    return f"{method.upper()} {parts.scheme}://{parts.netloc}{parts.path}{query}"
+
+
+def request_range(url, at_ms):
+    """
+    Límites de rango de una petición relativos a at_ms (ms), p.ej. {'startTime': -86400000}
+
+    Así la página N de una descarga paginada grabada en vivo se corresponde con
+    la página N pedida en replay, aunque el reloj simulado no coincida al ms.
+    """
+    offsets = {}
+    for k, v in parse_qsl(urlsplit(url).query):
+        if k in RANGE_PARAMS:
+            try:
+                offsets[k] = int(float(v)) - at_ms
+            except ValueError:
+                continue
+    return offsets
+
+
+def _range_distance(requested, recorded):
+    if recorded is None:
+        # Grabación sin rangos (formato anterior): vale cualquiera
+        return 0
+    keys = set(requested) | set(recorded)
+    return sum(abs(requested[k] - recorded[k]) if k in requested and k in recorded else float('inf') for k in keys)
+
+
+class PayloadArchive:
+    """
+    Respuestas HTTP grabadas en ficheros JSONL diarios (una línea por respuesta).
+    En lectura se indexan por clave con los instantes de grabación ordenados.
+    """
+
+    def __init__(self, directory=REPLAY_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._times = {}
+        self._entries = {}
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def append(self, key, status, headers, body, ranges=None):
+        """Añade una respuesta grabada al fichero del día (ranges: ver request_range)"""
+        t = now_ms()
+        day = datetime.fromtimestamp(t / 1000.0, tz=timezone.utc).strftime('%Y-%m-%d')
+        line = json.dumps({
+            't': t, 'key': key, 'range': ranges or {}, 'status': status,
+            'content_type': headers.get('Content-Type', 'application/json'), 'body': body
+        })
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{day}.jsonl"), 'a', encoding='utf-8') as fh:
+                fh.write(line + '\n')
+
+    def load(self):
+        """Carga e indexa todas las grabaciones del directorio"""
+        grouped = defaultdict(list)
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith('.jsonl'):
+                    continue
+                with open(os.path.join(self.directory, name), encoding='utf-8') as fh:
+                    for line in fh:
+                        if line.strip():
+                            entry = json.loads(line)
+                            grouped[entry['key']].append(entry)
+        with self._lock:
+            self._entries = {key: sorted(items, key=lambda e: e['t']) for key, items in grouped.items()}
+            self._times = {key: np.array([e['t'] for e in items], dtype=np.int64)
+                           for key, items in self._entries.items()}
+        return self
+
+    @property
+    def first_timestamp(self):
+        starts = [times[0] for times in self._times.values() if len(times)]
+        return int(min(starts)) if starts else None
+
+    def lookup(self, key, at_ms, ranges=None):
+        """
+        Última respuesta grabada de una clave en o antes de at_ms
+        (la primera si el reloj aún no ha llegado a ninguna). Si la petición
+        lleva rangos (ver request_range), entre las últimas grabaciones se
+        elige la de rango más parecido y, a igualdad, la más reciente.
+        """
+        times = self._times.get(key)
+        if times is None or len(times) == 0:
+            self.stats[key]['misses'] += 1
+            return None
+        pos = max(int(np.searchsorted(times, at_ms, side='right')) - 1, 0)
+        self.stats[key]['hits'] += 1
+        entries = self._entries[key]
+        if not ranges:
+            return entries[pos]
+        candidates = entries[max(pos - RANGE_CANDIDATES + 1, 0):pos + 1]
+        return min(reversed(candidates), key=lambda e: _range_distance(ranges, e.get('range')))
+
+    def summary(self):
+        return {
+            'keys': len(self._entries),
+            'payloads': int(sum(len(t) for t in self._times.values())),
+            'first_timestamp': self.first_timestamp,
+            'requests': {key: dict(value) for key, value in self.stats.items()}
+        }
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Adaptador que hace la petición real y graba la respuesta"""
+
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        ranges = request_range(request.url, now_ms())
+        response = super().send(request, **kwargs)
+        try:
+            self.archive.append(request_key(request.method, request.url),
+                                response.status_code, response.headers, response.text, ranges)
+        except Exception as e:
+            print(f"Error grabando respuesta de {request.url}: {e}")
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """Adaptador que responde con las grabaciones según el reloj simulado, sin red"""
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        at_ms = now_ms()
+        entry = self.archive.lookup(request_key(request.method, request.url), at_ms,
+                                    request_range(request.url, at_ms))
+        if entry is None:
+            raise requests.ConnectionError(f"Sin respuesta grabada para {request.method} {request.url}", request=request)
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict({'Content-Type': entry['content_type']})
+        response._content = entry['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK' if entry['status'] < 400 else 'Recorded error'
+        return response
+
+    def close(self):
+        pass
+
+
+def _parse_start(value):
+    if value.isdigit():
+        return int(value)
+    start = datetime.fromisoformat(value)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000)
+
+
+_archive = None
+_session = None
+_setup_lock = threading.Lock()
+
+
+def get_archive():
+    """Archivo de grabaciones del modo actual (None en modo live)"""
+    global _archive
+    with _setup_lock:
+        if _archive is None and HTTP_MODE in ('record', 'replay'):
+            _archive = PayloadArchive()
+            if HTTP_MODE == 'replay':
+                _archive.load()
+                start_ms = _parse_start(REPLAY_START) if REPLAY_START else _archive.first_timestamp
+                if start_ms is not None and get_clock() is None:
+                    set_clock(ReplayClock(start_ms, REPLAY_SPEED))
+                print(f"Modo replay: {_archive.summary()['payloads']} respuestas grabadas, velocidad x{REPLAY_SPEED}")
+        return _archive
+
+
+def configure_session(session):
+    """
+    Monta en una sesión de requests el adaptador del modo actual.
+    Se usa también con la sesión interna de cada exchange de ccxt.
+    """
+    archive = get_archive()
+    if HTTP_MODE == 'record':
+        adapter = RecordingAdapter(archive)
+    elif HTTP_MODE == 'replay':
+        adapter = ReplayAdapter(archive)
+    else:
+        return session
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def http_session():
+    """Sesión HTTP compartida por los servicios (reutiliza conexiones)"""
+    global _session
+    if _session is None:
+        session = configure_session(requests.Session())
+        with _setup_lock:
+            if _session is None:
+                _session = session
+    return _session
+
+
+def replay_status():
+    """Estado del modo HTTP: reloj simulado y uso de las grabaciones"""
+    clock = get_clock()
+    status = {'mode': HTTP_MODE, 'now': now_ms()}
+    if clock is not None:
+        status.update({'replay_start': clock.start_ms, 'speed': clock.speed})
+    archive = get_archive()
+    if archive is not None and HTTP_MODE == 'replay':
+        status['archive'] = archive.summary()
+    return status
+
+
+def reset_replay(start=None, speed=None):
+    """
+    Reinicia el reloj del replay (opcionalmente desde otro instante o a otra velocidad)
+
+    Returns:
+        Estado actualizado, o None si la aplicación no está en modo replay
+    """
+    clock = get_clock()
+    if HTTP_MODE != 'replay' or clock is None:
+        return None
+    clock.reset(_parse_start(str(start)) if start is not None else None, speed)
+    return replay_status()
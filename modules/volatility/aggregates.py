@@ -0,0 +1,214 @@
+"""
+Agregados de la cadena de opciones (OI y volumen por vencimiento, tipo y
+strike, curva de dolor) mantenidos incrementalmente entre snapshots
+"""
+import copy
+
+import numpy as np
+
+from modules.volatility.analytics import pain_curve
+from modules.volatility.chain import CALL, PUT, as_float64
+
+# Por encima de esta fracción de filas cambiadas sale más barato recalcular todo
+MAX_CHANGED_FRACTION = 0.25
+# Actualizaciones incrementales seguidas antes de recalcular desde cero
+# (acota el error acumulado por las sumas y restas en coma flotante)
+REBUILD_EVERY = 500
+
+
+def _values(column):
+    return np.nan_to_num(as_float64(column))
+
+
+def _pain_rows(candidates, strike, is_call, weight):
+    """Aportación de cada fila (con peso weight) a la curva de dolor: matriz filas x candidatos"""
+    intrinsic = np.where(is_call[:, None], candidates[None, :] - strike[:, None], strike[:, None] - candidates[None, :])
+    return np.maximum(intrinsic, 0.0) * weight[:, None]
+
+
+class ChainAggregates:
+    """
+    Agregados de un snapshot de la cadena sobre la rejilla vencimiento x strike
+    (todos los strikes listados en la cadena):
+
+    - oi_grid, volume_grid: [vencimiento, tipo, strike]
+    - pain: [vencimiento, strike], pago de cada vencimiento si se liquida en
+      ese strike (la curva de varios vencimientos es la suma de sus filas)
+    - listed: [vencimiento, strike], strikes que existen en cada vencimiento
+
+    El snapshot siguiente se obtiene con from_snapshot: se comparan las filas
+    instrumento a instrumento y solo las que cambian de OI o volumen se
+    aplican a las rejillas. Si cambia el conjunto de instrumentos (altas,
+    vencimientos que expiran...) se recalcula todo.
+    """
+
+    @classmethod
+    def build(cls, chain):
+        """Agregados calculados desde cero sobre todas las filas"""
+        agg = cls.__new__(cls)
+        agg.currency = chain.currency
+        agg.version = chain.version
+        agg.timestamp = chain.timestamp
+        agg.names = chain['instrument_name']
+        agg.expiries = chain.expiries
+        agg.bounds = chain.expiry_bounds.copy()
+        agg.strike = as_float64(chain['strike'])
+        agg.strikes = np.unique(agg.strike)
+        agg.strike_idx = np.searchsorted(agg.strikes, agg.strike)
+        agg.expiry_code = chain['expiry_code'].astype(np.intp)
+        agg.type_code = chain['type_code'].astype(np.intp)
+        agg.is_call = agg.type_code == CALL
+        # Columnas tal como vienen (float32) para comparar con el snapshot siguiente
+        agg.raw_oi, agg.raw_volume = chain['open_interest'], chain['volume']
+        agg.oi = _values(agg.raw_oi)
+        agg.volume = _values(agg.raw_volume)
+
+        shape = (len(agg.expiries), len(agg.strikes))
+        cells = (agg.expiry_code, agg.type_code, agg.strike_idx)
+        agg.listed = np.zeros(shape, dtype=bool)
+        agg.listed[agg.expiry_code, agg.strike_idx] = True
+        agg.oi_grid = np.zeros((shape[0], 2, shape[1]))
+        np.add.at(agg.oi_grid, cells, agg.oi)
+        agg.volume_grid = np.zeros((shape[0], 2, shape[1]))
+        np.add.at(agg.volume_grid, cells, agg.volume)
+        agg.pain = np.zeros(shape)
+        for e in range(shape[0]):
+            rows = slice(int(agg.bounds[e]), int(agg.bounds[e + 1]))
+            if rows.stop > rows.start:
+                agg.pain[e] = pain_curve(agg.strikes, agg.strike[rows], agg.is_call[rows], agg.oi[rows])
+
+        agg.incremental_updates = 0
+        agg.changed_rows = len(chain)
+        return agg
+
+    def _same_instruments(self, chain):
+        names = chain['instrument_name']
+        return (
+            chain.currency == self.currency
+            and len(names) == len(self.names)
+            and np.array_equal(chain.expiries, self.expiries)
+            # Los nombres están internados: la comparación es casi siempre por identidad
+            and (names is self.names or bool(np.all(names == self.names)))
+        )
+
+    def advance(self, chain):
+        """
+        Agregados del snapshot chain aplicando solo las filas que han cambiado
+
+        Returns:
+            ChainAggregates nuevo (este no se modifica) o None si hay que
+            recalcular desde cero (otros instrumentos o demasiados cambios)
+        """
+        if not self._same_instruments(chain):
+            return None
+        raw_oi, raw_volume = chain['open_interest'], chain['volume']
+        changed = np.nonzero((raw_oi != self.raw_oi) | (raw_volume != self.raw_volume))[0]
+        if len(changed) > MAX_CHANGED_FRACTION * len(raw_oi):
+            return None
+
+        agg = copy.copy(self)
+        agg.version, agg.timestamp, agg.names = chain.version, chain.timestamp, chain['instrument_name']
+        agg.raw_oi, agg.raw_volume = raw_oi, raw_volume
+        agg.incremental_updates = self.incremental_updates + 1
+        agg.changed_rows = len(changed)
+        if len(changed) == 0:
+            return agg
+
+        # Solo se convierten las filas cambiadas
+        agg.oi, agg.volume = self.oi.copy(), self.volume.copy()
+        agg.oi[changed], agg.volume[changed] = _values(raw_oi[changed]), _values(raw_volume[changed])
+        d_oi = agg.oi[changed] - self.oi[changed]
+        d_volume = agg.volume[changed] - self.volume[changed]
+
+        cells = (self.expiry_code[changed], self.type_code[changed], self.strike_idx[changed])
+        agg.oi_grid = self.oi_grid.copy()
+        np.add.at(agg.oi_grid, cells, d_oi)
+        agg.volume_grid = self.volume_grid.copy()
+        np.add.at(agg.volume_grid, cells, d_volume)
+
+        moved = d_oi != 0
+        if moved.any():
+            rows = changed[moved]
+            agg.pain = self.pain.copy()
+            np.add.at(agg.pain, self.expiry_code[rows],
+                      _pain_rows(self.strikes, self.strike[rows], self.is_call[rows], d_oi[moved]))
+        return agg
+
+    @classmethod
+    def from_snapshot(cls, chain, previous=None):
+        """
+        Agregados de un snapshot completo de la cadena (no de una vista),
+        partiendo de los de un snapshot anterior si se pueden reutilizar
+        """
+        if previous is not None and previous.incremental_updates < REBUILD_EVERY:
+            agg = previous.advance(chain)
+            if agg is not None:
+                return agg
+        return cls.build(chain)
+
+    def _selection(self, chain):
+        """
+        Máscara de los vencimientos de una (sub)cadena de este snapshot; None si
+        no es de este snapshot o no contiene vencimientos completos
+        """
+        if chain.version != self.version or chain.currency != self.currency:
+            return None
+        counts = np.diff(chain.expiry_bounds)
+        selected = counts > 0
+        if not np.array_equal(counts[selected], np.diff(self.bounds)[selected]):
+            return None
+        return selected
+
+    def totals(self, chain, nearest_expiry=False):
+        """
+        OI y volumen por tipo y max pain de una (sub)cadena a partir de las
+        rejillas (mismo resultado que analytics.chain_totals)
+
+        Returns:
+            Dict o None si los agregados no cubren la cadena
+        """
+        selected = self._selection(chain)
+        if selected is None:
+            return None
+        oi = self.oi_grid[selected].sum(axis=(0, 2))
+        volume = self.volume_grid[selected].sum(axis=(0, 2))
+
+        pain_selected = selected
+        if nearest_expiry:
+            codes = np.nonzero(selected)[0]
+            upcoming = codes[self.expiries[codes] >= np.datetime64(self.timestamp.date(), 'D')]
+            if len(codes) > 1 and len(upcoming):
+                pain_selected = np.zeros_like(selected)
+                pain_selected[upcoming[0]] = True
+
+        candidates = np.nonzero(self.listed[pain_selected].any(axis=0))[0]
+        curve = self.pain[pain_selected].sum(axis=0)
+        return {
+            'call_oi': float(oi[CALL]),
+            'put_oi': float(oi[PUT]),
+            'call_volume': float(volume[CALL]),
+            'put_volume': float(volume[PUT]),
+            'max_pain': float(self.strikes[candidates[np.argmin(curve[candidates])]]) if len(candidates) else 0.0
+        }
+
+    def by_strike(self, chain):
+        """
+        OI y volumen de calls y puts por strike de los vencimientos de una
+        (sub)cadena (solo strikes listados); None si no la cubren
+        """
+        selected = self._selection(chain)
+        if selected is None:
+            return None
+        listed = self.listed[selected].any(axis=0)
+        oi = self.oi_grid[selected].sum(axis=0)[:, listed]
+        volume = self.volume_grid[selected].sum(axis=0)[:, listed]
+        return {
+            'strike': self.strikes[listed],
+            'call_oi': oi[CALL], 'put_oi': oi[PUT],
+            'call_volume': volume[CALL], 'put_volume': volume[PUT]
+        }
+
+    def by_expiry(self):
+        """OI total por vencimiento (solo vencimientos con instrumentos)"""
+        present = np.diff(self.bounds) > 0
+        return self.expiries[present], self.oi_grid.sum(axis=(1, 2))[present]
@@ -0,0 +1,126 @@
+"""
+Métricas vectorizadas de la cadena de opciones (max pain, OI, put/call)
+"""
+import numpy as np
+
+from modules.volatility.chain import CALL, as_float64
+
+
+def pain_curve(candidates, strike, is_call, open_interest):
+    """
+    Pago total a los compradores de opciones si el subyacente liquida en cada
+    precio candidato. Se evalúa en O((n + m) log n) con sumas acumuladas de OI
+    y OI*strike en lugar de recorrer todos los strikes para cada candidato.
+
+    Args:
+        candidates: Precios de liquidación (ordenados o no)
+        strike, is_call, open_interest: Columnas de las opciones
+
+    Returns:
+        Array float64 alineado con candidates
+    """
+    candidates = np.asarray(candidates, dtype=np.float64)
+    strike = np.asarray(strike, dtype=np.float64)
+    is_call = np.asarray(is_call, dtype=bool)
+    oi = np.nan_to_num(np.asarray(open_interest, dtype=np.float64))
+
+    def prefix_sums(mask):
+        order = np.argsort(strike[mask], kind='stable')
+        k, w = strike[mask][order], oi[mask][order]
+        return k, np.r_[0.0, np.cumsum(w)], np.r_[0.0, np.cumsum(w * k)]
+
+    # Calls: paga sum(oi * (S - K)) sobre los strikes K < S
+    k, cum_oi, cum_koi = prefix_sums(is_call)
+    below = np.searchsorted(k, candidates, side='left')
+    call_loss = candidates * cum_oi[below] - cum_koi[below]
+
+    # Puts: paga sum(oi * (K - S)) sobre los strikes K > S
+    k, cum_oi, cum_koi = prefix_sums(~is_call)
+    upto = np.searchsorted(k, candidates, side='right')
+    put_loss = (cum_koi[-1] - cum_koi[upto]) - candidates * (cum_oi[-1] - cum_oi[upto])
+
+    return call_loss + put_loss
+
+
+def max_pain(strike, is_call, open_interest):
+    """
+    Strike de máximo dolor: el precio de liquidación (entre los strikes
+    listados) que minimiza el pago total a los compradores de opciones
+
+    Returns:
+        float con el strike (0.0 si no hay strikes)
+    """
+    strike = np.asarray(strike, dtype=np.float64)
+    if len(strike) == 0:
+        return 0.0
+    candidates = np.unique(strike)
+    return float(candidates[np.argmin(pain_curve(candidates, strike, is_call, open_interest))])
+
+
+def chain_totals(chain, nearest_expiry=False):
+    """OI y volumen por tipo y max pain de una (sub)cadena, calculados sobre todas sus filas"""
+    is_call = chain['type_code'] == CALL
+    oi = np.nan_to_num(as_float64(chain['open_interest']))
+    volume = np.nan_to_num(as_float64(chain['volume']))
+
+    pain_chain = chain
+    if nearest_expiry:
+        dates = chain.expiration_dates()
+        upcoming = dates[dates >= np.datetime64(chain.timestamp.date(), 'D')]
+        if len(dates) > 1 and len(upcoming):
+            pain_chain = chain.for_expiry(upcoming[0])
+
+    return {
+        'call_oi': float(oi[is_call].sum()),
+        'put_oi': float(oi[~is_call].sum()),
+        'call_volume': float(volume[is_call].sum()),
+        'put_volume': float(volume[~is_call].sum()),
+        'max_pain': max_pain(as_float64(pain_chain['strike']), pain_chain['type_code'] == CALL, pain_chain['open_interest'])
+    }
+
+
+def chain_metrics(chain, nearest_expiry=False, aggregates=None):
+    """
+    Métricas agregadas de una (sub)cadena de opciones
+
+    Args:
+        chain: OptionsChain (o vista de un vencimiento)
+        nearest_expiry: Si hay varios vencimientos, calcular el max pain solo
+            sobre el más próximo no vencido (el max pain es por vencimiento)
+        aggregates: ChainAggregates del snapshot (opcional); si cubre la cadena,
+            OI, volumen y max pain salen de ahí sin recorrer las filas
+
+    Returns:
+        Dict con OI y volumen por tipo, ratios put/call, max pain y nocional
+    """
+    if chain is None or chain.empty:
+        return {
+            'call_oi': 0.0, 'put_oi': 0.0, 'total_oi': 0.0, 'call_volume': 0.0, 'put_volume': 0.0,
+            'put_call_ratio_oi': 0.0, 'put_call_ratio_volume': 0.0, 'max_pain': 0.0,
+            'notional_value_usd': 0.0, 'notional_value_asset': 0.0, 'underlying_price': 0.0
+        }
+
+    totals = aggregates.totals(chain, nearest_expiry) if aggregates is not None else None
+    if totals is None:
+        totals = chain_totals(chain, nearest_expiry)
+    call_oi, put_oi = totals['call_oi'], totals['put_oi']
+    call_volume, put_volume = totals['call_volume'], totals['put_volume']
+
+    # El nocional depende del forward de cada fila, que cambia en cada snapshot
+    oi = np.nan_to_num(as_float64(chain['open_interest']))
+    underlying = as_float64(chain['underlying_price'])
+    finite = underlying[np.isfinite(underlying)]
+    return {
+        'call_oi': call_oi,
+        'put_oi': put_oi,
+        'total_oi': call_oi + put_oi,
+        'call_volume': call_volume,
+        'put_volume': put_volume,
+        'put_call_ratio_oi': put_oi / call_oi if call_oi > 0 else 0.0,
+        'put_call_ratio_volume': put_volume / call_volume if call_volume > 0 else 0.0,
+        'max_pain': totals['max_pain'],
+        # Nocional fila a fila (cada opción con el precio de su subyacente)
+        'notional_value_usd': float(np.nansum(oi * underlying)),
+        'notional_value_asset': call_oi + put_oi,
+        'underlying_price': float(finite[0]) if len(finite) else 0.0
+    }
@@ -0,0 +1,346 @@
+"""
+Archivo histórico de snapshots de la cadena de opciones en Parquet,
+particionado por moneda y fecha
+"""
+import os
+import queue
+import threading
+from datetime import timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config.paths import STORE_DIR
+from modules.volatility.chain import NUMERIC_FIELDS, OPTION_TYPES
+from modules.replay.clock import now_ms as clock_ms
+
+# Columnas de cada fila archivada (las griegas no se guardan: se recalculan)
+KEY_FIELDS = ('instrument_name', 'expiration_date', 'strike', 'type')
+VALUE_FIELDS = NUMERIC_FIELDS
+COMPRESSION = 'zstd'
+COMPACT_FILE = 'compact.parquet'
+# Snapshots pendientes de archivar como máximo (si se llena se descartan)
+QUEUE_SIZE = 32
+
+SCHEMA = pa.schema(
+    [
+        ('snapshot', pa.int64()),
+        ('instrument_name', pa.string()),
+        ('expiration_date', pa.date32()),
+        ('strike', pa.float32()),
+        ('type', pa.dictionary(pa.int8(), pa.string())),
+        ('removed', pa.bool_()),
+    ]
+    + [(field, pa.float32()) for field in VALUE_FIELDS]
+)
+
+
+class ChainArchive:
+    """
+    Guarda cada snapshot de la cadena como un fichero Parquet comprimido en
+    <directorio>/<MONEDA>/<YYYY-MM-DD>/<versión>.parquet.
+
+    El primer snapshot de cada día es completo; los siguientes solo contienen
+    las filas que han cambiado respecto al anterior y las que han desaparecido
+    (marcadas con removed=True). Al empezar un día nuevo, el anterior se compacta
+    en un único fichero ordenado por instrumento. Tras reiniciar el proceso, el
+    diff parte del estado archivado del día y se compactan los días pendientes.
+    Las lecturas usan memory map y solo cargan las columnas pedidas.
+
+    Desde las peticiones se usa submit: la escritura y la compactación se hacen
+    en un hilo propio, en el orden en que llegan los snapshots.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(STORE_DIR, 'chains')
+        # Último snapshot archivado por moneda: (día, DataFrame indexado por instrumento)
+        self._last = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def _partition(self, currency, day):
+        return os.path.join(self.directory, currency.upper(), str(day))
+
+    def _partition_files(self, currency, day):
+        path = self._partition(currency, day)
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.parquet'))
+
+    def days(self, currency):
+        """Días archivados de una moneda, en orden cronológico"""
+        path = os.path.join(self.directory, currency.upper())
+        if not os.path.isdir(path):
+            return []
+        return sorted(name for name in os.listdir(path) if self._partition_files(currency, name))
+
+    @staticmethod
+    def _chain_frame(chain):
+        cols = chain.columns
+        frame = pd.DataFrame({
+            'instrument_name': cols['instrument_name'],
+            'expiration_date': chain.expiries[cols['expiry_code']],
+            'strike': cols['strike'],
+            'type': np.asarray(OPTION_TYPES)[cols['type_code']],
+        })
+        for field in VALUE_FIELDS:
+            frame[field] = cols[field]
+        return frame.set_index('instrument_name', drop=False)
+
+    def record(self, chain):
+        """
+        Archiva un snapshot de la cadena
+
+        Args:
+            chain: OptionsChain
+
+        Returns:
+            Número de filas escritas (0 si no había cambios)
+        """
+        if chain is None or chain.empty:
+            return 0
+        currency = chain.currency.upper()
+        day = chain.timestamp.astimezone(timezone.utc).date()
+        current = self._chain_frame(chain)
+
+        with self._lock:
+            previous = self._last.get(currency)
+            if previous is None:
+                previous = self._resume(currency, day)
+            if previous is None or previous[0] != day:
+                if previous is not None:
+                    self.compact(currency, previous[0])
+                # Primer snapshot del día: completo
+                rows = current.assign(removed=False)
+            else:
+                rows = self._changed_rows(previous[1], current)
+            self._last[currency] = (day, current)
+            if rows.empty:
+                return 0
+
+            table = self._to_table(rows, chain.version)
+            path = self._partition(currency, day)
+            os.makedirs(path, exist_ok=True)
+            pq.write_table(table, os.path.join(path, f"{chain.version}.parquet"), compression=COMPRESSION)
+            return len(rows)
+
+    def submit(self, chain):
+        """
+        Encola un snapshot para archivarlo en segundo plano
+
+        Returns:
+            False si se ha descartado (cadena vacía o cola llena). Perder un
+            snapshot no rompe el archivo: el siguiente se compara con el último
+            que sí se escribió.
+        """
+        if chain is None or chain.empty:
+            return False
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(chain)
+        except queue.Full:
+            print(f"Cola del archivo llena: se descarta el snapshot {chain.version} de {chain.currency}")
+            return False
+        return True
+
+    def flush(self):
+        """Espera a que se hayan archivado los snapshots encolados"""
+        self._queue.join()
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+
+            def run():
+                while True:
+                    chain = self._queue.get()
+                    try:
+                        self.record(chain)
+                    except Exception as e:
+                        print(f"Error archivando la cadena de {chain.currency}: {e}")
+                    finally:
+                        self._queue.task_done()
+
+            self._worker = threading.Thread(target=run, name='chain-archive', daemon=True)
+            self._worker.start()
+
+    def _resume(self, currency, day):
+        """
+        Estado de partida del primer snapshot del proceso: se compactan los días
+        anteriores que quedaron sin compactar y, si el día ya tiene ficheros, se
+        reconstruye su último estado para que el diff marque como removed los
+        instrumentos que han desaparecido mientras el proceso estaba parado
+
+        Returns:
+            (día, DataFrame indexado por instrumento) o None si el día está vacío
+        """
+        for archived in self.days(currency):
+            if archived < str(day):
+                self.compact(currency, archived)
+        frame = self._partition_state(currency, day, [*KEY_FIELDS, *VALUE_FIELDS])
+        if frame is None or frame.empty:
+            return None
+        frame['expiration_date'] = pd.to_datetime(frame['expiration_date']).to_numpy(dtype='datetime64[D]')
+        frame['type'] = frame['type'].astype(str)
+        return day, frame.set_index('instrument_name', drop=False)
+
+    @staticmethod
+    def _changed_rows(previous, current):
+        """Filas nuevas o con algún valor distinto, más las que ya no existen"""
+        aligned = previous.reindex(current.index)
+        new = aligned['strike'].isna().to_numpy()
+        changed = np.zeros(len(current), dtype=bool)
+        for field in VALUE_FIELDS:
+            before, after = aligned[field].to_numpy(), current[field].to_numpy()
+            changed |= ~((before == after) | (np.isnan(before) & np.isnan(after)))
+        rows = current[new | changed].assign(removed=False)
+
+        gone = previous[~previous.index.isin(current.index)]
+        if len(gone):
+            rows = pd.concat([rows, gone.assign(removed=True)])
+        return rows
+
+    @staticmethod
+    def _to_table(rows, version):
+        data = {
+            'snapshot': np.full(len(rows), version, dtype=np.int64),
+            'instrument_name': rows['instrument_name'].to_numpy(dtype=object),
+            'expiration_date': rows['expiration_date'].to_numpy(dtype='datetime64[D]'),
+            'strike': rows['strike'].to_numpy(dtype=np.float32),
+            'type': pa.DictionaryArray.from_arrays(
+                pa.array(pd.Categorical(rows['type'], categories=OPTION_TYPES).codes, type=pa.int8()),
+                pa.array(OPTION_TYPES)
+            ),
+            'removed': rows['removed'].to_numpy(dtype=bool),
+        }
+        for field in VALUE_FIELDS:
+            data[field] = rows[field].to_numpy(dtype=np.float32)
+        return pa.table(data, schema=SCHEMA)
+
+    def _read(self, files, columns, filters=None):
+        if not files:
+            return None
+        table = pq.read_table(files, columns=list(columns), filters=filters, memory_map=True, schema=SCHEMA)
+        return table.to_pandas()
+
+    def compact(self, currency, day):
+        """
+        Une todos los ficheros de un día en uno solo ordenado por instrumento y
+        snapshot (las series de un instrumento se leen entonces por row groups)
+        """
+        files = self._partition_files(currency, day)
+        if len(files) <= 1:
+            return
+        try:
+            table = pq.read_table(files, memory_map=True, schema=SCHEMA)
+            table = table.sort_by([('instrument_name', 'ascending'), ('snapshot', 'ascending')])
+            path = os.path.join(self._partition(currency, day), COMPACT_FILE)
+            tmp_path = path + '.tmp'
+            pq.write_table(table, tmp_path, compression=COMPRESSION, row_group_size=20000)
+            os.replace(tmp_path, path)
+            for name in files:
+                if name != path:
+                    os.remove(name)
+        except Exception as e:
+            print(f"Error compactando el archivo de {currency} {day}: {e}")
+
+    def snapshot(self, currency, at=None, columns=None):
+        """
+        Reconstruye la cadena archivada tal como estaba en un momento dado
+
+        Args:
+            currency: Moneda
+            at: Momento (datetime, str ISO o ms); por defecto, ahora según el
+                reloj de la aplicación (el instante simulado en replay)
+            columns: Columnas de valores a cargar (por defecto, todas)
+
+        Returns:
+            DataFrame con una fila por instrumento y la columna 'snapshot' con la
+            versión en que cambió por última vez, o None si no hay datos
+        """
+        at_ms = _to_ms(at) if at is not None else clock_ms()
+        value_columns = [c for c in (columns or VALUE_FIELDS) if c in VALUE_FIELDS]
+        wanted = ['snapshot', *KEY_FIELDS, 'removed', *value_columns]
+
+        last_day = str(pd.Timestamp(at_ms, unit='ms').date())
+        days = [d for d in self.days(currency) if d <= last_day]
+        if not days:
+            return None
+
+        frame = self._partition_state(currency, days[-1], wanted, at_ms)
+        if (frame is None or frame.empty) and len(days) > 1:
+            # `at` es anterior al primer snapshot de su día: vale el estado final del día previo
+            frame = self._partition_state(currency, days[-2], wanted, at_ms)
+        if frame is None or frame.empty:
+            return None
+        return frame.sort_values(['expiration_date', 'type', 'strike']).reset_index(drop=True)
+
+    def _partition_state(self, currency, day, columns, at_ms=None):
+        """
+        Última fila vigente de cada instrumento de un día (hasta at_ms). Cada día
+        empieza con un snapshot completo, así que basta con su partición.
+        """
+        columns = list(dict.fromkeys(['snapshot', 'instrument_name', 'removed', *columns]))
+        filters = [('snapshot', '<=', at_ms)] if at_ms is not None else None
+        frame = self._read(self._partition_files(currency, day), columns, filters)
+        if frame is None or frame.empty:
+            return None
+        frame = frame.sort_values('snapshot', kind='stable').drop_duplicates('instrument_name', keep='last')
+        return frame[~frame['removed']].drop(columns='removed')
+
+    def instrument_series(self, instrument_name, start=None, end=None, columns=None):
+        """
+        Serie temporal de un instrumento (solo los snapshots en que cambió)
+
+        Args:
+            instrument_name: Nombre Deribit (ej: BTC-27DEC25-100000-C)
+            start, end: Límites (datetime, str ISO o ms); end por defecto es ahora
+            columns: Columnas de valores a cargar (por defecto, todas)
+
+        Returns:
+            DataFrame ordenado por snapshot o None si no hay datos
+        """
+        currency = instrument_name.split('-')[0].split('_')[0]
+        start_ms = _to_ms(start) if start is not None else None
+        end_ms = _to_ms(end) if end is not None else clock_ms()
+        value_columns = [c for c in (columns or VALUE_FIELDS) if c in VALUE_FIELDS]
+
+        days = self.days(currency)
+        if start_ms is not None:
+            first_day = str(pd.Timestamp(start_ms, unit='ms').date())
+            days = [d for d in days if d >= first_day]
+        last_day = str(pd.Timestamp(end_ms, unit='ms').date())
+        days = [d for d in days if d <= last_day]
+
+        filters = [('instrument_name', '=', instrument_name), ('snapshot', '<=', end_ms)]
+        files = [f for day in days for f in self._partition_files(currency, day)]
+        frame = self._read(files, ['snapshot', 'removed', *value_columns], filters)
+        if frame is None or frame.empty:
+            return None
+
+        frame = frame.sort_values('snapshot', kind='stable')
+        if start_ms is not None:
+            # Se conserva el último valor anterior al inicio (vigente en start)
+            before = frame['snapshot'].to_numpy() < start_ms
+            if before.any():
+                before[np.nonzero(before)[0][-1]] = False
+            frame = frame[~before]
+        frame['timestamp'] = pd.to_datetime(frame['snapshot'], unit='ms', utc=True)
+        return frame.reset_index(drop=True)
+
+
+def _to_ms(value):
+    """datetime, str ISO o número -> timestamp en ms"""
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return int(ts.timestamp() * 1000)
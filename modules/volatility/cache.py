@@ -0,0 +1,114 @@
+"""
+Caché compartida de datos de derivados: con TTL, acotada y de una sola carga por clave
+"""
+import threading
+from collections import OrderedDict
+
+from modules.replay.clock import now_ms
+
+
+class _Flight:
+    """Carga en curso de una clave: el resto de hilos espera su resultado"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class DataCache:
+    """
+    Caché thread-safe con expiración por entrada (reloj de replay), límite de
+    entradas (se descarta la usada hace más tiempo) y single-flight: si varios
+    hilos piden a la vez una clave caducada, solo uno la descarga y los demás
+    reciben el mismo resultado.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        # clave -> (caduca_ms, valor), en orden de uso
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader, ttl_seconds, valid=None):
+        """
+        Valor de una clave, cargándolo con loader() si falta o ha caducado
+
+        Args:
+            key: Clave hashable
+            loader: Función sin argumentos que descarga el valor
+            ttl_seconds: Segundos de validez
+            valid: Predicado sobre el valor cargado; si no lo cumple (por
+                defecto, None) se sigue sirviendo el valor anterior
+
+        Returns:
+            El valor (o el anterior caducado si la carga falla o no es válida)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now_ms():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        stale = entry[1] if entry is not None else None
+        try:
+            value = loader()
+            if (valid(value) if valid is not None else value is not None):
+                self._store(key, value, ttl_seconds)
+            else:
+                value = stale
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _store(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (now_ms() + int(ttl_seconds * 1000), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def peek(self, key):
+        """Valor guardado (aunque haya caducado) sin cargar nada; None si no existe"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[1] if entry is not None else None
+
+    def invalidate(self, key=None):
+        """Borra una clave (o todas)"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'inflight': len(self._inflight)
+            }
@@ -0,0 +1,309 @@
+"""
+Representación columnar compacta de la cadena de opciones de Deribit
+"""
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+from modules.replay.clock import utc_now
+
+# Tipos de opción codificados como enteros (índice en OPTION_TYPES)
+OPTION_TYPES = ('C', 'P')
+CALL, PUT = 0, 1
+
+# Campos numéricos del book summary que se conservan como float32
+NUMERIC_FIELDS = (
+    'mark_iv', 'mark_price', 'underlying_price', 'open_interest', 'volume',
+    'volume_usd', 'bid_price', 'ask_price', 'last', 'interest_rate'
+)
+
+# Griegas almacenadas como columnas planas
+GREEK_FIELDS = ('delta', 'gamma', 'vega', 'theta', 'vanna')
+
+# Nombre de instrumento de Deribit: BTC-11JUL25-106000-C, XRP_USDC-25JUL25-2d5-P
+INSTRUMENT_PATTERN = (
+    r'^(?P<currency>[A-Z0-9]+)(?:_(?P<settlement>[A-Z]+))?'
+    r'-(?P<expiry>\d{1,2}[A-Z]{3}\d{2})-(?P<strike>[0-9]+(?:d[0-9]+)?)-(?P<type>[CP])$'
+)
+
+# Caché de nombres ya decodificados (índice = instrument_name)
+PARSE_CACHE_MAX = 200000
+_parsed_names = None
+_parse_lock = threading.Lock()
+
+
+def _decode_instrument_names(names):
+    """Decodifica en una sola pasada vectorizada una lista de nombres únicos"""
+    parts = pd.Series(names, dtype=object).astype(str).str.extract(INSTRUMENT_PATTERN)
+    expiry = pd.to_datetime(parts['expiry'], format='%d%b%y', errors='coerce')
+    strike = pd.to_numeric(parts['strike'].str.replace('d', '.', regex=False), errors='coerce')
+    decoded = pd.DataFrame({
+        'currency': parts['currency'].to_numpy(dtype=object),
+        'settlement': parts['settlement'].to_numpy(dtype=object),
+        'expiry': expiry.to_numpy(dtype='datetime64[D]'),
+        'strike': strike.to_numpy(dtype=np.float64),
+        'type_code': parts['type'].map({'C': CALL, 'P': PUT}).to_numpy(dtype=np.float64),
+    }, index=pd.Index(names, dtype=object, name='instrument_name'))
+    return decoded
+
+
+def parse_instrument_names(names):
+    """
+    Decodifica moneda, vencimiento, strike y tipo de una lista de instrumentos
+
+    Solo se parsean con la expresión regular los nombres que no están en la caché;
+    el resto se resuelve con una búsqueda vectorizada sobre el índice.
+
+    Args:
+        names: Secuencia de nombres de instrumento
+
+    Returns:
+        DataFrame alineado con names (columnas currency, settlement, expiry,
+        strike, type_code); las filas no válidas quedan con NaN/NaT
+    """
+    global _parsed_names
+    names = pd.Index(names, dtype=object)
+    cache = _parsed_names
+    if cache is None:
+        missing = names.unique()
+    else:
+        missing = names[cache.index.get_indexer(names) < 0].unique()
+
+    if len(missing):
+        needed = _decode_instrument_names(missing)
+        if cache is not None and len(missing) < len(names.unique()):
+            # Filas de todos los nombres pedidos: las ya conocidas salen de la caché leída arriba
+            known = names.unique().difference(missing)
+            needed = pd.concat([cache.take(cache.index.get_indexer(known)), needed])
+        with _parse_lock:
+            current = _parsed_names
+            added = needed if current is None else needed[~needed.index.isin(current.index)]
+            if current is None or len(current) + len(added) > PARSE_CACHE_MAX:
+                # Se vacía la caché pero conservando todo lo que resuelve esta llamada
+                current = needed
+            else:
+                current = pd.concat([current, added])
+            _parsed_names = cache = current
+
+    return cache.take(cache.index.get_indexer(names)).reset_index(drop=True)
+
+
+def deribit_expiry_code(day):
+    """Formatea una fecha como en los nombres de Deribit (datetime64 -> '11JUL25')"""
+    ts = pd.Timestamp(day)
+    return f"{ts.day}{ts.strftime('%b%y').upper()}"
+
+
+def as_float64(values):
+    """
+    Convierte una columna float32 a float64 redondeando a 7 cifras significativas,
+    para que 0.1 no se serialice como 0.10000000149011612
+    """
+    wide = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(wide)))
+    scale = np.power(10.0, 6 - np.nan_to_num(magnitude, nan=0.0, posinf=0.0, neginf=0.0))
+    return np.round(wide * scale) / scale
+
+
+class OptionsChain:
+    """
+    Cadena de opciones en formato columnar.
+
+    Las filas se ordenan por vencimiento, tipo y strike, de modo que cada
+    vencimiento ocupa un rango contiguo y se puede extraer como vista sin copia.
+    El tipo y el vencimiento se guardan como códigos enteros, los valores
+    numéricos como float32 y los nombres de instrumento internados.
+    """
+
+    def __init__(self, currency, columns, expiries, timestamp=None):
+        self.currency = currency
+        self.columns = columns
+        self.expiries = expiries
+        # Reloj de la aplicación: en replay, el instante simulado
+        self.timestamp = timestamp or utc_now()
+        self.version = int(self.timestamp.timestamp() * 1000)
+        # Límites [inicio, fin) de cada vencimiento dentro de las columnas
+        self.expiry_bounds = np.searchsorted(columns['expiry_code'], np.arange(len(expiries) + 1))
+        # Resultados derivados de este snapshot (GEX, superficie de IV...)
+        self._derived = {}
+        self._derived_lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.columns['strike'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def nbytes(self):
+        """Memoria aproximada ocupada por las columnas (sin contar los nombres internados)"""
+        return int(sum(col.nbytes for col in self.columns.values()) + self.expiries.nbytes)
+
+    @classmethod
+    def from_deribit(cls, records, currency, timestamp=None):
+        """
+        Construye la cadena a partir de la respuesta de get_book_summary_by_currency
+
+        Args:
+            records: Lista de dicts devuelta por Deribit en 'result'
+            currency: Moneda de la cadena (BTC, ETH...)
+            timestamp: Momento del snapshot (por defecto, ahora)
+        """
+        raw = pd.DataFrame.from_records(records, columns=('instrument_name',) + NUMERIC_FIELDS)
+        parsed = parse_instrument_names(raw['instrument_name'])
+
+        valid = (parsed['expiry'].notna() & parsed['strike'].notna() & parsed['type_code'].notna()).to_numpy()
+        expiry_days = parsed['expiry'].to_numpy()[valid].astype('datetime64[D]')
+        expiries, expiry_code = np.unique(expiry_days, return_inverse=True)
+        strike = parsed['strike'].to_numpy()[valid].astype(np.float32)
+        type_code = parsed['type_code'].to_numpy()[valid].astype(np.int8)
+        expiry_code = expiry_code.astype(np.int16)
+
+        order = np.lexsort((strike, type_code, expiry_code))
+        names = raw['instrument_name'].to_numpy()[valid][order]
+
+        columns = {
+            'instrument_name': np.array([sys.intern(name) for name in names], dtype=object),
+            'expiry_code': expiry_code[order],
+            'type_code': type_code[order],
+            'strike': strike[order],
+        }
+        for field in NUMERIC_FIELDS:
+            values = pd.to_numeric(raw[field], errors='coerce').to_numpy(dtype=np.float32)
+            columns[field] = values[valid][order]
+        for greek in GREEK_FIELDS:
+            columns[greek] = np.zeros(len(order), dtype=np.float32)
+
+        return cls(currency, columns, expiries, timestamp)
+
+    @classmethod
+    def empty_chain(cls, currency, timestamp=None):
+        """Cadena vacía con el esquema completo"""
+        columns = {
+            'instrument_name': np.empty(0, dtype=object),
+            'expiry_code': np.empty(0, dtype=np.int16),
+            'type_code': np.empty(0, dtype=np.int8),
+            'strike': np.empty(0, dtype=np.float32),
+        }
+        for field in NUMERIC_FIELDS + GREEK_FIELDS:
+            columns[field] = np.empty(0, dtype=np.float32)
+        return cls(currency, columns, np.empty(0, dtype='datetime64[D]'), timestamp)
+
+    def memoize(self, key, compute):
+        """
+        Devuelve un resultado derivado de este snapshot, calculándolo solo la primera vez
+
+        Args:
+            key: Clave hashable del cálculo (ej: ('gex', None))
+            compute: Función sin argumentos que produce el resultado
+        """
+        if key in self._derived:
+            return self._derived[key]
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = compute()
+            return self._derived[key]
+
+    def expiry_slice(self, expiry):
+        """
+        Devuelve el rango de filas de un vencimiento (slice vacío si no existe)
+
+        Args:
+            expiry: Fecha de vencimiento (str 'YYYY-MM-DD', datetime o datetime64)
+        """
+        day = np.datetime64(pd.Timestamp(expiry).date(), 'D')
+        pos = int(np.searchsorted(self.expiries, day))
+        if pos >= len(self.expiries) or self.expiries[pos] != day:
+            return slice(0, 0)
+        return slice(int(self.expiry_bounds[pos]), int(self.expiry_bounds[pos + 1]))
+
+    def expiry_index(self):
+        """Índice vencimiento ('YYYY-MM-DD') -> (inicio, fin) de sus filas, en orden cronológico"""
+        bounds = self.expiry_bounds.tolist()
+        return {
+            str(day): (bounds[pos], bounds[pos + 1])
+            for pos, day in enumerate(self.expiries)
+            if bounds[pos + 1] > bounds[pos]
+        }
+
+    def view(self, rows):
+        """Subcadena sobre un slice de filas; las columnas son vistas sin copia"""
+        columns = {name: col[rows] for name, col in self.columns.items()}
+        return self._derive(columns)
+
+    def for_expiry(self, expiry):
+        """Subcadena (vista sin copia) de un único vencimiento"""
+        return self.view(self.expiry_slice(expiry))
+
+    def take(self, index):
+        """
+        Subcadena a partir de un array de índices o una máscara booleana.
+        Los índices deben ir en orden creciente para conservar los rangos por vencimiento.
+        """
+        columns = {name: col[index] for name, col in self.columns.items()}
+        return self._derive(columns)
+
+    def _derive(self, columns):
+        chain = OptionsChain.__new__(OptionsChain)
+        chain.currency = self.currency
+        chain.columns = columns
+        chain.expiries = self.expiries
+        chain.timestamp = self.timestamp
+        chain.version = self.version
+        chain.expiry_bounds = np.searchsorted(columns['expiry_code'], np.arange(len(self.expiries) + 1))
+        chain._derived = {}
+        chain._derived_lock = threading.RLock()
+        return chain
+
+    def expiration_dates(self):
+        """Vencimientos presentes como datetime64[D]"""
+        present = np.diff(self.expiry_bounds) > 0
+        return self.expiries[present]
+
+    def option_types(self):
+        """Tipo de cada fila como array de 'C'/'P'"""
+        return np.asarray(OPTION_TYPES)[self.columns['type_code']]
+
+    def to_frame(self):
+        """
+        DataFrame compatible con el formato histórico de get_deribit_option_data,
+        con tipo categórico, columnas float32 y griegas planas
+        """
+        cols = self.columns
+        frame = {
+            'instrument_name': cols['instrument_name'],
+            'expiration_date': self.expiries[cols['expiry_code']].astype('datetime64[ns]'),
+            'strike': cols['strike'],
+            'type': pd.Categorical.from_codes(cols['type_code'], categories=list(OPTION_TYPES)),
+        }
+        for field in NUMERIC_FIELDS + GREEK_FIELDS:
+            frame[field] = cols[field]
+        return pd.DataFrame(frame)
+
+    def to_records(self, fields=None):
+        """
+        Lista de dicts con tipos nativos de Python, construida columna a columna
+
+        Args:
+            fields: Columnas a incluir (por defecto, todas las numéricas y griegas)
+        """
+        fields = list(fields or NUMERIC_FIELDS + GREEK_FIELDS)
+        cols = self.columns
+        data = {
+            'instrument_name': cols['instrument_name'].tolist(),
+            'expiration_date': np.datetime_as_string(self.expiries[cols['expiry_code']]).tolist(),
+            'strike': as_float64(cols['strike']).tolist(),
+            'type': self.option_types().tolist(),
+        }
+        for field in fields:
+            values = as_float64(cols[field])
+            data[field] = np.where(np.isnan(values), None, values).tolist()
+        keys = list(data)
+        return [dict(zip(keys, row)) for row in zip(*data.values())]
@@ -0,0 +1,255 @@
+"""
+Capa de datos de derivados compartida por VolatilityService y el backend del
+módulo de sentimiento: descargas de Deribit y Binance con una sola caché
+"""
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from modules.volatility.aggregates import ChainAggregates
+from modules.volatility.archive import ChainArchive
+from modules.volatility.cache import DataCache
+from modules.volatility.chain import OptionsChain
+from modules.volatility.futures import fetch_futures_curve
+from modules.volatility.greeks import compute_chain_greeks
+from modules.replay.clock import utc_now
+from modules.replay.http import http_session
+
+
+# Monedas del pipeline de opciones (configurable con TRADINGROAD_OPTION_CURRENCIES)
+OPTION_CURRENCIES = tuple(
+    currency.strip().upper()
+    for currency in os.getenv('TRADINGROAD_OPTION_CURRENCIES', 'BTC,ETH,SOL,XRP').split(',') if currency.strip()
+)
+# Opciones inversas (liquidadas en la propia moneda); el resto son lineales en USDC
+INVERSE_OPTION_CURRENCIES = ('BTC', 'ETH')
+
+
+def option_settlement(currency):
+    """Moneda de liquidación de las opciones de Deribit (BTC, ETH o USDC)"""
+    currency = currency.upper()
+    return currency if currency in INVERSE_OPTION_CURRENCIES else 'USDC'
+
+
+def fetch_deribit_book_summary(settlement='BTC'):
+    """
+    Book summary de todas las opciones de una moneda de liquidación
+    (con USDC vienen juntas SOL, XRP y el resto de opciones lineales)
+
+    Returns:
+        Lista de dicts de Deribit ([] si viene vacío) o None si falla
+    """
+    url = f"https://www.deribit.com/api/v2/public/get_book_summary_by_currency?currency={settlement}&kind=option"
+    
+    try:
+        headers = {
+            'User-Agent': 'TradingRoad/1.0 (contact@tradingroad.app)',
+            'Accept': 'application/json'
+        }
+        response = http_session().get(url, timeout=15, headers=headers)
+        response.raise_for_status()
+        result = response.json()
+        
+        if 'result' not in result:
+            print(f"Warning: No 'result' key in Deribit response for {settlement}")
+            return []
+        return result['result']
+        
+    except Exception as e:
+        print(f"Error en fetch_deribit_book_summary: {e}")
+        traceback.print_exc()
+        return None
+
+
+def build_option_chain(records, currency, timestamp=None):
+    """
+    OptionsChain de una moneda a partir del book summary de su moneda de
+    liquidación, con las griegas calculadas
+    """
+    currency = currency.upper()
+    settlement = option_settlement(currency)
+    if settlement != currency:
+        prefix = f"{currency}_{settlement}-"
+        records = [record for record in records if record.get('instrument_name', '').startswith(prefix)]
+    if not records:
+        print(f"Warning: Empty data from Deribit for {currency}")
+        return OptionsChain.empty_chain(currency)
+    
+    chain = OptionsChain.from_deribit(records, currency, timestamp or utc_now())
+    if chain.empty:
+        print(f"Warning: Empty chain after processing Deribit data for {currency}")
+    # El book summary no trae griegas: se calculan una vez por snapshot
+    return compute_chain_greeks(chain)
+
+
+def fetch_deribit_option_chain(currency='BTC'):
+    """Obtiene la cadena de opciones de Deribit en formato columnar (OptionsChain)"""
+    records = fetch_deribit_book_summary(option_settlement(currency))
+    if records is None:
+        return None
+    return build_option_chain(records, currency)
+
+
+def get_binance_klines(symbol='BTC', interval='1d', days=7):
+    """Obtiene datos de velas de Binance"""
+    url = f"https://fapi.binance.com/fapi/v1/klines?symbol={symbol}USDT&interval={interval}&limit={days}"
+    
+    try:
+        response = http_session().get(url, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        
+        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_volume', 'count', 'taker_buy_volume', 'taker_buy_quote_volume', 'ignore'])
+        df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].astype(float)
+        
+        week_high_idx = df['high'].idxmax()
+        week_low_idx = df['low'].idxmin()
+        
+        return {
+            'week_high': df.loc[week_high_idx, 'high'],
+            'week_high_timestamp': df.loc[week_high_idx, 'timestamp'],
+            'week_low': df.loc[week_low_idx, 'low'],
+            'week_low_timestamp': df.loc[week_low_idx, 'timestamp']
+        }
+        
+    except Exception as e:
+        print(f"Error en get_binance_klines: {e}")
+        return None
+
+
+def get_binance_funding_info(symbol='BTC'):
+    """Obtiene información de funding de Binance"""
+    try:
+        url = f"https://fapi.binance.com/fapi/v1/premiumIndex?symbol={symbol}USDT"
+        response = http_session().get(url, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        
+        return {
+            'current_funding_rate': float(data['lastFundingRate']),
+            'next_funding_time_ms': int(data['nextFundingTime']),
+            'mark_price': float(data['markPrice'])
+        }
+        
+    except Exception as e:
+        print(f"Error en get_binance_funding_info: {e}")
+        return None
+
+
+class DerivativesData:
+    """
+    Punto único de acceso a los datos de derivados que se descargan por
+    petición (cadena de opciones, curva de futuros, funding y velas de Binance).
+    Todas las descargas pasan por la misma DataCache, así que cada payload se
+    pide una vez aunque lo usen las dos apps o varios hilos a la vez.
+    """
+
+    # Segundos de validez de cada tipo de dato
+    CHAIN_TTL = 60
+    # El book summary en bruto solo se guarda unos segundos: sirve para que las
+    # monedas que comparten liquidación (SOL, XRP... en USDC) se construyan de una
+    # sola descarga aunque se pidan a la vez
+    SUMMARY_TTL = 5
+    FUTURES_TTL = 30
+    FUNDING_TTL = 30
+    KLINES_TTL = 300
+
+    def __init__(self, cache=None, chain_archive=None, currencies=OPTION_CURRENCIES):
+        self.currencies = tuple(currencies)
+        self.cache = cache or DataCache(int(os.getenv('TRADINGROAD_CACHE_ENTRIES', '256')))
+        # Histórico de snapshots de la cadena (desactivable con TRADINGROAD_ARCHIVE_CHAINS=0)
+        if chain_archive is None and os.getenv('TRADINGROAD_ARCHIVE_CHAINS', '1') != '0':
+            chain_archive = ChainArchive()
+        self.chain_archive = chain_archive
+        # Últimos agregados por moneda: el snapshot siguiente solo aplica las filas que cambian
+        self._aggregates = {}
+        self._aggregates_lock = threading.Lock()
+
+    def book_summary(self, settlement):
+        """Book summary en bruto de una moneda de liquidación (una descarga por ráfaga)"""
+        return self.cache.get(('summary', settlement), lambda: fetch_deribit_book_summary(settlement), self.SUMMARY_TTL)
+
+    def _load_chain(self, currency):
+        records = self.book_summary(option_settlement(currency))
+        if records is None:
+            return None
+        chain = build_option_chain(records, currency)
+        if self.chain_archive is not None:
+            # Se archiva en segundo plano: la compactación al cambiar de día no frena la petición
+            self.chain_archive.submit(chain)
+        return chain
+
+    def options_chain(self, currency='BTC'):
+        """OptionsChain de una moneda (la anterior si Deribit no responde)"""
+        currency = currency.upper()
+        return self.cache.get(('chain', currency), lambda: self._load_chain(currency), self.CHAIN_TTL)
+
+    def options_chains(self, currencies=None):
+        """
+        Cadenas de varias monedas (por defecto, las configuradas), descargadas y
+        procesadas en paralelo
+
+        Returns:
+            Dict moneda -> OptionsChain (None si no hay datos)
+        """
+        currencies = [currency.upper() for currency in currencies or self.currencies]
+        if not currencies:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(currencies)) as pool:
+            return dict(zip(currencies, pool.map(self.options_chain, currencies)))
+
+    def chain_aggregates(self, chain):
+        """
+        Agregados (OI, volumen, curva de dolor) de un snapshot completo de la
+        cadena, calculados una vez por snapshot a partir de los del anterior
+
+        Args:
+            chain: OptionsChain completa devuelta por options_chain (no una vista)
+        """
+        def compute():
+            with self._aggregates_lock:
+                previous = self._aggregates.get(chain.currency)
+                aggregates = ChainAggregates.from_snapshot(chain, previous)
+                if previous is None or aggregates.version >= previous.version:
+                    self._aggregates[chain.currency] = aggregates
+                return aggregates
+        return chain.memoize(('aggregates',), compute)
+
+    def options_frame(self, currency='BTC'):
+        """Cadena como DataFrame (to_frame), calculado una vez por snapshot"""
+        chain = self.options_chain(currency)
+        if chain is None:
+            return None
+        return chain.memoize(('frame',), chain.to_frame)
+
+    def futures_curve(self, currency='BTC'):
+        """Curva de futuros (Deribit y Binance COIN-M); la anterior si vuelve vacía"""
+        currency = currency.upper()
+        return self.cache.get(('futures', currency), lambda: fetch_futures_curve(currency), self.FUTURES_TTL,
+                              valid=lambda curve: curve is not None and len(curve) > 0)
+
+    def funding_info(self, symbol='BTC'):
+        """Funding actual, próximo pago y mark price del perpetuo USDT de Binance"""
+        symbol = symbol.upper()
+        return self.cache.get(('funding_info', symbol), lambda: get_binance_funding_info(symbol), self.FUNDING_TTL)
+
+    def weekly_stats(self, symbol='BTC'):
+        """Máximo y mínimo de los últimos 7 días (velas diarias de Binance)"""
+        symbol = symbol.upper()
+        return self.cache.get(('weekly', symbol), lambda: get_binance_klines(symbol, '1d', 7), self.KLINES_TTL)
+
+
+_default_data = None
+_default_data_lock = threading.Lock()
+
+
+def default_derivatives_data():
+    """Capa de datos compartida del proceso"""
+    global _default_data
+    with _default_data_lock:
+        if _default_data is None:
+            _default_data = DerivativesData()
+        return _default_data
@@ -0,0 +1,174 @@
+"""
+Histórico local del índice DVOL de Deribit con descarga incremental
+"""
+import os
+import threading
+
+import numpy as np
+
+from config.paths import STORE_DIR
+from modules.replay.clock import now_ms as clock_ms
+from modules.replay.http import http_session
+from modules.volatility.store import SeriesStore
+
+DVOL_DTYPE = np.dtype([
+    ('timestamp', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8')
+])
+
+# Resolución -> (parámetro de Deribit, paso en ms)
+RESOLUTIONS = {
+    '1m': ('1', 60 * 1000),
+    '1h': ('3600', 3600 * 1000),
+    '1D': ('1D', 86400 * 1000),
+}
+
+# Máximo de páginas por descarga (Deribit devuelve como mucho 1000 puntos por llamada)
+MAX_PAGES = 600
+
+
+def fetch_dvol_range(currency, resolution, start_ms, end_ms):
+    """
+    Descarga DVOL de Deribit entre dos timestamps, paginando hacia atrás con 'continuation'
+
+    Returns:
+        Array estructurado DVOL_DTYPE (posiblemente desordenado) o None si falla
+    """
+    url = "https://www.deribit.com/api/v2/public/get_volatility_index_data"
+    chunks = []
+    end = end_ms
+    try:
+        for _ in range(MAX_PAGES):
+            params = {
+                'currency': currency, 'start_timestamp': int(start_ms),
+                'end_timestamp': int(end), 'resolution': RESOLUTIONS[resolution][0]
+            }
+            response = http_session().get(url, params=params, timeout=10)
+            response.raise_for_status()
+            result = response.json().get('result', {})
+            data = result.get('data', [])
+            if data:
+                chunks.append(np.asarray(data, dtype=np.float64).reshape(-1, 5))
+            continuation = result.get('continuation')
+            if not data or not continuation or continuation <= start_ms or continuation >= end:
+                break
+            end = continuation
+    except Exception as e:
+        print(f"Error descargando DVOL de {currency} ({resolution}): {e}")
+        if not chunks:
+            return None
+
+    if not chunks:
+        return np.empty(0, dtype=DVOL_DTYPE)
+    rows = np.vstack(chunks)
+    records = np.empty(len(rows), dtype=DVOL_DTYPE)
+    records['timestamp'] = rows[:, 0].astype(np.int64)
+    for i, field in enumerate(('open', 'high', 'low', 'close'), start=1):
+        records[field] = rows[:, i]
+    return records
+
+
+class DVOLStore:
+    """
+    DVOL por moneda y resolución (1m, 1h, 1D) persistido en disco.
+    Solo se descargan las dos últimas velas guardadas y lo posterior (la
+    última puede estar abierta y se sobrescribe), la parte de la ventana
+    anterior al primero y los huecos intermedios.
+    """
+
+    # Segundos mínimos entre sincronizaciones de la misma serie
+    MIN_SYNC_SECONDS = 30
+
+    def __init__(self, directory=None):
+        self.store = SeriesStore(directory or os.path.join(STORE_DIR, 'dvol'), DVOL_DTYPE)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._last_sync = {}
+        # Huecos ya intentados (Deribit puede no tener datos en ellos)
+        self._attempted_gaps = set()
+        # Primer punto de cada serie tras pedir lo anterior: Deribit no tiene nada antes
+        self._earliest = {}
+
+    def _lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def sync(self, currency, resolution='1D', days=90):
+        """
+        Actualiza la serie local para cubrir los últimos `days` días
+
+        Returns:
+            Número de puntos nuevos o actualizados
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Resolución no soportada: {resolution}")
+        currency = currency.upper()
+        key = f"{currency}_{resolution}"
+        step = RESOLUTIONS[resolution][1]
+
+        with self._lock(key):
+            now_ms = clock_ms()
+            if now_ms - self._last_sync.get((key, days), 0) < self.MIN_SYNC_SECONDS * 1000:
+                return 0
+            start_ms = now_ms - days * 86400 * 1000
+
+            ranges = []
+            first, last = self.store.first_timestamp(key), self.store.last_timestamp(key)
+            if last is None:
+                ranges.append((start_ms, now_ms))
+            else:
+                # Se vuelve a pedir desde la penúltima vela: la última puede haberse
+                # guardado abierta (la de hoy en 1D, la hora en curso en 1h)
+                ranges.append((last - step, now_ms))
+                if first - start_ms >= step and self._earliest.get(key) != first:
+                    ranges.append((start_ms, first - 1))
+                for gap in self.store.gaps(key, step, start_ms, now_ms):
+                    if (key, gap) not in self._attempted_gaps:
+                        self._attempted_gaps.add((key, gap))
+                        ranges.append(gap)
+
+            added = 0
+            for lo, hi in ranges:
+                records = fetch_dvol_range(currency, resolution, lo, hi)
+                if records is not None:
+                    added += self.store.upsert(key, records)
+                    if lo == start_ms:
+                        # Lo que no haya llegado desde el inicio de la ventana no existe en Deribit
+                        self._earliest[key] = self.store.first_timestamp(key)
+            self._last_sync[(key, days)] = now_ms
+            return added
+
+    def history(self, currency, resolution='1D', days=90, sync=True):
+        """
+        Serie DVOL de los últimos `days` días servida desde el almacén local
+
+        Returns:
+            Array estructurado (vista) con timestamp, open, high, low, close
+        """
+        if sync:
+            self.sync(currency, resolution, days)
+        key = f"{currency.upper()}_{resolution}"
+        # Acotada por el reloj: en replay no se ven puntos posteriores al instante simulado
+        now_ms = clock_ms()
+        return self.store.window(key, now_ms - days * 86400 * 1000, now_ms)
+
+    def version(self, currency, resolution='1D', days=90):
+        """Versión de la serie (timestamp y cierre del último punto hasta ahora) tras sincronizarla"""
+        self.sync(currency, resolution, days)
+        # El cierre cambia mientras la última vela sigue abierta
+        series = self.store.window(f"{currency.upper()}_{resolution}", None, clock_ms())
+        if not len(series):
+            return None
+        return (int(series['timestamp'][-1]), float(series['close'][-1]))
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_dvol_store():
+    """Instancia compartida del almacén DVOL"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = DVOLStore()
+        return _default_store
@@ -0,0 +1,210 @@
+"""
+Estructura temporal de futuros (Deribit y Binance COIN-M) y basis anualizado
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from modules.replay.clock import utc_now
+from modules.replay.http import http_session
+from modules.volatility.greeks import years_to_expiry
+
+# Plazo mínimo (años) para anualizar: evita dividir por casi cero el día del vencimiento
+MIN_YEARS = 1.0 / 365.0
+
+
+def fetch_deribit_futures(currency):
+    """
+    Futuros de Deribit (fechados y perpetuo) de una moneda
+
+    Returns:
+        Lista de dicts {venue, instrument, expiry (datetime64[D] o None), mark_price,
+        index_price, open_interest}
+    """
+    url = "https://www.deribit.com/api/v2/public/get_book_summary_by_currency"
+    response = http_session().get(url, params={'currency': currency, 'kind': 'future'}, timeout=10)
+    response.raise_for_status()
+    contracts = []
+    for item in response.json().get('result', []):
+        name = item.get('instrument_name', '')
+        code = name.split('-')[-1]
+        expiry = None if code == 'PERPETUAL' else pd.to_datetime(code, format='%d%b%y', errors='coerce')
+        if expiry is not None and pd.isna(expiry):
+            continue
+        contracts.append({
+            'venue': 'deribit',
+            'instrument': name,
+            'expiry': None if expiry is None else np.datetime64(expiry.date(), 'D'),
+            'mark_price': item.get('mark_price'),
+            'index_price': item.get('estimated_delivery_price'),
+            'open_interest': item.get('open_interest'),
+        })
+    return contracts
+
+
+def fetch_binance_delivery(currency):
+    """Contratos de entrega COIN-M de Binance (BTCUSD_251226, BTCUSD_PERP...) en una sola llamada"""
+    url = "https://dapi.binance.com/dapi/v1/premiumIndex"
+    response = http_session().get(url, params={'pair': f"{currency}USD"}, timeout=10)
+    response.raise_for_status()
+    contracts = []
+    for item in response.json():
+        symbol = item.get('symbol', '')
+        code = symbol.split('_')[-1]
+        expiry = None if code == 'PERP' else pd.to_datetime(code, format='%y%m%d', errors='coerce')
+        if expiry is not None and pd.isna(expiry):
+            continue
+        contracts.append({
+            'venue': 'binance',
+            'instrument': symbol,
+            'expiry': None if expiry is None else np.datetime64(expiry.date(), 'D'),
+            'mark_price': float(item['markPrice']) if item.get('markPrice') else None,
+            'index_price': float(item['indexPrice']) if item.get('indexPrice') else None,
+            'open_interest': None,
+        })
+    return contracts
+
+
+FUTURES_SOURCES = {
+    'deribit': fetch_deribit_futures,
+    'binance': fetch_binance_delivery,
+}
+
+
+def fetch_futures_curve(currency, sources=FUTURES_SOURCES):
+    """
+    Descarga en paralelo los futuros de todas las fuentes y calcula el basis
+
+    Returns:
+        FuturesCurve (los venues que fallan quedan en errors)
+    """
+    contracts, errors = [], {}
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        futures = {venue: pool.submit(fetch, currency) for venue, fetch in sources.items()}
+        for venue, future in futures.items():
+            try:
+                contracts.extend(future.result())
+            except Exception as e:
+                print(f"Error obteniendo futuros de {venue} para {currency}: {e}")
+                errors[venue] = str(e)
+    return FuturesCurve(currency, contracts, utc_now(), errors)
+
+
+class FuturesCurve:
+    """
+    Curva de futuros de un snapshot: basis de cada contrato fechado frente al
+    índice spot y frente al perpetuo del mismo venue, en bruto y anualizado.
+    """
+
+    def __init__(self, currency, contracts, timestamp, errors=None):
+        self.currency = currency
+        self.timestamp = timestamp
+        self.version = int(timestamp.timestamp() * 1000)
+        self.errors = errors or {}
+
+        perpetuals = {c['venue']: c for c in contracts if c['expiry'] is None and c['mark_price']}
+        self.perpetuals = {
+            venue: {'instrument': c['instrument'], 'mark_price': c['mark_price'], 'index_price': c['index_price']}
+            for venue, c in perpetuals.items()
+        }
+        dated = [c for c in contracts if c['expiry'] is not None and c['mark_price'] and c['index_price']]
+        dated.sort(key=lambda c: (c['expiry'], c['venue']))
+
+        self.venue = np.array([c['venue'] for c in dated], dtype=object)
+        self.instrument = np.array([c['instrument'] for c in dated], dtype=object)
+        self.expiry = np.array([c['expiry'] for c in dated], dtype='datetime64[D]')
+        self.price = np.array([c['mark_price'] for c in dated], dtype=np.float64)
+        self.spot = np.array([c['index_price'] for c in dated], dtype=np.float64)
+        self.perpetual = np.array([perpetuals[c['venue']]['mark_price'] if c['venue'] in perpetuals else np.nan
+                                   for c in dated], dtype=np.float64)
+        self.open_interest = np.array([c['open_interest'] if c['open_interest'] is not None else np.nan
+                                       for c in dated], dtype=np.float64)
+
+        self.years = years_to_expiry(self.expiry, timestamp)
+        t = np.maximum(self.years, MIN_YEARS)
+        self.basis = self.price / self.spot - 1.0
+        self.annualized_basis = self.basis / t
+        # Tipo implícito continuo: ln(F/S) / T (el que se interpola entre vencimientos)
+        self.implied_rate = np.log(self.price / self.spot) / t
+        self.perpetual_basis = self.price / self.perpetual - 1.0
+        self.annualized_perpetual_basis = self.perpetual_basis / t
+
+    def __len__(self):
+        return len(self.expiry)
+
+    def implied_rate_at(self, years):
+        """
+        Tipo implícito interpolado (lineal en plazo) con la media por vencimiento
+        de todos los venues; constante fuera del rango de la curva
+        """
+        years = np.asarray(years, dtype=np.float64)
+        if len(self) == 0:
+            return np.full(years.shape, np.nan)
+        nodes, inverse = np.unique(self.years, return_inverse=True)
+        rates = np.bincount(inverse, weights=self.implied_rate) / np.bincount(inverse)
+        return np.interp(years, nodes, rates)
+
+    def to_dict(self):
+        """Contratos de la curva en formato de columnas"""
+        def clean(values):
+            return np.where(np.isfinite(values), values, None).tolist()
+
+        return {
+            'currency': self.currency,
+            'perpetuals': self.perpetuals,
+            'contracts': {
+                'venue': self.venue.tolist(),
+                'instrument': self.instrument.tolist(),
+                'expiration_date': np.datetime_as_string(self.expiry).tolist(),
+                'days': (self.years * 365.0).tolist(),
+                'mark_price': self.price.tolist(),
+                'index_price': self.spot.tolist(),
+                'basis': clean(self.basis),
+                'annualized_basis': clean(self.annualized_basis),
+                'implied_rate': clean(self.implied_rate),
+                'perpetual_basis': clean(self.perpetual_basis),
+                'annualized_perpetual_basis': clean(self.annualized_perpetual_basis),
+                'open_interest': clean(self.open_interest),
+            },
+            'errors': self.errors,
+            'version': self.version,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+
+def align_with_options(curve, chain, surface=None):
+    """
+    Basis en los vencimientos de opciones de la cadena: el del futuro con la
+    misma fecha si existe (media entre venues) o el interpolado de la curva,
+    junto con la IV ATM de la superficie para graficar ambas estructuras
+
+    Returns:
+        Dict de columnas alineadas con chain.expiry_index()
+    """
+    dates = chain.expiration_dates()
+    years = years_to_expiry(dates, chain.timestamp)
+    rate = curve.implied_rate_at(years)
+
+    listed = np.isin(dates, curve.expiry)
+    if listed.any():
+        # Fechas con futuro cotizado: media exacta de los venues en esa fecha
+        nodes, inverse = np.unique(curve.expiry, return_inverse=True)
+        means = np.bincount(inverse, weights=curve.implied_rate) / np.bincount(inverse)
+        rate[listed] = means[np.searchsorted(nodes, dates[listed])]
+
+    t = np.maximum(years, MIN_YEARS)
+    annualized_basis = np.expm1(rate * t) / t
+    atm_iv = surface.implied_vol(1.0, years) if surface is not None else np.full(len(dates), np.nan)
+
+    def clean(values):
+        return np.where(np.isfinite(values), values, None).tolist()
+
+    return {
+        'expiration_dates': np.datetime_as_string(dates).tolist(),
+        'days': (years * 365.0).tolist(),
+        'listed_future': listed.tolist(),
+        'implied_rate': clean(rate),
+        'annualized_basis': clean(annualized_basis),
+        'atm_iv': clean(np.asarray(atm_iv, dtype=np.float64))
+    }
@@ -0,0 +1,121 @@
+"""
+Perfil de exposición gamma (GEX) y posicionamiento de dealers por strike
+"""
+import numpy as np
+
+from modules.volatility.chain import CALL, as_float64
+from modules.volatility.greeks import black_scholes_gamma, years_to_expiry
+
+# Rango de precios (relativo al spot) sobre el que se busca el nivel de gamma cero
+PROFILE_RANGE = (0.7, 1.3)
+PROFILE_POINTS = 121
+
+
+def reference_price(chain):
+    """Precio del subyacente del vencimiento más cercano con dato válido"""
+    prices = chain['underlying_price']
+    finite = prices[np.isfinite(prices)]
+    return float(finite[0]) if len(finite) else 0.0
+
+
+def _dealer_sign(chain):
+    # Convención habitual: los dealers están largos de calls y cortos de puts
+    return np.where(chain['type_code'] == CALL, 1.0, -1.0)
+
+
+def _row_gex(chain, gamma, forward):
+    """GEX en USD por movimiento del 1% del subyacente, por fila"""
+    oi = np.nan_to_num(chain['open_interest'].astype(np.float64))
+    return gamma * oi * forward * forward * 0.01
+
+
+def _zero_gamma_profile(chain, spot):
+    """
+    Recalcula la GEX neta total para una rejilla de precios hipotéticos del
+    subyacente (matriz instrumentos x precios) y localiza el cambio de signo
+    """
+    levels = spot * np.linspace(PROFILE_RANGE[0], PROFILE_RANGE[1], PROFILE_POINTS)
+    # Solo contribuyen las filas con interés abierto
+    oi = np.nan_to_num(chain['open_interest'].astype(np.float64))
+    rows = np.nonzero(oi > 0)[0]
+    if len(rows) == 0:
+        return levels, np.zeros_like(levels), None
+
+    forward = np.nan_to_num(chain['underlying_price'][rows].astype(np.float64))
+    # Cada forward se desplaza en la misma proporción que el spot
+    shifted = forward[:, None] * (levels / spot)[None, :]
+    t = years_to_expiry(chain.expiries, chain.timestamp)[chain['expiry_code'][rows]][:, None]
+    iv = chain['mark_iv'][rows].astype(np.float64)[:, None] / 100.0
+    gamma = black_scholes_gamma(shifted, chain['strike'][rows][:, None], t, iv)
+
+    weight = (_dealer_sign(chain)[rows] * oi[rows] * 0.01)[:, None]
+    net = (weight * gamma * shifted * shifted).sum(axis=0)
+
+    flip = None
+    crossings = np.nonzero(np.diff(np.sign(net)) != 0)[0]
+    if len(crossings):
+        # Cruce más cercano al spot, interpolado linealmente entre los dos niveles
+        i = crossings[np.argmin(np.abs(levels[crossings] - spot))]
+        x0, x1, y0, y1 = levels[i], levels[i + 1], net[i], net[i + 1]
+        flip = float(x0 - y0 * (x1 - x0) / (y1 - y0)) if y1 != y0 else float(x0)
+    return levels, net, flip
+
+
+def compute_gex_profile(chain):
+    """
+    Calcula el perfil GEX de una cadena con griegas ya calculadas
+
+    Args:
+        chain: OptionsChain (completa o de un vencimiento)
+
+    Returns:
+        Dict con la GEX neta por strike y por vencimiento, el total,
+        el nivel de gamma cero y la curva GEX frente al precio
+    """
+    if chain.empty:
+        return {}
+
+    spot = reference_price(chain)
+    forward = np.nan_to_num(chain['underlying_price'].astype(np.float64))
+    gex = _row_gex(chain, chain['gamma'].astype(np.float64), forward)
+    is_call = chain['type_code'] == CALL
+    call_gex = np.where(is_call, gex, 0.0)
+    put_gex = np.where(is_call, 0.0, gex)
+
+    strikes, strike_idx = np.unique(chain['strike'], return_inverse=True)
+    call_by_strike = np.bincount(strike_idx, weights=call_gex, minlength=len(strikes))
+    put_by_strike = np.bincount(strike_idx, weights=put_gex, minlength=len(strikes))
+
+    n_expiries = len(chain.expiries)
+    call_by_expiry = np.bincount(chain['expiry_code'], weights=call_gex, minlength=n_expiries)
+    put_by_expiry = np.bincount(chain['expiry_code'], weights=put_gex, minlength=n_expiries)
+    present = np.diff(chain.expiry_bounds) > 0
+
+    levels, profile, flip = _zero_gamma_profile(chain, spot) if spot > 0 else (np.empty(0), np.empty(0), None)
+
+    return {
+        'currency': chain.currency,
+        'spot': spot,
+        'total_gex': float(call_gex.sum() - put_gex.sum()),
+        'call_gex': float(call_gex.sum()),
+        'put_gex': float(-put_gex.sum()),
+        'zero_gamma_level': flip,
+        'by_strike': {
+            'strikes': as_float64(strikes).tolist(),
+            'call_gex': call_by_strike.tolist(),
+            'put_gex': (-put_by_strike).tolist(),
+            'net_gex': (call_by_strike - put_by_strike).tolist()
+        },
+        'by_expiry': {
+            'expiration_dates': np.datetime_as_string(chain.expiries[present]).tolist(),
+            'call_gex': call_by_expiry[present].tolist(),
+            'put_gex': (-put_by_expiry[present]).tolist(),
+            'net_gex': (call_by_expiry - put_by_expiry)[present].tolist()
+        },
+        'profile': {
+            'spot_levels': levels.tolist(),
+            'net_gex': profile.tolist()
+        },
+        'version': chain.version,
+        'timestamp': chain.timestamp.isoformat()
+    }
@@ -0,0 +1,167 @@
+"""
+Motor vectorizado de griegas Black-Scholes para la cadena de opciones
+"""
+import numpy as np
+
+from modules.volatility.chain import CALL
+
+# Las opciones de Deribit vencen a las 08:00 UTC
+EXPIRY_HOUR_UTC = 8
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+
+_SQRT_2 = np.sqrt(2.0)
+_INV_SQRT_2PI = 1.0 / np.sqrt(2.0 * np.pi)
+
+
+def norm_pdf(x):
+    """Densidad de la normal estándar"""
+    return _INV_SQRT_2PI * np.exp(-0.5 * x * x)
+
+
+def norm_cdf(x):
+    """
+    Distribución normal estándar acumulada, vectorizada.
+    Usa la aproximación de erf de Abramowitz-Stegun 7.1.26 (error < 1.5e-7)
+    para no depender de scipy.
+    """
+    z = np.abs(x) / _SQRT_2
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def _d1_d2(spot, strike, t, sigma, rate):
+    sqrt_t = np.sqrt(t)
+    sig_sqrt_t = sigma * sqrt_t
+    d1 = (np.log(spot / strike) + (rate + 0.5 * sigma * sigma) * t) / sig_sqrt_t
+    return d1, d1 - sig_sqrt_t, sqrt_t
+
+
+def black_scholes_greeks(spot, strike, t, iv, is_call, rate=0.0):
+    """
+    Calcula las griegas Black-Scholes de todos los instrumentos en una pasada
+
+    Args:
+        spot: Precio del subyacente (array o escalar)
+        strike: Strike de cada opción
+        t: Tiempo a vencimiento en años
+        iv: Volatilidad implícita en tanto por uno (0.55 = 55%)
+        is_call: Array booleano, True para calls
+        rate: Tipo de interés libre de riesgo (continuo)
+
+    Returns:
+        Dict de arrays float64 con delta, gamma, vega (por punto de vol),
+        theta (por día) y vanna (cambio de delta por punto de vol).
+        Las opciones vencidas o sin IV quedan con delta intrínseca y resto a 0.
+    """
+    spot, strike, t, iv, rate = np.broadcast_arrays(
+        np.asarray(spot, dtype=np.float64), np.asarray(strike, dtype=np.float64),
+        np.asarray(t, dtype=np.float64), np.asarray(iv, dtype=np.float64),
+        np.asarray(rate, dtype=np.float64)
+    )
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), spot.shape)
+
+    live = (t > 0) & (iv > 0) & (spot > 0) & (strike > 0)
+    # Valores neutros donde no se puede evaluar el modelo, para evitar avisos de división
+    safe_t = np.where(live, t, 1.0)
+    safe_iv = np.where(live, iv, 1.0)
+    safe_spot = np.where(live, spot, 1.0)
+    safe_strike = np.where(live, strike, 1.0)
+
+    d1, d2, sqrt_t = _d1_d2(safe_spot, safe_strike, safe_t, safe_iv, rate)
+    pdf_d1 = norm_pdf(d1)
+    discount = np.exp(-rate * safe_t)
+
+    delta = np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0)
+    gamma = pdf_d1 / (safe_spot * safe_iv * sqrt_t)
+    vega = safe_spot * pdf_d1 * sqrt_t / 100.0
+    decay = -safe_spot * pdf_d1 * safe_iv / (2.0 * sqrt_t)
+    carry = rate * safe_strike * discount
+    theta = np.where(is_call, decay - carry * norm_cdf(d2), decay + carry * norm_cdf(-d2)) / 365.0
+    vanna = -pdf_d1 * d2 / safe_iv / 100.0
+
+    # Opciones vencidas o sin volatilidad: solo queda la delta intrínseca
+    intrinsic_delta = np.where(is_call, (spot > strike).astype(np.float64), -(spot < strike).astype(np.float64))
+    return {
+        'delta': np.where(live, delta, intrinsic_delta),
+        'gamma': np.where(live, gamma, 0.0),
+        'vega': np.where(live, vega, 0.0),
+        'theta': np.where(live, theta, 0.0),
+        'vanna': np.where(live, vanna, 0.0),
+    }
+
+
+def black_scholes_gamma(spot, strike, t, iv):
+    """Solo la gamma (igual para calls y puts), para rejillas grandes de precios"""
+    spot, strike, t, iv = np.broadcast_arrays(
+        np.asarray(spot, dtype=np.float64), np.asarray(strike, dtype=np.float64),
+        np.asarray(t, dtype=np.float64), np.asarray(iv, dtype=np.float64)
+    )
+    live = (t > 0) & (iv > 0) & (spot > 0) & (strike > 0)
+    safe_spot = np.where(live, spot, 1.0)
+    safe_iv = np.where(live, iv, 1.0)
+    d1, _, sqrt_t = _d1_d2(safe_spot, np.where(live, strike, 1.0), np.where(live, t, 1.0), safe_iv, 0.0)
+    return np.where(live, norm_pdf(d1) / (safe_spot * safe_iv * sqrt_t), 0.0)
+
+
+def black_scholes_price(spot, strike, t, iv, is_call, rate=0.0):
+    """Precio Black-Scholes vectorizado (en la moneda del strike); valor intrínseco si t <= 0"""
+    spot, strike, t, iv, rate = np.broadcast_arrays(
+        np.asarray(spot, dtype=np.float64), np.asarray(strike, dtype=np.float64),
+        np.asarray(t, dtype=np.float64), np.asarray(iv, dtype=np.float64),
+        np.asarray(rate, dtype=np.float64)
+    )
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), spot.shape)
+
+    live = (t > 0) & (iv > 0) & (spot > 0) & (strike > 0)
+    safe_t = np.where(live, t, 1.0)
+    d1, d2, _ = _d1_d2(np.where(live, spot, 1.0), np.where(live, strike, 1.0), safe_t, np.where(live, iv, 1.0), rate)
+    discount = np.exp(-rate * safe_t)
+
+    call = spot * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    put = strike * discount * norm_cdf(-d2) - spot * norm_cdf(-d1)
+    intrinsic = np.where(is_call, np.maximum(spot - strike, 0.0), np.maximum(strike - spot, 0.0))
+    return np.where(live, np.where(is_call, call, put), intrinsic)
+
+
+def years_to_expiry(expiries, now):
+    """
+    Tiempo a vencimiento en años de cada fecha de vencimiento
+
+    Args:
+        expiries: Array datetime64[D] de vencimientos
+        now: datetime (con zona horaria) del snapshot
+    """
+    expiry_times = expiries.astype('datetime64[s]') + np.timedelta64(EXPIRY_HOUR_UTC, 'h')
+    now_s = np.datetime64(int(now.timestamp()), 's')
+    return (expiry_times - now_s).astype(np.float64) / SECONDS_PER_YEAR
+
+
+def compute_chain_greeks(chain):
+    """
+    Rellena las columnas de griegas de una cadena a partir de mark_iv,
+    underlying_price, strike y tiempo a vencimiento. Se ejecuta una sola vez
+    por snapshot: si la cadena ya tiene griegas calculadas no hace nada.
+
+    Args:
+        chain: OptionsChain completa (no una vista)
+
+    Returns:
+        La misma cadena, con las griegas en columnas float32
+    """
+    if getattr(chain, 'greeks_version', None) == chain.version or chain.empty:
+        return chain
+
+    cols = chain.columns
+    t = years_to_expiry(chain.expiries, chain.timestamp)[cols['expiry_code']]
+    # underlying_price es el forward de cada vencimiento, así que se usa tipo 0 (Black-76)
+    greeks = black_scholes_greeks(
+        cols['underlying_price'], cols['strike'], t,
+        cols['mark_iv'].astype(np.float64) / 100.0,
+        cols['type_code'] == CALL
+    )
+    for name, values in greeks.items():
+        cols[name] = values.astype(np.float32)
+    chain.greeks_version = chain.version
+    return chain
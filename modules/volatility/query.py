@@ -0,0 +1,231 @@
+"""
+Consultas sobre la cadena de opciones cacheada: filtros por rango resueltos
+con búsqueda binaria sobre índices ordenados (construidos una vez por
+snapshot), paginación y proyección de columnas
+"""
+import numpy as np
+import pandas as pd
+
+from modules.volatility.chain import GREEK_FIELDS, NUMERIC_FIELDS, OPTION_TYPES, as_float64
+
+# Columnas que se pueden pedir en fields
+QUERY_FIELDS = ('instrument_name', 'expiration_date', 'strike', 'type', 'moneyness') + NUMERIC_FIELDS + GREEK_FIELDS
+DEFAULT_FIELDS = ('instrument_name', 'expiration_date', 'strike', 'type', 'mark_iv', 'open_interest', 'delta')
+# Columnas con índice ordenado (filtros *_min / *_max)
+RANGE_COLUMNS = ('strike', 'moneyness', 'delta', 'open_interest')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+TYPE_CODES = {'C': 0, 'CALL': 0, 'P': 1, 'PUT': 1}
+
+
+class ChainIndex:
+    """
+    Índices de un snapshot de la cadena: para cada columna de RANGE_COLUMNS,
+    el orden de las filas y los valores ordenados (los NaN quedan al final y
+    no entran en ningún rango). El vencimiento no necesita índice: las filas
+    ya están agrupadas por vencimiento en rangos contiguos.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        with np.errstate(divide='ignore', invalid='ignore'):
+            moneyness = chain['strike'].astype(np.float64) / chain['underlying_price'].astype(np.float64)
+        moneyness[~np.isfinite(moneyness)] = np.nan
+        self.columns = {
+            'strike': chain['strike'].astype(np.float64),
+            'moneyness': moneyness,
+            'delta': chain['delta'].astype(np.float64),
+            'open_interest': chain['open_interest'].astype(np.float64),
+        }
+        # columna -> (orden de filas, valores ordenados sin NaN)
+        self._sorted = {}
+        for name, values in self.columns.items():
+            order = np.argsort(values, kind='stable')
+            valid = int(np.count_nonzero(~np.isnan(values)))
+            self._sorted[name] = (order[:valid], values[order[:valid]])
+
+    @classmethod
+    def for_chain(cls, chain):
+        """Índice de la cadena, construido la primera vez que se consulta el snapshot"""
+        return chain.memoize(('query_index',), lambda: cls(chain))
+
+    def range_bounds(self, column, low=None, high=None):
+        """Posiciones [inicio, fin) en el orden de column de los valores en [low, high]"""
+        order, values = self._sorted[column]
+        start = int(np.searchsorted(values, low, side='left')) if low is not None else 0
+        stop = int(np.searchsorted(values, high, side='right')) if high is not None else len(values)
+        return start, max(start, stop)
+
+    def range_rows(self, column, start, stop):
+        return self._sorted[column][0][start:stop]
+
+    def expiry_bounds(self, start=None, end=None):
+        """Filas [inicio, fin) de los vencimientos entre start y end (inclusive)"""
+        chain = self.chain
+        first = int(np.searchsorted(chain.expiries, _day(start), side='left')) if start is not None else 0
+        last = int(np.searchsorted(chain.expiries, _day(end), side='right')) if end is not None else len(chain.expiries)
+        return int(chain.expiry_bounds[first]), int(chain.expiry_bounds[max(first, last)])
+
+
+def _day(value):
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
+
+
+def _number(filters, name):
+    value = filters.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} debe ser numérico: {value!r}")
+    if np.isnan(value):
+        raise ValueError(f"{name} no puede ser NaN")
+    return value
+
+
+def parse_query(filters):
+    """
+    Normaliza los filtros de una consulta
+
+    Args:
+        filters: Dict con expiry_from, expiry_to ('YYYY-MM-DD'), strike_min,
+            strike_max, moneyness_min, moneyness_max (K/F), delta_min,
+            delta_max, type ('C'/'P'/'call'/'put') y min_oi
+
+    Returns:
+        Dict con 'ranges' {columna: (low, high)}, 'expiry' (from, to) y 'type'
+
+    Raises:
+        ValueError: Si algún filtro no es válido
+    """
+    filters = filters or {}
+    ranges = {}
+    for column, low_key, high_key in (('strike', 'strike_min', 'strike_max'),
+                                      ('moneyness', 'moneyness_min', 'moneyness_max'),
+                                      ('delta', 'delta_min', 'delta_max')):
+        low, high = _number(filters, low_key), _number(filters, high_key)
+        if low is not None or high is not None:
+            ranges[column] = (low, high)
+    min_oi = _number(filters, 'min_oi')
+    if min_oi is not None:
+        ranges['open_interest'] = (min_oi, None)
+
+    expiry = []
+    for key in ('expiry_from', 'expiry_to'):
+        value = filters.get(key)
+        if value:
+            try:
+                _day(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} no es una fecha válida: {value!r}")
+        expiry.append(value or None)
+
+    option_type = filters.get('type') or None
+    if option_type is not None:
+        option_type = str(option_type).upper()
+        if option_type not in TYPE_CODES:
+            raise ValueError(f"type no válido: {option_type!r} (C, P, call o put)")
+        option_type = TYPE_CODES[option_type]
+    return {'ranges': ranges, 'expiry': tuple(expiry), 'type': option_type}
+
+
+def matching_rows(chain, query):
+    """
+    Filas (en el orden de la cadena) que cumplen todos los filtros.
+
+    Cada filtro de rango se traduce con búsqueda binaria a un tramo de su
+    índice, cuyo tamaño se conoce sin recorrer datos. El tramo más pequeño
+    (o el rango contiguo de vencimientos) da las filas candidatas y el resto
+    de filtros solo se evalúa sobre ellas.
+    """
+    index = ChainIndex.for_chain(chain)
+    expiry_start, expiry_stop = index.expiry_bounds(*query['expiry'])
+
+    spans = {column: index.range_bounds(column, low, high) for column, (low, high) in query['ranges'].items()}
+    driver = min(spans, key=lambda column: spans[column][1] - spans[column][0], default=None)
+    if driver is None or spans[driver][1] - spans[driver][0] >= expiry_stop - expiry_start:
+        driver = None
+        rows = np.arange(expiry_start, expiry_stop)
+    else:
+        rows = np.sort(index.range_rows(driver, *spans[driver]))
+        rows = rows[(rows >= expiry_start) & (rows < expiry_stop)]
+
+    for column, (low, high) in query['ranges'].items():
+        if column == driver or len(rows) == 0:
+            continue
+        values = index.columns[column][rows]
+        keep = ~np.isnan(values)
+        if low is not None:
+            keep &= values >= low
+        if high is not None:
+            keep &= values <= high
+        rows = rows[keep]
+
+    if query['type'] is not None and len(rows):
+        rows = rows[chain['type_code'][rows] == query['type']]
+    return rows
+
+
+def project(chain, rows, fields):
+    """Registros con solo las columnas pedidas para las filas dadas"""
+    index = ChainIndex.for_chain(chain)
+    cols = chain.columns
+    data = {}
+    for field in fields:
+        if field == 'instrument_name':
+            data[field] = cols['instrument_name'][rows].tolist()
+        elif field == 'expiration_date':
+            data[field] = np.datetime_as_string(chain.expiries[cols['expiry_code'][rows]]).tolist()
+        elif field == 'type':
+            data[field] = np.asarray(OPTION_TYPES)[cols['type_code'][rows]].tolist()
+        else:
+            values = index.columns[field][rows] if field == 'moneyness' else as_float64(cols[field][rows])
+            if field == 'moneyness':
+                values = np.round(values, 6)
+            data[field] = np.where(np.isnan(values), None, values).tolist()
+    return [dict(zip(fields, row)) for row in zip(*data.values())]
+
+
+def query_chain(chain, filters=None, fields=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+    """
+    Consulta paginada sobre un snapshot de la cadena
+
+    Args:
+        chain: OptionsChain completa
+        filters: Filtros (ver parse_query)
+        fields: Columnas a devolver (por defecto, DEFAULT_FIELDS)
+        offset: Primera fila de la página
+        limit: Filas por página (máximo MAX_PAGE_SIZE)
+
+    Returns:
+        Dict con el total de filas que cumplen los filtros, la página pedida
+        y el offset de la siguiente (None si es la última)
+
+    Raises:
+        ValueError: Si los filtros, las columnas o la paginación no son válidos
+    """
+    fields = list(fields or DEFAULT_FIELDS)
+    unknown = [field for field in fields if field not in QUERY_FIELDS]
+    if unknown:
+        raise ValueError(f"Columnas no disponibles: {', '.join(map(str, unknown))}")
+    fields = list(dict.fromkeys(fields))
+    if offset < 0:
+        raise ValueError("offset no puede ser negativo")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit debe estar entre 1 y {MAX_PAGE_SIZE}")
+
+    rows = matching_rows(chain, parse_query(filters))
+    page = rows[offset:offset + limit]
+    next_offset = offset + len(page)
+    return {
+        'currency': chain.currency,
+        'snapshot': chain.version,
+        'total': int(len(rows)),
+        'offset': offset,
+        'limit': limit,
+        'next_offset': next_offset if next_offset < len(rows) else None,
+        'fields': fields,
+        'data': project(chain, page, fields)
+    }
@@ -0,0 +1,301 @@
+"""
+Motor de volatilidad realizada (close-to-close, Parkinson, Garman-Klass y Yang-Zhang)
+"""
+import threading
+
+import numpy as np
+
+from modules.replay.clock import now_ms
+
+ESTIMATORS = ('close_to_close', 'parkinson', 'garman_klass', 'yang_zhang')
+DEFAULT_WINDOWS = (7, 30, 90)
+# Valores de volatilidad que se guardan por ventana para calcular percentiles
+HISTORY_SIZE = 365
+
+TIMEFRAME_SECONDS = {
+    '1m': 60, '5m': 300, '15m': 900, '30m': 1800,
+    '1h': 3600, '4h': 14400, '1d': 86400, '1w': 604800
+}
+
+# Términos por vela que se acumulan en las sumas móviles:
+# r = ln(C/C_prev), hl = ln(H/L), o = ln(O/C_prev), c = ln(C/O), rs = término de Rogers-Satchell
+_R, _R2, _HL2, _O, _O2, _C, _C2, _RS = range(8)
+N_TERMS = 8
+_LN2 = np.log(2.0)
+
+
+def periods_per_year(timeframe):
+    """Número de velas por año (mercado 24/7)"""
+    return 365.0 * 86400.0 / TIMEFRAME_SECONDS[timeframe]
+
+
+def closed_candles(candles, timeframe):
+    """Descarta la vela en curso (todavía no cerrada); None si no hay velas"""
+    if candles is None or len(candles['timestamp']) == 0:
+        return None
+    closed = candles['timestamp'] + TIMEFRAME_SECONDS[timeframe] * 1000 <= now_ms()
+    return {name: values[closed] for name, values in candles.items()}
+
+
+def candle_terms(open_, high, low, close, prev_close):
+    """
+    Términos por vela de los cuatro estimadores (vectorizado, cualquier forma)
+
+    Returns:
+        Array con un eje final de tamaño N_TERMS
+    """
+    r = np.log(close / prev_close)
+    hl = np.log(high / low)
+    o = np.log(open_ / prev_close)
+    c = np.log(close / open_)
+    rs = np.log(high / close) * np.log(high / open_) + np.log(low / close) * np.log(low / open_)
+    return np.stack([r, r * r, hl * hl, o, o * o, c, c * c, rs], axis=-1)
+
+
+def estimators_from_sums(sums, n, ppy):
+    """
+    Volatilidades anualizadas a partir de las sumas de términos de una ventana
+
+    Args:
+        sums: Array [..., N_TERMS] con las sumas de la ventana
+        n: Número de velas de la ventana (>= 2)
+        ppy: Velas por año
+    """
+    s = np.moveaxis(np.asarray(sums, dtype=np.float64), -1, 0)
+    cc_var = (s[_R2] - s[_R] * s[_R] / n) / (n - 1)
+    park_var = s[_HL2] / (4.0 * _LN2 * n)
+    gk_var = (0.5 * s[_HL2] - (2.0 * _LN2 - 1.0) * s[_C2]) / n
+    o_var = (s[_O2] - s[_O] * s[_O] / n) / (n - 1)
+    c_var = (s[_C2] - s[_C] * s[_C] / n) / (n - 1)
+    k = 0.34 / (1.34 + (n + 1.0) / (n - 1.0))
+    yz_var = o_var + k * c_var + (1.0 - k) * s[_RS] / n
+    return {
+        name: np.sqrt(np.maximum(var, 0.0) * ppy)
+        for name, var in zip(ESTIMATORS, (cc_var, park_var, gk_var, yz_var))
+    }
+
+
+def rolling_volatility(open_, high, low, close, window, ppy):
+    """
+    Volatilidad realizada móvil de varios símbolos a la vez
+
+    Args:
+        open_, high, low, close: Arrays [símbolos, velas]
+        window: Tamaño de la ventana en velas
+        ppy: Velas por año
+
+    Returns:
+        Dict estimador -> array [símbolos, velas - window] (la primera vela solo
+        aporta el cierre previo)
+    """
+    terms = candle_terms(open_[:, 1:], high[:, 1:], low[:, 1:], close[:, 1:], close[:, :-1])
+    cumulative = np.concatenate([np.zeros(terms.shape[:1] + (1, N_TERMS)), np.cumsum(terms, axis=1)], axis=1)
+    sums = cumulative[:, window:] - cumulative[:, :-window]
+    return estimators_from_sums(sums, window, ppy)
+
+
+class RollingVolatilityState:
+    """
+    Estado incremental de un símbolo: búfer circular con los términos de las
+    últimas velas, sumas móviles por ventana e historial de volatilidades.
+    Cada vela nueva se incorpora en O(1).
+    """
+
+    def __init__(self, windows, ppy, history_size=HISTORY_SIZE):
+        self.windows = tuple(sorted(windows))
+        self.ppy = ppy
+        self.capacity = self.windows[-1]
+        self.buffer = np.zeros((self.capacity, N_TERMS))
+        self.count = 0
+        self.head = 0
+        self.sums = {w: np.zeros(N_TERMS) for w in self.windows}
+        self.history_size = history_size
+        self.history = {w: np.full((history_size, len(ESTIMATORS)), np.nan) for w in self.windows}
+        self.history_head = {w: 0 for w in self.windows}
+        self.last_timestamp = None
+        self.last_close = None
+
+    def seed(self, candles, histories):
+        """
+        Inicializa el estado con las velas de un símbolo y sus volatilidades móviles
+        ya calculadas en bloque por rolling_volatility
+
+        Args:
+            candles: Dict de arrays 1D (timestamp, open, high, low, close)
+            histories: Dict ventana -> dict estimador -> array 1D de volatilidades
+        """
+        terms = candle_terms(candles['open'][1:], candles['high'][1:], candles['low'][1:],
+                             candles['close'][1:], candles['close'][:-1])
+        for row in terms[-self.capacity:]:
+            self._push(row)
+        for w in self.windows:
+            values = np.column_stack([histories[w][name] for name in ESTIMATORS])[-self.history_size:]
+            self.history[w][:len(values)] = values
+            self.history_head[w] = len(values) % self.history_size
+        self.last_timestamp = int(candles['timestamp'][-1])
+        self.last_close = float(candles['close'][-1])
+
+    def _push(self, row):
+        for w in self.windows:
+            self.sums[w] += row
+            if self.count >= w:
+                self.sums[w] -= self.buffer[(self.head - w) % self.capacity]
+        self.buffer[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count += 1
+
+    def update(self, timestamp, open_, high, low, close):
+        """Incorpora una vela cerrada nueva"""
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return
+        if self.last_close is not None:
+            self._push(candle_terms(open_, high, low, close, self.last_close))
+            for w in self.windows:
+                if self.count >= w:
+                    values = self.current(w)
+                    self.history[w][self.history_head[w]] = [values[name] for name in ESTIMATORS]
+                    self.history_head[w] = (self.history_head[w] + 1) % self.history_size
+        self.last_timestamp = int(timestamp)
+        self.last_close = float(close)
+
+    def current(self, window):
+        """Volatilidades anualizadas de la ventana con las últimas velas"""
+        if self.count < window:
+            return {name: None for name in ESTIMATORS}
+        values = estimators_from_sums(self.sums[window], window, self.ppy)
+        return {name: float(values[name]) for name in ESTIMATORS}
+
+    def percentiles(self, window, values):
+        """Percentil (0-1) de cada estimador actual frente al historial propio"""
+        history = self.history[window]
+        result = {}
+        for i, name in enumerate(ESTIMATORS):
+            past = history[:, i][np.isfinite(history[:, i])]
+            value = values.get(name)
+            result[name] = float((past < value).mean()) if len(past) and value is not None else None
+        return result
+
+    def recent(self, window, bars):
+        """Últimos valores del historial de una ventana (orden cronológico)"""
+        order = (np.arange(self.history_size) + self.history_head[window]) % self.history_size
+        history = self.history[window][order]
+        history = history[np.isfinite(history[:, 0])]
+        return history[-bars:]
+
+
+class RealizedVolatilityEngine:
+    """
+    Calcula la volatilidad realizada de varios símbolos con velas de MarketService.
+    La primera vez se calcula en bloque (vectorizado entre símbolos); después
+    solo se piden las velas nuevas y se actualiza el estado incrementalmente.
+    """
+
+    def __init__(self, market_service, source='binance', windows=DEFAULT_WINDOWS, history_size=HISTORY_SIZE):
+        self.market_service = market_service
+        self.source = source
+        self.windows = tuple(sorted(windows))
+        self.history_size = history_size
+        self._states = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _market_symbol(symbol):
+        return symbol if '/' in symbol else f"{symbol.upper()}/USDT"
+
+    def _seed(self, symbols, timeframe):
+        """Descarga el histórico de los símbolos y construye su estado (sin tocar self._states)"""
+        ppy = periods_per_year(timeframe)
+        limit = self.history_size + self.windows[-1] + 2
+        by_length = {}
+        for symbol in symbols:
+            candles = self.market_service.get_ohlcv_arrays(self._market_symbol(symbol), timeframe, limit, self.source)
+            candles = closed_candles(candles, timeframe)
+            if candles is not None and len(candles['close']) > self.windows[-1] + 1:
+                by_length.setdefault(len(candles['close']), {})[symbol] = candles
+
+        # Se calcula en bloque cada grupo de símbolos con el mismo número de velas:
+        # un símbolo con poco histórico no recorta el de los demás
+        states = {}
+        for loaded in by_length.values():
+            stacked = {
+                field: np.vstack([c[field] for c in loaded.values()])
+                for field in ('open', 'high', 'low', 'close')
+            }
+            rolling = {
+                w: rolling_volatility(stacked['open'], stacked['high'], stacked['low'], stacked['close'], w, ppy)
+                for w in self.windows
+            }
+            for i, (symbol, candles) in enumerate(loaded.items()):
+                state = RollingVolatilityState(self.windows, ppy, self.history_size)
+                state.seed(candles, {w: {name: rolling[w][name][i] for name in ESTIMATORS} for w in self.windows})
+                states[symbol] = state
+        return states
+
+    def _new_candles(self, symbol, timeframe, last_timestamp):
+        """Velas cerradas posteriores a last_timestamp (None si aún no puede haberlas)"""
+        # Solo hay vela cerrada nueva si ha pasado un periodo completo desde la última
+        period_ms = TIMEFRAME_SECONDS[timeframe] * 1000
+        if now_ms() < last_timestamp + 2 * period_ms:
+            return None
+        candles = self.market_service.get_ohlcv_arrays(
+            self._market_symbol(symbol), timeframe, 1000, self.source, since=last_timestamp + 1
+        )
+        return closed_candles(candles, timeframe)
+
+    def analyze(self, symbols, timeframe='1d'):
+        """
+        Volatilidad realizada de cada símbolo para todas las ventanas configuradas
+
+        Args:
+            symbols: Lista de símbolos base (BTC, ETH...) o pares 'BTC/USDT'
+            timeframe: Temporalidad de las velas
+
+        Returns:
+            Dict símbolo -> {ventana: {estimadores, percentiles}}
+        """
+        if timeframe not in TIMEFRAME_SECONDS:
+            raise ValueError(f"Temporalidad no soportada: {timeframe}")
+
+        # Las velas se piden fuera del lock; solo la actualización de estados lo toma
+        with self._lock:
+            known = {s: self._states[(s, timeframe)].last_timestamp
+                     for s in symbols if (s, timeframe) in self._states}
+        missing = [s for s in symbols if s not in known]
+        seeded = self._seed(missing, timeframe) if missing else {}
+        fresh = {s: self._new_candles(s, timeframe, last) for s, last in known.items()}
+
+        with self._lock:
+            for symbol, state in seeded.items():
+                self._states.setdefault((symbol, timeframe), state)
+            for symbol, candles in fresh.items():
+                if candles is None:
+                    continue
+                # update descarta velas ya incorporadas por otra petición concurrente
+                state = self._states[(symbol, timeframe)]
+                for ts, o, h, l, c in zip(candles['timestamp'].tolist(), candles['open'].tolist(),
+                                          candles['high'].tolist(), candles['low'].tolist(),
+                                          candles['close'].tolist()):
+                    state.update(ts, o, h, l, c)
+
+            result = {}
+            for symbol in symbols:
+                state = self._states.get((symbol, timeframe))
+                if state is None:
+                    continue
+                windows = {}
+                for w in self.windows:
+                    values = state.current(w)
+                    windows[str(w)] = {
+                        'volatility': values,
+                        'percentile': state.percentiles(w, values)
+                    }
+                result[symbol] = {
+                    'timeframe': timeframe,
+                    'last_candle': state.last_timestamp,
+                    'windows': windows
+                }
+            return result
+
+    def state(self, symbol, timeframe='1d'):
+        """Estado incremental de un símbolo (None si aún no se ha analizado)"""
+        return self._states.get((symbol, timeframe))
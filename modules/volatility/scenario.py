@@ -0,0 +1,315 @@
+"""
+Escenarios de P&L y griegas de una cartera de opciones sobre una rejilla de
+movimientos del subyacente, desplazamientos de IV y paso del tiempo
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from modules.volatility.cache import DataCache
+from modules.volatility.chain import CALL, OPTION_TYPES, as_float64
+from modules.volatility.greeks import black_scholes_greeks, black_scholes_price, years_to_expiry
+
+# Métricas de la rejilla (además del valor de la cartera)
+SCENARIO_GREEKS = ('delta', 'gamma', 'vega', 'theta')
+# Límites de tamaño de una consulta
+MAX_GRID_POINTS = 2000000
+MAX_LEGS = 200
+# IV mínima tras aplicar el desplazamiento (en tanto por uno)
+MIN_IV = 0.01
+D_LIMIT = np.float32(9.0)
+
+# Abramowitz-Stegun 7.1.26 en float32: coeficientes del polinomio (ya divididos
+# por 2: dan directamente la cola 1 - N(|x|)) y p / sqrt(2) para usar x sin escalar
+_TAIL_COEFFS = tuple(np.float32(c / 2.0) for c in (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429))
+_TAIL_P = np.float32(0.3275911 / np.sqrt(2.0))
+_INV_SQRT_2PI = np.float32(1.0 / np.sqrt(2.0 * np.pi))
+
+
+def scenario_grid(price_range=0.5, price_steps=200, iv_range=30.0, iv_steps=50, days=30.0, time_steps=10):
+    """
+    Ejes de la rejilla
+
+    Args:
+        price_range: Movimiento máximo del subyacente en tanto por uno (0.5 = ±50%)
+        iv_range: Desplazamiento máximo de IV en puntos de volatilidad
+        days: Horizonte en días (el primer paso es hoy)
+
+    Returns:
+        (movimientos, desplazamientos de IV en puntos, días) como arrays float64
+    """
+    price_steps, iv_steps, time_steps = int(price_steps), int(iv_steps), int(time_steps)
+    if min(price_steps, iv_steps, time_steps) < 1:
+        raise ValueError("Cada eje de la rejilla necesita al menos un punto")
+    if price_steps * iv_steps * time_steps > MAX_GRID_POINTS:
+        raise ValueError(f"La rejilla supera {MAX_GRID_POINTS} puntos")
+    if not 0 <= price_range < 1:
+        raise ValueError("price_range debe estar entre 0 y 1")
+    moves = np.linspace(-price_range, price_range, price_steps) if price_steps > 1 else np.zeros(1)
+    shifts = np.linspace(-iv_range, iv_range, iv_steps) if iv_steps > 1 else np.zeros(1)
+    horizon = np.linspace(0.0, max(float(days), 0.0), time_steps)
+    return moves, shifts, horizon
+
+
+def _cdf_pdf(x, cdf, pdf, tmp):
+    """
+    Normal acumulada y densidad de x en los buffers cdf y pdf (float32, sin
+    temporales). La exponencial de Abramowitz-Stegun es la misma de la densidad,
+    y el signo se aplica con aritmética en lugar de una máscara (np.where con
+    signos aleatorios es varias veces más lento que el resto del cálculo).
+    """
+    a1, a2, a3, a4, a5 = _TAIL_COEFFS
+    np.abs(x, out=tmp)
+    tmp *= _TAIL_P
+    tmp += 1
+    np.reciprocal(tmp, out=tmp)
+    np.multiply(tmp, a5, out=cdf)
+    for coeff in (a4, a3, a2, a1):
+        cdf += coeff
+        cdf *= tmp
+    np.multiply(x, x, out=pdf)
+    pdf *= np.float32(-0.5)
+    np.exp(pdf, out=pdf)
+    cdf *= pdf                          # cola: 1 - N(|x|)
+    np.subtract(np.float32(0.5), cdf, out=cdf)
+    np.sign(x, out=tmp)
+    cdf *= tmp
+    cdf += np.float32(0.5)              # N(x) = 0.5 + sign(x) * (0.5 - cola)
+    pdf *= _INV_SQRT_2PI
+    return cdf, pdf
+
+
+def call_unit_grid(forward, strike, t, iv, moves, shifts, horizon):
+    """
+    Valor y griegas de una call (Black-76, una unidad) en toda la rejilla
+
+    Los términos que solo dependen de un eje (log-moneyness por precio,
+    sigma*sqrt(t) por IV y tiempo) se calculan aparte y se combinan por
+    broadcasting en buffers float32. Internamente la rejilla es (tiempo, IV,
+    precio): el eje de precio, el más largo, queda contiguo en los bucles de
+    NumPy, y los pasos ya vencidos (un sufijo del eje de tiempo) toman el
+    valor intrínseco.
+
+    Returns:
+        Dict de arrays float32 (tiempo, IV, precio): value, delta, gamma, vega, theta
+    """
+    forwards = (forward * (1.0 + moves)).astype(np.float32)
+    shape = (len(horizon), len(shifts), len(moves))
+    remaining = t - horizon / 365.0
+    live = int(np.count_nonzero(remaining > 0))  # horizon es creciente: los vivos son un prefijo
+
+    grid = {name: np.empty(shape, dtype=np.float32) for name in ('value',) + SCENARIO_GREEKS}
+    if live:
+        out = {name: values[:live] for name, values in grid.items()}
+        d1, d2, nd1, pdf, nd2, tmp = (np.empty((live,) + shape[1:], dtype=np.float32) for _ in range(6))
+
+        sigma = np.maximum(iv + shifts / 100.0, MIN_IV).astype(np.float32)[None, :, None]
+        sqrt_t = np.sqrt(remaining[:live]).astype(np.float32)[:, None, None]
+        vol_time = sigma * sqrt_t                                  # (tiempo, IV, 1)
+        strike = np.float32(strike)
+
+        np.add(np.log(forwards / strike), np.float32(0.5) * vol_time * vol_time, out=d1)
+        d1 /= vol_time
+        np.subtract(d1, vol_time, out=d2)
+        # Más allá de ±D_LIMIT N(d) ya es 0 o 1 en float32; recortar evita que
+        # exp(-d²/2) caiga en números subnormales, que son mucho más lentos
+        np.clip(d1, -D_LIMIT, D_LIMIT, out=d1)
+        np.clip(d2, -D_LIMIT, D_LIMIT, out=d2)
+        _cdf_pdf(d1, nd1, pdf, tmp)
+        _cdf_pdf(d2, nd2, d1, tmp)
+
+        np.multiply(nd1, forwards, out=out['value'])
+        nd2 *= strike
+        out['value'] -= nd2
+        out['delta'][...] = nd1
+        pdf *= forwards                                            # F * pdf(d1)
+        np.multiply(pdf, sqrt_t / np.float32(100.0), out=out['vega'])
+        np.multiply(pdf, -sigma / (np.float32(2.0 * 365.0) * sqrt_t), out=out['theta'])
+        np.multiply(vol_time, forwards * forwards, out=tmp)
+        np.divide(pdf, tmp, out=out['gamma'])                      # pdf / (F * sigma * sqrt(t))
+    if live < shape[0]:
+        # Vencida: valor intrínseco, delta 0/1 y resto de griegas a 0
+        intrinsic = np.maximum(forwards - np.float32(strike), 0)
+        grid['value'][live:] = intrinsic
+        grid['delta'][live:] = intrinsic > 0
+        for name in ('gamma', 'vega', 'theta'):
+            grid[name][live:] = 0
+    return grid
+
+
+def _instrument_index(chain):
+    return chain.memoize(('instrument_index',), lambda: pd.Index(chain['instrument_name']))
+
+
+def leg_terms(chain, instrument):
+    """
+    Términos de un instrumento en el snapshot (strike, tipo, forward, IV, t),
+    memoizados por cadena
+
+    Returns:
+        Dict o None si el instrumento no está en la cadena
+    """
+    def compute():
+        row = _instrument_index(chain).get_indexer([instrument])[0]
+        if row < 0:
+            return None
+        expiry = chain.expiries[chain['expiry_code'][row]]
+        value = lambda field: float(as_float64(chain[field][row:row + 1])[0])
+        return {
+            'instrument': instrument,
+            'expiry': str(expiry),
+            'strike': value('strike'),
+            'is_call': bool(chain['type_code'][row] == CALL),
+            'forward': value('underlying_price'),
+            'iv': value('mark_iv') / 100.0,
+            't': float(years_to_expiry(np.array([expiry]), chain.timestamp)[0]),
+        }
+    return chain.memoize(('leg_terms', instrument), compute)
+
+
+class ScenarioEngine:
+    """
+    Rejillas de escenarios de carteras de opciones. Las calls y puts del mismo
+    strike, vencimiento e IV se evalúan una sola vez (paridad put-call: una put
+    es una call menos un forward), y la rejilla unitaria de cada (vencimiento,
+    strike) se guarda en una caché acotada: una consulta que solo cambia
+    cantidades o añade una pata reutiliza el resto.
+    """
+
+    def __init__(self, max_legs_cached=None):
+        # Cada rejilla unitaria de 200x50x10 ocupa 2 MB (cinco métricas en float32)
+        max_legs_cached = max_legs_cached or int(os.getenv('TRADINGROAD_SCENARIO_CACHE_LEGS', '48'))
+        self.unit_grids = DataCache(max_legs_cached)
+
+    def _unit_grid(self, chain, terms, grid_key, axes):
+        key = (chain.currency, chain.version, terms['expiry'], terms['strike'], terms['iv'], grid_key)
+        return self.unit_grids.get(
+            key, lambda: call_unit_grid(terms['forward'], terms['strike'], terms['t'], terms['iv'], *axes),
+            ttl_seconds=3600
+        )
+
+    def evaluate(self, chain, positions, grid=None, fields=SCENARIO_GREEKS):
+        """
+        P&L y griegas de una cartera en la rejilla
+
+        Args:
+            chain: OptionsChain del snapshot
+            positions: Lista de {'instrument', 'quantity', ['entry_price' en USD por unidad]}
+                (quantity negativa = vendida)
+            grid: Parámetros de scenario_grid
+            fields: Griegas a devolver (subconjunto de SCENARIO_GREEKS)
+
+        Returns:
+            Dict con ejes, patas, valor actual y rejillas (precio, IV, tiempo) en USD
+        """
+        if len(positions) > MAX_LEGS:
+            raise ValueError(f"Como máximo {MAX_LEGS} posiciones")
+        fields = [field for field in fields if field in SCENARIO_GREEKS]
+        grid = dict(grid or {})
+        try:
+            axes = scenario_grid(**grid)
+        except TypeError as e:
+            raise ValueError(f"Rejilla no válida: {e}")
+        grid_key = tuple(sorted(grid.items()))
+        moves = axes[0]
+
+        legs, missing = [], []
+        for position in positions:
+            try:
+                instrument, quantity = str(position['instrument']), float(position['quantity'])
+                entry_price = position.get('entry_price')
+                entry_price = float(entry_price) if entry_price is not None else None
+            except (KeyError, TypeError, ValueError, AttributeError):
+                raise ValueError(f"Posición no válida: {position}")
+            terms = leg_terms(chain, instrument)
+            if terms is None:
+                missing.append(instrument)
+                continue
+            legs.append({**terms, 'quantity': quantity, 'entry_price': entry_price})
+        if not legs:
+            return {'legs': [], 'missing': missing}
+
+        # Valor y griegas actuales de cada pata (escenario base, sin mover nada)
+        forward = np.array([leg['forward'] for leg in legs])
+        strike = np.array([leg['strike'] for leg in legs])
+        t = np.array([leg['t'] for leg in legs])
+        iv = np.array([leg['iv'] for leg in legs])
+        is_call = np.array([leg['is_call'] for leg in legs])
+        quantity = np.array([leg['quantity'] for leg in legs])
+        value_now = black_scholes_price(forward, strike, t, iv, is_call)
+        greeks_now = black_scholes_greeks(forward, strike, t, iv, is_call)
+        cost = np.array([leg['entry_price'] if leg['entry_price'] is not None else value_now[i]
+                         for i, leg in enumerate(legs)], dtype=np.float64)
+
+        # Agrupación por (vencimiento, strike): cantidad equivalente en calls y
+        # la parte lineal de las puts (-(F - K) por unidad)
+        # Acumulación en la disposición interna (tiempo, IV, precio)
+        shape = (len(axes[2]), len(axes[1]), len(moves))
+        totals = {name: np.zeros(shape, dtype=np.float32) for name in ('value',) + tuple(fields)}
+        put_qty = np.where(is_call, 0.0, quantity)
+        forwards = forward[:, None] * (1.0 + moves[None, :])
+        linear = -(put_qty[:, None] * (forwards - strike[:, None])).sum(axis=0)
+        totals['value'] += linear.astype(np.float32)
+        if 'delta' in totals:
+            totals['delta'] -= put_qty.sum()
+
+        groups = {}
+        for leg in legs:
+            key = (leg['expiry'], leg['strike'], leg['iv'])
+            groups.setdefault(key, [leg, 0.0])[1] += leg['quantity']
+        scaled = np.empty(shape, dtype=np.float32)
+        for leg, call_qty in groups.values():
+            if call_qty == 0:
+                continue
+            unit = self._unit_grid(chain, leg, grid_key, axes)
+            for name, total in totals.items():
+                np.multiply(unit[name], np.float32(call_qty), out=scaled)
+                total += scaled
+
+        totals['value'] -= np.float32((quantity * cost).sum())
+        # Rejillas de salida como (precio, IV, tiempo)
+        totals = {name: np.ascontiguousarray(values.transpose(2, 1, 0)) for name, values in totals.items()}
+        result = {
+            'currency': chain.currency,
+            'snapshot': chain.version,
+            'axes': {
+                'price_move': moves,
+                'iv_shift': axes[1],
+                'days': axes[2],
+            },
+            'legs': [{
+                'instrument': leg['instrument'],
+                'type': OPTION_TYPES[CALL if leg['is_call'] else 1],
+                'expiry': leg['expiry'],
+                'strike': leg['strike'],
+                'quantity': leg['quantity'],
+                'forward': leg['forward'],
+                'mark_iv': leg['iv'] * 100.0,
+                'value': float(value_now[i]),
+                'cost': float(cost[i]),
+            } for i, leg in enumerate(legs)],
+            'missing': missing,
+            'current': {
+                'value': float((quantity * value_now).sum()),
+                'pnl': float((quantity * (value_now - cost)).sum()),
+                **{name: float((quantity * greeks_now[name]).sum()) for name in fields}
+            },
+            'pnl': totals.pop('value'),
+        }
+        result.update(totals)
+        return result
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def default_scenario_engine():
+    """Motor de escenarios compartido del proceso"""
+    global _default_engine
+    with _default_engine_lock:
+        if _default_engine is None:
+            _default_engine = ScenarioEngine()
+        return _default_engine
@@ -0,0 +1,290 @@
+"""
+Histórico local de sentimiento de derivados de Binance (open interest,
+ratio long/short y funding) con descarga incremental
+"""
+import os
+import threading
+
+import numpy as np
+
+from config.paths import STORE_DIR
+from modules.replay.clock import now_ms as clock_ms
+from modules.replay.http import http_session
+from modules.volatility.store import SeriesStore
+
+BINANCE_FUTURES_URL = "https://fapi.binance.com"
+
+# Serie -> definición (endpoint, campos de la respuesta, paso en ms, límite por llamada, histórico disponible)
+SERIES = {
+    'open_interest': {
+        'path': '/futures/data/openInterestHist',
+        'time_field': 'timestamp',
+        'fields': (('sum_open_interest', 'sumOpenInterest'), ('sum_open_interest_value', 'sumOpenInterestValue')),
+        'params': {'period': '5m'},
+        'step_ms': 5 * 60 * 1000,
+        'limit': 500,
+        'lookback_days': 30,
+    },
+    'long_short': {
+        'path': '/futures/data/globalLongShortAccountRatio',
+        'time_field': 'timestamp',
+        'fields': (('long_short_ratio', 'longShortRatio'), ('long_account', 'longAccount'),
+                   ('short_account', 'shortAccount')),
+        'params': {'period': '5m'},
+        'step_ms': 5 * 60 * 1000,
+        'limit': 500,
+        'lookback_days': 30,
+    },
+    'funding': {
+        'path': '/fapi/v1/fundingRate',
+        'time_field': 'fundingTime',
+        'fields': (('funding_rate', 'fundingRate'), ('mark_price', 'markPrice')),
+        'params': {},
+        # Depende del símbolo (1h, 4h u 8h): ver BinanceSentimentStore._step_ms
+        'step_ms': None,
+        'limit': 1000,
+        'lookback_days': 365,
+    },
+}
+
+# Máximo de páginas por sincronización de una serie
+MAX_PAGES = 100
+# Intervalo de funding de los símbolos que no aparecen en fundingInfo
+DEFAULT_FUNDING_HOURS = 8.0
+# Intervalo supuesto si no se puede consultar fundingInfo (el más corto de Binance)
+MIN_FUNDING_HOURS = 1.0
+# Segundos que se reutilizan los intervalos de funding descargados
+FUNDING_INFO_TTL = 3600
+
+
+def series_dtype(name):
+    """dtype de registro de una serie (timestamp + campos float64)"""
+    return np.dtype([('timestamp', '<i8')] + [(field, '<f8') for field, _ in SERIES[name]['fields']])
+
+
+def fetch_binance_series(name, symbol, start_ms, end_ms=None):
+    """
+    Descarga una serie de Binance desde start_ms paginando hacia delante
+
+    Returns:
+        Array estructurado con el dtype de la serie o None si falla la primera página
+    """
+    spec = SERIES[name]
+    dtype = series_dtype(name)
+    url = BINANCE_FUTURES_URL + spec['path']
+    rows = []
+    cursor = int(start_ms)
+    try:
+        for _ in range(MAX_PAGES):
+            params = dict(spec['params'], symbol=f"{symbol}USDT", startTime=cursor, limit=spec['limit'])
+            if end_ms is not None:
+                params['endTime'] = int(end_ms)
+            response = http_session().get(url, params=params, timeout=10)
+            response.raise_for_status()
+            page = response.json()
+            if not page:
+                break
+            rows.extend(page)
+            last = int(page[-1][spec['time_field']])
+            if len(page) < spec['limit'] or last < cursor:
+                break
+            cursor = last + 1
+    except Exception as e:
+        print(f"Error descargando {name} de Binance para {symbol}: {e}")
+        if not rows:
+            return None
+
+    records = np.empty(len(rows), dtype=dtype)
+    records['timestamp'] = [int(item[spec['time_field']]) for item in rows]
+    for field, source in spec['fields']:
+        # Binance devuelve números como texto ('' cuando no hay valor)
+        records[field] = [float(item.get(source) or 'nan') for item in rows]
+    return records
+
+
+def fetch_binance_funding_intervals():
+    """
+    Intervalo de funding en horas de los símbolos de Binance con intervalo
+    propio (el resto liquidan cada DEFAULT_FUNDING_HOURS)
+
+    Returns:
+        Dict 'BTCUSDT' -> horas o None si falla
+    """
+    try:
+        response = http_session().get(BINANCE_FUTURES_URL + '/fapi/v1/fundingInfo', timeout=10)
+        response.raise_for_status()
+        return {item['symbol']: float(item['fundingIntervalHours'])
+                for item in response.json() if item.get('fundingIntervalHours')}
+    except Exception as e:
+        print(f"Error obteniendo los intervalos de funding de Binance: {e}")
+        return None
+
+
+class BinanceSentimentStore:
+    """
+    Series de sentimiento por símbolo persistidas en disco. Cada sincronización
+    solo pide los puntos posteriores al último guardado, de modo que el
+    histórico local crece más allá de lo que Binance permite consultar.
+
+    La descarga inicial de un símbolo sin datos (hasta un año de funding y 30
+    días de series de 5 minutos) nunca se hace en una lectura: se lanza en
+    segundo plano y mientras tanto se sirve lo que haya guardado.
+    """
+
+    # Segundos mínimos entre sincronizaciones de la misma serie
+    MIN_SYNC_SECONDS = 60
+    # Antigüedad de la última sincronización a partir de la cual una lectura
+    # (sync=None) sincroniza por su cuenta; con el hilo de fondo (cada 300 s)
+    # activo las peticiones y los ETag solo leen del almacén
+    READ_SYNC_SECONDS = 900
+
+    def __init__(self, directory=None):
+        directory = directory or os.path.join(STORE_DIR, 'binance')
+        self.stores = {name: SeriesStore(os.path.join(directory, name), series_dtype(name)) for name in SERIES}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._last_sync = {}
+        self._funding_intervals = None
+        self._backfilling = set()
+        self._backfill_lock = threading.Lock()
+        self._worker = None
+        self._stop = threading.Event()
+
+    def _lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _step_ms(self, symbol, name):
+        """Paso de una serie; el del funding es el intervalo real del símbolo"""
+        step = SERIES[name]['step_ms']
+        if step is not None:
+            return step
+        cached = self._funding_intervals
+        if cached is None or clock_ms() - cached[0] >= FUNDING_INFO_TTL * 1000:
+            intervals = fetch_binance_funding_intervals()
+            if intervals is not None or cached is None:
+                cached = self._funding_intervals = (clock_ms(), intervals)
+        intervals = cached[1]
+        hours = intervals.get(f"{symbol}USDT", DEFAULT_FUNDING_HOURS) if intervals is not None else MIN_FUNDING_HOURS
+        return int(hours * 3600 * 1000)
+
+    def sync(self, symbol, names=None):
+        """
+        Añade los puntos nuevos de las series de un símbolo
+
+        Returns:
+            Dict serie -> número de puntos nuevos
+        """
+        symbol = symbol.upper()
+        added = {}
+        for name in names or SERIES:
+            spec = SERIES[name]
+            with self._lock((symbol, name)):
+                now_ms = clock_ms()
+                last_sync = self._last_sync.get((symbol, name), 0)
+                last = self.stores[name].last_timestamp(symbol)
+                # Sin punto nuevo posible todavía o sincronizado hace muy poco
+                if now_ms - last_sync < self.MIN_SYNC_SECONDS * 1000 or (
+                        last is not None and now_ms - last < self._step_ms(symbol, name)):
+                    added[name] = 0
+                    continue
+                start_ms = last + 1 if last is not None else now_ms - spec['lookback_days'] * 86400 * 1000
+                records = fetch_binance_series(name, symbol, start_ms)
+                added[name] = self.stores[name].append(symbol, records) if records is not None else 0
+                self._last_sync[(symbol, name)] = now_ms
+        return added
+
+    def _read_sync(self, symbol, names, sync):
+        """
+        Sincronización previa a una lectura: sync=True siempre, False nunca y
+        None solo las series sin sincronizar en READ_SYNC_SECONDS. Con None, las
+        series que aún no tienen datos se descargan en segundo plano.
+        """
+        if sync is None:
+            now_ms = clock_ms()
+            names = [name for name in names
+                     if now_ms - self._last_sync.get((symbol.upper(), name), 0) >= self.READ_SYNC_SECONDS * 1000]
+            empty = [name for name in names if self.stores[name].last_timestamp(symbol.upper()) is None]
+            if empty:
+                self._backfill(symbol, empty)
+            names = [name for name in names if name not in empty]
+            sync = bool(names)
+        if sync:
+            self.sync(symbol, names)
+
+    def _backfill(self, symbol, names):
+        """Lanza en un hilo propio la descarga inicial de las series que no estén ya descargándose"""
+        symbol = symbol.upper()
+        with self._backfill_lock:
+            names = [name for name in names if (symbol, name) not in self._backfilling]
+            self._backfilling.update((symbol, name) for name in names)
+        if not names:
+            return
+
+        def run():
+            try:
+                self.sync(symbol, names)
+            except Exception as e:
+                print(f"Error descargando el histórico de sentimiento de {symbol}: {e}")
+            finally:
+                with self._backfill_lock:
+                    self._backfilling.difference_update((symbol, name) for name in names)
+
+        threading.Thread(target=run, name=f'sentiment-backfill-{symbol}', daemon=True).start()
+
+    def window(self, symbol, name, start_ms=None, end_ms=None, sync=None):
+        """
+        Puntos de una serie en [start_ms, end_ms] (vista sobre el almacén);
+        nunca posteriores al reloj de la aplicación (instante simulado en replay)
+        """
+        self._read_sync(symbol, [name], sync)
+        now_ms = clock_ms()
+        end_ms = now_ms if end_ms is None else min(int(end_ms), now_ms)
+        return self.stores[name].window(symbol.upper(), start_ms, end_ms)
+
+    def last(self, symbol, name, count, sync=None):
+        """Últimos `count` puntos de una serie hasta ahora"""
+        self._read_sync(symbol, [name], sync)
+        series = self.stores[name].window(symbol.upper(), None, clock_ms())
+        return series[-count:] if count else series[:0]
+
+    def version(self, symbol, names=None, sync=None):
+        """Versión de las series de un símbolo (último timestamp hasta ahora de cada una)"""
+        names = names or list(SERIES)
+        self._read_sync(symbol, names, sync)
+        now_ms = clock_ms()
+        return tuple(self.stores[name].last_timestamp(symbol.upper(), now_ms) for name in names)
+
+    def start(self, symbols, interval_seconds=300):
+        """Arranca el hilo que añade periódicamente los puntos nuevos de cada símbolo"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+
+        def run():
+            while not self._stop.is_set():
+                for symbol in symbols:
+                    try:
+                        self.sync(symbol)
+                    except Exception as e:
+                        print(f"Error sincronizando sentimiento de {symbol}: {e}")
+                self._stop.wait(interval_seconds)
+
+        self._stop.clear()
+        self._worker = threading.Thread(target=run, name='binance-sentiment-store', daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_sentiment_store():
+    """Instancia compartida del almacén de sentimiento"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = BinanceSentimentStore()
+        return _default_store
@@ -0,0 +1,49 @@
+"""
+Formato compacto y común para las respuestas de series temporales
+"""
+import numpy as np
+
+# Unidades de etiqueta admitidas: día ('2025-07-11') o minuto ('2025-07-11 08:05')
+LABEL_UNITS = ('D', 'm')
+
+
+def column_values(values):
+    """
+    Columna numérica lista para jsonify: se devuelve como array (el proveedor
+    JSON de las apps la escribe en bloque y los NaN salen como null)
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return values.astype(np.float64, copy=False)
+    return values
+
+
+def series_payload(timestamps, columns, labels=None, since=None):
+    """
+    Serie temporal como columnas paralelas: timestamps epoch en ms y un array por campo
+
+    Args:
+        timestamps: Timestamps en ms (array de enteros o datetime64)
+        columns: Dict nombre -> array de valores (misma longitud)
+        labels: None, 'D' o 'm' para añadir etiquetas de texto UTC con esa resolución
+        since: Si se indica (ms), solo los puntos posteriores (timestamps ordenados)
+
+    Returns:
+        Dict {'timestamp': array, ['label': [...]], campo: array}
+    """
+    ts = np.asarray(timestamps)
+    if ts.dtype.kind == 'M':
+        ts = ts.astype('datetime64[ms]').astype(np.int64)
+    ts = ts.astype(np.int64, copy=False)
+    start = int(np.searchsorted(ts, since, side='right')) if since is not None else 0
+    if start:
+        ts = ts[start:]
+        columns = {name: np.asarray(values)[start:] for name, values in columns.items()}
+
+    payload = {'timestamp': ts}
+    if labels in LABEL_UNITS:
+        text = np.datetime_as_string(ts.astype('datetime64[ms]'), unit=labels)
+        payload['label'] = np.char.replace(text, 'T', ' ').tolist()
+    for name, values in columns.items():
+        payload[name] = column_values(values)
+    return payload
@@ -0,0 +1,138 @@
+"""
+Almacén local de series temporales en ficheros binarios de solo-añadir
+"""
+import os
+import threading
+
+import numpy as np
+
+
+class SeriesStore:
+    """
+    Series temporales por clave, cada una en un fichero binario con registros
+    de dtype fijo (el primer campo es 'timestamp' en ms) ordenados por tiempo.
+
+    Los datos nuevos posteriores al último registro se añaden al final del
+    fichero; solo el relleno de huecos intermedios obliga a reescribirlo, y
+    upsert reescribe únicamente el tramo final que actualiza.
+    Las lecturas por ventana son vistas (searchsorted) sobre la serie en memoria.
+    """
+
+    def __init__(self, directory, dtype):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self._series = {}
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def load(self, key):
+        """Serie completa de una clave (array estructurado, vacío si no existe)"""
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                path = self._path(key)
+                series = np.fromfile(path, dtype=self.dtype) if os.path.exists(path) else np.empty(0, dtype=self.dtype)
+                self._series[key] = series
+            return series
+
+    def append(self, key, records):
+        """
+        Añade registros a una serie, descartando timestamps ya almacenados
+
+        Args:
+            key: Clave de la serie
+            records: Array estructurado con el dtype del almacén
+
+        Returns:
+            Número de registros nuevos
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        if len(records) == 0:
+            return 0
+        with self._lock:
+            current = self.load(key)
+            records = np.sort(records, order='timestamp')
+            records = records[np.concatenate(([True], np.diff(records['timestamp']) > 0))]
+            if len(current):
+                records = records[~np.isin(records['timestamp'], current['timestamp'])]
+            if len(records) == 0:
+                return 0
+
+            if len(current) == 0 or records['timestamp'][0] > current['timestamp'][-1]:
+                # Caso habitual: datos posteriores al último registro
+                with open(self._path(key), 'ab') as fh:
+                    records.tofile(fh)
+                self._series[key] = np.concatenate([current, records])
+            else:
+                # Relleno de huecos: se fusiona y se reescribe el fichero de forma atómica
+                merged = np.concatenate([current, records])
+                merged = merged[np.argsort(merged['timestamp'], kind='stable')]
+                tmp_path = self._path(key) + '.tmp'
+                merged.tofile(tmp_path)
+                os.replace(tmp_path, self._path(key))
+                self._series[key] = merged
+            return len(records)
+
+    def upsert(self, key, records):
+        """
+        Añade registros a una serie sobrescribiendo los timestamps ya almacenados
+        (p.ej. la última vela, que sigue abierta mientras no cierra su periodo)
+
+        Solo se reescribe el fichero desde el primer timestamp recibido; las
+        vistas ya entregadas no se modifican porque la serie en memoria se sustituye.
+
+        Returns:
+            Número de registros escritos (nuevos o actualizados)
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        if len(records) == 0:
+            return 0
+        with self._lock:
+            current = self.load(key)
+            records = np.sort(records, order='timestamp')
+            records = records[np.concatenate((np.diff(records['timestamp']) > 0, [True]))]
+            if len(current) == 0 or records['timestamp'][0] > current['timestamp'][-1]:
+                return self.append(key, records)
+
+            pos = int(np.searchsorted(current['timestamp'], records['timestamp'][0], side='left'))
+            tail = current[pos:]
+            tail = np.concatenate([tail[~np.isin(tail['timestamp'], records['timestamp'])], records])
+            tail = tail[np.argsort(tail['timestamp'], kind='stable')]
+            with open(self._path(key), 'r+b') as fh:
+                fh.seek(pos * self.dtype.itemsize)
+                tail.tofile(fh)
+                fh.truncate()
+            self._series[key] = np.concatenate([current[:pos], tail])
+            return len(records)
+
+    def window(self, key, start_ms=None, end_ms=None):
+        """Registros con start_ms <= timestamp <= end_ms (vista sin copia)"""
+        series = self.load(key)
+        ts = series['timestamp']
+        lo = 0 if start_ms is None else int(np.searchsorted(ts, start_ms, side='left'))
+        hi = len(ts) if end_ms is None else int(np.searchsorted(ts, end_ms, side='right'))
+        return series[lo:hi]
+
+    def first_timestamp(self, key):
+        series = self.load(key)
+        return int(series['timestamp'][0]) if len(series) else None
+
+    def last_timestamp(self, key, end_ms=None):
+        series = self.window(key, None, end_ms) if end_ms is not None else self.load(key)
+        return int(series['timestamp'][-1]) if len(series) else None
+
+    def gaps(self, key, step_ms, start_ms=None, end_ms=None):
+        """
+        Huecos de una serie con paso regular dentro de una ventana
+
+        Returns:
+            Lista de (inicio, fin) en ms de los tramos sin datos
+        """
+        ts = self.window(key, start_ms, end_ms)['timestamp']
+        if len(ts) < 2:
+            return []
+        missing = np.nonzero(np.diff(ts) > step_ms * 1.5)[0]
+        return [(int(ts[i]) + step_ms, int(ts[i + 1]) - step_ms) for i in missing]
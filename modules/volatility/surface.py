@@ -0,0 +1,192 @@
+"""
+Superficie de volatilidad implícita construida a partir de la cadena completa
+"""
+import numpy as np
+
+from modules.volatility.chain import CALL
+from modules.volatility.greeks import years_to_expiry
+
+# Rejilla en moneyness (K/F) y número de nodos temporales de la superficie
+MONEYNESS_RANGE = (0.5, 2.0)
+MONEYNESS_POINTS = 61
+TIME_POINTS = 40
+# Puntos con |ln(K/F)| mayor que este valor no se usan en el ajuste
+MAX_ABS_LOG_MONEYNESS = 1.5
+MIN_TOTAL_VARIANCE = 1e-8
+
+
+def _fit_slice(k, w, degree=2):
+    """Ajusta la varianza total de un vencimiento como polinomio en log-moneyness"""
+    degree = min(degree, len(k) - 1)
+    if degree < 0:
+        return None
+    return np.polyfit(k, w, degree)
+
+
+class IVSurface:
+    """
+    Superficie de volatilidad implícita sobre una rejilla (log-moneyness x tiempo).
+
+    Cada vencimiento se ajusta con un polinomio de grado 2 en la varianza total
+    (iv² · T) frente a ln(K/F); entre vencimientos se interpola linealmente la
+    varianza total. Las consultas se resuelven sobre la rejilla sin volver a la cadena.
+    """
+
+    def __init__(self, currency, log_moneyness, times, total_variance, spot, slices, version, timestamp):
+        self.currency = currency
+        self.log_moneyness = log_moneyness
+        self.times = times
+        self.total_variance = total_variance
+        self.spot = spot
+        self.slices = slices
+        self.version = version
+        self.timestamp = timestamp
+
+    @property
+    def empty(self):
+        return len(self.times) == 0
+
+    @classmethod
+    def build(cls, chain):
+        """
+        Construye la superficie de una cadena en una sola pasada
+
+        Args:
+            chain: OptionsChain con mark_iv y underlying_price
+
+        Returns:
+            IVSurface (vacía si no hay ningún vencimiento ajustable)
+        """
+        cols = chain.columns
+        t_expiry = years_to_expiry(chain.expiries, chain.timestamp)
+        t_row = t_expiry[cols['expiry_code']]
+        forward = cols['underlying_price'].astype(np.float64)
+        iv = cols['mark_iv'].astype(np.float64) / 100.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = np.log(cols['strike'].astype(np.float64) / forward)
+        # Solo opciones OTM: calls por encima del forward y puts por debajo
+        otm = np.where(cols['type_code'] == CALL, k >= 0, k < 0)
+        usable = otm & np.isfinite(k) & np.isfinite(iv) & (iv > 0) & (t_row > 0) & (np.abs(k) <= MAX_ABS_LOG_MONEYNESS)
+        w = iv * iv * t_row
+
+        k_grid = np.log(np.linspace(MONEYNESS_RANGE[0], MONEYNESS_RANGE[1], MONEYNESS_POINTS))
+        node_times, node_variance, slices = [], [], []
+        for pos, day in enumerate(chain.expiries):
+            start, stop = chain.expiry_bounds[pos], chain.expiry_bounds[pos + 1]
+            rows = np.nonzero(usable[start:stop])[0] + start
+            if len(rows) < 2:
+                continue
+            coeffs = _fit_slice(k[rows], w[rows])
+            if coeffs is None:
+                continue
+            fitted = np.maximum(np.polyval(coeffs, k_grid), MIN_TOTAL_VARIANCE)
+            node_times.append(t_expiry[pos])
+            node_variance.append(fitted)
+            slices.append({
+                'expiration_date': str(day),
+                'days': float(t_expiry[pos] * 365.0),
+                'atm_iv': float(np.sqrt(max(np.polyval(coeffs, 0.0), MIN_TOTAL_VARIANCE) / t_expiry[pos]) * 100.0),
+                'points': int(len(rows)),
+                'coefficients': coeffs.tolist()
+            })
+
+        spot = float(forward[np.isfinite(forward)][0]) if np.isfinite(forward).any() else 0.0
+        if not node_times:
+            return cls(chain.currency, k_grid, np.empty(0), np.empty((0, len(k_grid))), spot, [], chain.version, chain.timestamp)
+
+        node_times = np.asarray(node_times)
+        node_variance = np.vstack(node_variance)
+        # La varianza total no puede decrecer con el plazo (sin arbitraje de calendario)
+        node_variance = np.maximum.accumulate(node_variance, axis=0)
+
+        times = np.unique(np.concatenate([
+            np.linspace(node_times[0], node_times[-1], TIME_POINTS), node_times
+        ]))
+        total_variance = _interp_rows(times, node_times, node_variance)
+        return cls(chain.currency, k_grid, times, total_variance, spot, slices, chain.version, chain.timestamp)
+
+    def implied_vol(self, moneyness, t):
+        """
+        Volatilidad implícita (en %) para moneyness K/F y plazo en años, vectorizada.
+        Fuera de la rejilla temporal se mantiene constante la volatilidad del borde.
+        """
+        if self.empty:
+            return np.full(np.broadcast(np.asarray(moneyness), np.asarray(t)).shape, np.nan)
+        k = np.clip(np.log(np.asarray(moneyness, dtype=np.float64)), self.log_moneyness[0], self.log_moneyness[-1])
+        t = np.asarray(t, dtype=np.float64)
+        t_clamped = np.clip(t, self.times[0], self.times[-1])
+        k, t_clamped = np.broadcast_arrays(k, t_clamped)
+
+        i = np.clip(np.searchsorted(self.log_moneyness, k) - 1, 0, len(self.log_moneyness) - 2)
+        k0, k1 = self.log_moneyness[i], self.log_moneyness[i + 1]
+        a = (k - k0) / (k1 - k0)
+        if len(self.times) == 1:
+            w = (1 - a) * self.total_variance[0, i] + a * self.total_variance[0, i + 1]
+        else:
+            j = np.clip(np.searchsorted(self.times, t_clamped) - 1, 0, len(self.times) - 2)
+            t0, t1 = self.times[j], self.times[j + 1]
+            b = (t_clamped - t0) / (t1 - t0)
+            grid = self.total_variance
+            w = ((1 - a) * (1 - b) * grid[j, i] + a * (1 - b) * grid[j, i + 1]
+                 + (1 - a) * b * grid[j + 1, i] + a * b * grid[j + 1, i + 1])
+        return np.sqrt(w / t_clamped) * 100.0
+
+    def point(self, moneyness, days):
+        """IV de un punto concreto de la superficie"""
+        iv = float(self.implied_vol(moneyness, days / 365.0))
+        return {
+            'moneyness': moneyness,
+            'strike': moneyness * self.spot,
+            'days': days,
+            'iv': None if np.isnan(iv) else iv
+        }
+
+    def smile(self, days):
+        """Corte de la superficie a un plazo dado (IV frente a moneyness y strike)"""
+        moneyness = np.exp(self.log_moneyness)
+        iv = self.implied_vol(moneyness, days / 365.0)
+        return {
+            'days': days,
+            'moneyness': moneyness.tolist(),
+            'strikes': (moneyness * self.spot).tolist(),
+            'iv': np.where(np.isnan(iv), None, iv).tolist()
+        }
+
+    def term_structure(self, moneyness=1.0):
+        """Estructura temporal de la IV para una moneyness fija (por defecto ATM)"""
+        iv = self.implied_vol(moneyness, self.times)
+        return {
+            'moneyness': moneyness,
+            'days': (self.times * 365.0).tolist(),
+            'iv': np.where(np.isnan(iv), None, iv).tolist(),
+            'expirations': [{'expiration_date': s['expiration_date'], 'days': s['days'], 'atm_iv': s['atm_iv']}
+                            for s in self.slices]
+        }
+
+    def to_dict(self):
+        """Rejilla completa en formato JSON-serializable (IV en %)"""
+        moneyness = np.exp(self.log_moneyness)
+        if self.empty:
+            iv = np.empty((0, len(moneyness)))
+        else:
+            iv = np.sqrt(self.total_variance / self.times[:, None]) * 100.0
+        return {
+            'currency': self.currency,
+            'spot': self.spot,
+            'moneyness': moneyness.tolist(),
+            'strikes': (moneyness * self.spot).tolist(),
+            'days': (self.times * 365.0).tolist(),
+            'iv': iv.tolist(),
+            'slices': self.slices,
+            'version': self.version,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+
+def _interp_rows(x, xp, fp):
+    """Interpolación lineal de cada columna de fp (filas en xp) a los puntos x"""
+    if len(xp) == 1:
+        return np.repeat(fp, len(x), axis=0)
+    j = np.clip(np.searchsorted(xp, x) - 1, 0, len(xp) - 2)
+    b = ((x - xp[j]) / (xp[j + 1] - xp[j]))[:, None]
+    return (1 - b) * fp[j] + b * fp[j + 1]
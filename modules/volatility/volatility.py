@@ -3,209 +3,134 @@
 
 import os
 import json
-import requests
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta, timezone
-from collections import defaultdict
 from decimal import Decimal
 import traceback
 
+from modules.volatility.chain import CALL, as_float64, deribit_expiry_code
+from modules.volatility.greeks import years_to_expiry
+from modules.volatility.gex import compute_gex_profile
+from modules.volatility.surface import IVSurface
+from modules.volatility.realized import ESTIMATORS, RealizedVolatilityEngine
+from modules.volatility.vrp import VRPEngine
+from modules.volatility.dvol_store import RESOLUTIONS, default_dvol_store
+from modules.volatility.sentiment_store import SERIES, default_sentiment_store
+from modules.volatility.series import series_payload
+from modules.volatility.scenario import SCENARIO_GREEKS, default_scenario_engine
+from modules.volatility.query import DEFAULT_PAGE_SIZE, query_chain
+from modules.volatility.futures import align_with_options
+from modules.volatility.analytics import chain_metrics
+from modules.volatility.data import OPTION_CURRENCIES, default_derivatives_data, option_settlement
+from modules.orderbook.aggregate import bucket_levels, ladder_pairs
+from modules.orderbook.feeds import default_book_manager
+from modules.replay.clock import now_ms, utc_now
+from modules.replay.http import http_session
+
 # ==============================================================================
 # SECCIÓN 1: LÓGICA DE DERIBIT (OPCIONES Y DERIVADOS)
 # ==============================================================================
-def calculate_max_pain(df):
-    """Calcula el punto de máximo dolor para opciones"""
-    if df.empty or 'strike' not in df or df['strike'].nunique() == 0: 
-        return 0
-    
-    strikes = sorted(df['strike'].unique())
-    total_losses = []
-    
-    for expiry_strike in strikes:
-        loss = 0
-        
-        # Pérdidas para calls
-        calls_df = df[df['type'] == 'C'].copy()
-        calls_df['loss'] = (expiry_strike - calls_df['strike']) * calls_df['open_interest']
-        calls_df.loc[calls_df['loss'] < 0, 'loss'] = 0
-        loss += calls_df['loss'].sum()
-        
-        # Pérdidas para puts
-        puts_df = df[df['type'] == 'P'].copy()
-        puts_df['loss'] = (puts_df['strike'] - expiry_strike) * puts_df['open_interest']
-        puts_df.loc[puts_df['loss'] < 0, 'loss'] = 0
-        loss += puts_df['loss'].sum()
-        
-        total_losses.append(loss)
-    
-    min_loss_index = total_losses.index(min(total_losses))
-    return strikes[min_loss_index]
-
 def get_deribit_option_data(currency='BTC'):
-    """Obtiene datos de opciones de Deribit con manejo de errores mejorado"""
-    url = f"https://www.deribit.com/api/v2/public/get_book_summary_by_currency?currency={currency}&kind=option"
-    
-    try:
-        headers = {
-            'User-Agent': 'TradingRoad/1.0 (contact@tradingroad.app)',
-            'Accept': 'application/json'
-        }
-        response = requests.get(url, timeout=15, headers=headers)
-        response.raise_for_status()
-        result = response.json()
-        
-        if 'result' not in result:
-            print(f"Warning: No 'result' key in Deribit response for {currency}")
-            return pd.DataFrame()
-            
-        data = result['result']
-        if not data:
-            print(f"Warning: Empty data from Deribit for {currency}")
-            return pd.DataFrame()
-        
-        df = pd.DataFrame(data)
-        if df.empty:
-            print(f"Warning: Empty DataFrame after processing Deribit data for {currency}")
-            return df
-        
-        # Procesar datos griegos
-        if 'greeks' not in df.columns:
-            df['greeks'] = [{'delta': 0, 'gamma': 0, 'vega': 0, 'theta': 0} for _ in range(len(df))]
-        else:
-            df['greeks'] = df['greeks'].apply(lambda x: x if isinstance(x, dict) else {'delta': 0, 'gamma': 0, 'vega': 0, 'theta': 0})
-        
-        # Procesar fechas y strikes
-        df['expiration_date'] = pd.to_datetime(df['instrument_name'].str.split('-').str[1], format='%d%b%y').dt.normalize()
-        df['strike'] = df['instrument_name'].str.split('-').str[2]
-        df['type'] = df['instrument_name'].str.split('-').str[3]
-        
-        # Convertir columnas numéricas
-        numeric_cols = ['mark_iv', 'underlying_price', 'strike', 'open_interest', 'volume']
-        df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric, errors='coerce')
-        
-        df.dropna(subset=['strike'], inplace=True)
-        df['strike'] = df['strike'].astype(int)
-        
-        # Convertir tipos numpy a tipos Python nativos para JSON
-        for col in df.select_dtypes(include=[np.integer]).columns:
-            df[col] = df[col].astype(int)
-        for col in df.select_dtypes(include=[np.floating]).columns:
-            df[col] = df[col].astype(float)
-        
-        return df
-        
-    except Exception as e:
-        print(f"Error en get_deribit_option_data: {e}")
-        traceback.print_exc()
-        return None
+    """Obtiene datos de opciones de Deribit como DataFrame (griegas en columnas planas)"""
+    return default_derivatives_data().options_frame(currency)
 
 def get_deribit_orderbook_data(currency='BTC', level=1000):
-    """Obtiene datos del libro de órdenes de Deribit"""
+    """Obtiene datos del libro de órdenes de Deribit (libro local en memoria)"""
     try:
-        url = f"https://deribit.com/api/v2/public/get_order_book?instrument_name={currency}-PERPETUAL&depth=100"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()['result']
-        
-        # Procesar bids y asks
-        bids = [[float(bid[0]), float(bid[1])] for bid in data.get('bids', [])]
-        asks = [[float(ask[0]), float(ask[1])] for ask in data.get('asks', [])]
-        
-        # Agregar datos según el nivel especificado
-        if level > 1:
-            bids = aggregate_orderbook_level(bids, level, 'bid')
-            asks = aggregate_orderbook_level(asks, level, 'ask')
+        book = default_book_manager().book(f"{currency}-PERPETUAL")
+        # Escalera precalculada para la versión actual del libro (level <= 1: sin agregar)
+        ladder = book.aggregated(level if level > 1 else 0)
         
         return {
-            'bids': bids[:20],  # Limitar a top 20
-            'asks': asks[:20],
-            'timestamp': data.get('timestamp', datetime.now().timestamp() * 1000)
+            'bids': ladder_pairs(ladder['bids'], 20),  # Limitar a top 20
+            'asks': ladder_pairs(ladder['asks'], 20),
+            'bids_cumulative': ladder['bids']['cumulative'][:20].tolist(),
+            'asks_cumulative': ladder['asks']['cumulative'][:20].tolist(),
+            'timestamp': book.timestamp or now_ms()
         }
         
     except Exception as e:
         print(f"Error en get_deribit_orderbook_data: {e}")
-        return {'bids': [], 'asks': [], 'timestamp': datetime.now().timestamp() * 1000}
+        return {'bids': [], 'asks': [], 'timestamp': now_ms()}
+
+def expiration_records(chain):
+    """Convierte una (sub)cadena al formato de lista de vencimientos, columna a columna"""
+    cols = chain.columns
+    expiry_codes = [deribit_expiry_code(date) for date in chain.expiries]
+    data = {
+        'symbol': [chain.currency] * len(chain),
+        'instrument': cols['instrument_name'].tolist(),
+        'expiration_date': [expiry_codes[code] for code in cols['expiry_code'].tolist()],
+        'strike_price': as_float64(cols['strike']).tolist(),
+        'option_type': np.where(cols['type_code'] == CALL, 'call', 'put').tolist(),
+        'open_interest': np.nan_to_num(as_float64(cols['open_interest'])).tolist(),
+        'volume': np.nan_to_num(as_float64(cols['volume'])).tolist(),
+        'last_price': np.nan_to_num(as_float64(cols['last'])).tolist(),
+        'mark_price': np.nan_to_num(as_float64(cols['mark_price'])).tolist(),
+        'underlying_price': np.nan_to_num(as_float64(cols['underlying_price'])).tolist(),
+        'mark_iv': np.nan_to_num(as_float64(cols['mark_iv'])).tolist()
+    }
+    keys = list(data)
+    return [dict(zip(keys, row)) for row in zip(*data.values())]
+
+def chain_summary(chain, aggregates=None):
+    """Fila del resumen multi-moneda de una cadena (métricas y vencimientos)"""
+    metrics = chain_metrics(chain, nearest_expiry=True, aggregates=aggregates)
+    expiries = chain.expiration_dates()
+    upcoming = expiries[expiries >= np.datetime64(chain.timestamp.date(), 'D')]
+    return {
+        'currency': chain.currency,
+        'settlement': option_settlement(chain.currency),
+        'available': True,
+        'instruments': len(chain),
+        'expirations': len(expiries),
+        'nearest_expiry': str(upcoming[0]) if len(upcoming) else None,
+        'underlying_price': metrics['underlying_price'],
+        'call_oi': metrics['call_oi'],
+        'put_oi': metrics['put_oi'],
+        'put_call_ratio_oi': metrics['put_call_ratio_oi'],
+        'put_call_ratio_volume': metrics['put_call_ratio_volume'],
+        'max_pain': metrics['max_pain'],
+        'notional_value_usd': metrics['notional_value_usd'],
+        'volume_usd': float(np.nansum(chain['volume_usd'], dtype=np.float64)),
+        'snapshot': chain.version
+    }
 
 def aggregate_orderbook_level(orders, level, side):
     """Agrega órdenes por nivel de precio"""
     if not orders or level <= 1:
         return orders
-    
-    aggregated = defaultdict(float)
-    
-    for price, amount in orders:
-        if side == 'bid':
-            aggregated_price = int(price // level) * level
-        else:  # ask
-            aggregated_price = int(price // level + 1) * level
-        aggregated[aggregated_price] += amount
-    
-    result = [[price, amount] for price, amount in aggregated.items()]
-    result.sort(key=lambda x: x[0], reverse=(side == 'bid'))
-    
-    return result
+    return _aggregate_pairs(orders, level, side)
 
-def calculate_deribit_metrics(df):
-    """Calcula métricas de Deribit"""
-    if df is None or df.empty:
-        return {}
-    
-    try:
-        calls_df = df[df['type'] == 'C']
-        puts_df = df[df['type'] == 'P']
-        
-        call_oi = calls_df['open_interest'].sum()
-        put_oi = puts_df['open_interest'].sum()
-        total_oi = call_oi + put_oi
-        
-        call_volume = calls_df['volume'].sum()
-        put_volume = puts_df['volume'].sum()
-        
-        put_call_ratio_oi = put_oi / call_oi if call_oi > 0 else 0
-        put_call_ratio_volume = put_volume / call_volume if call_volume > 0 else 0
-        
-        max_pain = calculate_max_pain(df)
-        
-        # Calcular valor nocional
-        underlying_price = df['underlying_price'].iloc[0] if not df.empty else 0
-        notional_value_usd = total_oi * underlying_price
-        
-        # Convertir a tipos Python nativos para serialización JSON
-        return {
-            'call_oi': int(call_oi) if not np.isnan(call_oi) else 0,
-            'put_oi': int(put_oi) if not np.isnan(put_oi) else 0,
-            'total_oi': int(total_oi) if not np.isnan(total_oi) else 0,
-            'put_call_ratio_oi': float(put_call_ratio_oi) if not np.isnan(put_call_ratio_oi) else 0.0,
-            'put_call_ratio_volume': float(put_call_ratio_volume) if not np.isnan(put_call_ratio_volume) else 0.0,
-            'max_pain': int(max_pain) if not np.isnan(max_pain) else 0,
-            'notional_value_usd': float(notional_value_usd) if not np.isnan(notional_value_usd) else 0.0,
-            'underlying_price': float(underlying_price) if not np.isnan(underlying_price) else 0.0
-        }
-        
-    except Exception as e:
-        print(f"Error en calculate_deribit_metrics: {e}")
-        return {}
+def _aggregate_pairs(levels, step, side):
+    """[[precio, cantidad], ...] -> niveles agrupados por escalón (bids hacia abajo, asks hacia arriba)"""
+    levels = np.asarray(levels, dtype=np.float64).reshape(-1, 2)
+    descending = side == 'bid'
+    order = np.argsort(-levels[:, 0] if descending else levels[:, 0], kind='stable')
+    prices, amounts, _ = bucket_levels(levels[order, 0], levels[order, 1], step, round_up=not descending)
+    return np.column_stack([prices, amounts]).tolist()
 
-def get_deribit_dvol_history(currency='BTC', days=90):
-    """Obtiene historial de volatilidad de Deribit"""
-    instrument = currency.upper()
-    end_time = int(datetime.now().timestamp() * 1000)
-    start_time = int((datetime.now() - timedelta(days=days)).timestamp() * 1000)
-    
-    url = f"https://www.deribit.com/api/v2/public/get_volatility_index_data?currency={instrument}&start_timestamp={start_time}&end_timestamp={end_time}&resolution=D"
-    
+def get_deribit_dvol_history(currency='BTC', days=90, resolution='1D'):
+    """
+    Obtiene historial de volatilidad de Deribit desde el almacén local DVOL
+    (solo se descargan los puntos que faltan)
+    """
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json().get('result', {}).get('data', [])
-        
-        if not data:
+        store = default_dvol_store()
+        step_days = RESOLUTIONS[resolution][1] / 86400000.0
+        # Se cargan 6 barras extra para que la media de 7 cubra toda la ventana
+        records = store.history(currency.upper(), resolution, days + 6 * step_days)
+        if len(records) == 0:
             return None
         
-        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-        df['close'] = pd.to_numeric(df['close'])
+        df = pd.DataFrame({
+            'timestamp': pd.to_datetime(records['timestamp'], unit='ms'),
+            'open': records['open'],
+            'high': records['high'],
+            'low': records['low'],
+            'close': records['close']
+        })
         df['sma_7'] = df['close'].rolling(window=7).mean()
         df.dropna(subset=['sma_7'], inplace=True)
         
@@ -218,63 +143,42 @@ def get_deribit_dvol_history(currency='BTC', days=90):
 # ==============================================================================
 # SECCIÓN 2: LÓGICA DE BINANCE Y OTRAS
 # ==============================================================================
-def get_binance_klines(symbol='BTC', interval='1d', days=7):
-    """Obtiene datos de velas de Binance"""
-    url = f"https://fapi.binance.com/fapi/v1/klines?symbol={symbol}USDT&interval={interval}&limit={days}"
-    
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        df = pd.DataFrame(data, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_volume', 'count', 'taker_buy_volume', 'taker_buy_quote_volume', 'ignore'])
-        df[['open', 'high', 'low', 'close', 'volume']] = df[['open', 'high', 'low', 'close', 'volume']].astype(float)
-        
-        week_high_idx = df['high'].idxmax()
-        week_low_idx = df['low'].idxmin()
-        
-        return {
-            'week_high': df.loc[week_high_idx, 'high'],
-            'week_high_timestamp': df.loc[week_high_idx, 'timestamp'],
-            'week_low': df.loc[week_low_idx, 'low'],
-            'week_low_timestamp': df.loc[week_low_idx, 'timestamp']
-        }
-        
-    except Exception as e:
-        print(f"Error en get_binance_klines: {e}")
-        return None
+def open_interest_change(oi):
+    """OI actual (último punto de 5 minutos) y su cambio porcentual en 4h"""
+    current_oi = float(oi['sum_open_interest'][-1])
+    oi_change_4h = 0
+    if len(oi) >= 49:  # 48 * 5min = 4h
+        oi_4h_ago = float(oi['sum_open_interest'][-49])
+        oi_change_4h = ((current_oi - oi_4h_ago) / oi_4h_ago) * 100 if oi_4h_ago > 0 else 0
+    return current_oi, oi_change_4h
 
 def get_binance_sentiment_data(symbol='BTC', limit_oi=48, limit_ls=48):
-    """Obtiene datos de sentimiento de Binance"""
+    """Obtiene datos de sentimiento de Binance desde el almacén local (solo se descargan los puntos nuevos)"""
     try:
-        # Obtener OI actual
-        oi_url = f"https://fapi.binance.com/fapi/v1/openInterest?symbol={symbol}USDT"
-        oi_response = requests.get(oi_url, timeout=10)
-        oi_response.raise_for_status()
-        current_oi = float(oi_response.json()['openInterest'])
-        
-        # Obtener historial de OI
-        oi_hist_url = f"https://fapi.binance.com/futures/data/openInterestHist?symbol={symbol}USDT&period=5m&limit={limit_oi}"
-        oi_hist_response = requests.get(oi_hist_url, timeout=10)
-        oi_hist_response.raise_for_status()
-        oi_hist_data = oi_hist_response.json()
+        store = default_sentiment_store()
+        oi = store.last(symbol, 'open_interest', max(limit_oi, 49))
+        ls = store.last(symbol, 'long_short', limit_ls)
+        if len(oi) == 0:
+            return None
         
-        # Obtener ratio Long/Short
-        ls_url = f"https://fapi.binance.com/futures/data/globalLongShortAccountRatio?symbol={symbol}USDT&period=5m&limit={limit_ls}"
-        ls_response = requests.get(ls_url, timeout=10)
-        ls_response.raise_for_status()
-        ls_data = ls_response.json()
+        current_oi, oi_change_4h = open_interest_change(oi)
         
-        # Calcular cambio de OI en 4h
-        oi_change_4h = 0
-        if len(oi_hist_data) >= 48:  # 48 * 5min = 4h
-            oi_4h_ago = float(oi_hist_data[-48]['sumOpenInterest'])
-            oi_change_4h = ((current_oi - oi_4h_ago) / oi_4h_ago) * 100 if oi_4h_ago > 0 else 0
+        oi = oi[-limit_oi:]
+        oi_history = [
+            {'timestamp': ts, 'sumOpenInterest': value, 'sumOpenInterestValue': notional}
+            for ts, value, notional in zip(oi['timestamp'].tolist(), oi['sum_open_interest'].tolist(),
+                                           oi['sum_open_interest_value'].tolist())
+        ]
+        ls_data = [
+            {'timestamp': ts, 'longShortRatio': ratio, 'longAccount': long_, 'shortAccount': short}
+            for ts, ratio, long_, short in zip(ls['timestamp'].tolist(), ls['long_short_ratio'].tolist(),
+                                               ls['long_account'].tolist(), ls['short_account'].tolist())
+        ]
         
         return {
             'current_oi_binance': current_oi,
             'oi_change_4h_percent': oi_change_4h,
-            'oi_history': oi_hist_data,
+            'oi_history': oi_history,
             'long_short_ratio': ls_data
         }
         
@@ -282,64 +186,36 @@ def get_binance_sentiment_data(symbol='BTC', limit_oi=48, limit_ls=48):
         print(f"Error en get_binance_sentiment_data: {e}")
         return None
 
-def get_binance_funding_info(symbol='BTC'):
-    """Obtiene información de funding de Binance"""
-    try:
-        url = f"https://fapi.binance.com/fapi/v1/premiumIndex?symbol={symbol}USDT"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        return {
-            'current_funding_rate': float(data['lastFundingRate']),
-            'next_funding_time_ms': int(data['nextFundingTime']),
-            'mark_price': float(data['markPrice'])
-        }
-        
-    except Exception as e:
-        print(f"Error en get_binance_funding_info: {e}")
-        return None
-
 def get_binance_funding_rate_history(symbol='BTC', limit=100):
-    """Obtiene historial de funding rate de Binance"""
+    """Obtiene historial de funding rate de Binance desde el almacén local"""
     try:
-        url = f"https://fapi.binance.com/fapi/v1/fundingRate?symbol={symbol}USDT&limit={limit}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        funding = default_sentiment_store().last(symbol, 'funding', limit)
         
         return [{
-            'timestamp': item['fundingTime'],
-            'funding_rate': float(item['fundingRate'])
-        } for item in data]
+            'timestamp': ts,
+            'funding_rate': rate
+        } for ts, rate in zip(funding['timestamp'].tolist(), funding['funding_rate'].tolist())]
         
     except Exception as e:
         print(f"Error en get_binance_funding_rate_history: {e}")
         return None
 
 def get_deribit_order_book(currency='BTC', depth=1000, step=0):
-    """Obtiene libro de órdenes de Deribit"""
+    """Obtiene libro de órdenes de Deribit (libro local en memoria)"""
     instrument = f"{currency}-PERPETUAL"
-    url = f"https://www.deribit.com/api/v2/public/get_order_book?instrument_name={instrument}&depth={depth}"
     
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()['result']
-        
-        # Procesar bids y asks
-        bids = [[float(price), float(amount)] for price, amount in data['bids']]
-        asks = [[float(price), float(amount)] for price, amount in data['asks']]
-        
-        # Aplicar agregación si se especifica step
-        if step > 0:
-            bids = aggregate_order_book_levels(bids, step, 'bid')
-            asks = aggregate_order_book_levels(asks, step, 'ask')
+        book = default_book_manager().book(instrument)
+        # Escalera precalculada para la versión actual del libro (se agrega el libro completo)
+        ladder = book.aggregated(step)
+        levels = min(depth, 50)  # Limitar a 50 niveles
         
         return {
-            'bids': bids[:50],  # Limitar a 50 niveles
-            'asks': asks[:50],
-            'timestamp': data['timestamp']
+            'bids': ladder_pairs(ladder['bids'], levels),
+            'asks': ladder_pairs(ladder['asks'], levels),
+            'bids_cumulative': ladder['bids']['cumulative'][:levels].tolist(),
+            'asks_cumulative': ladder['asks']['cumulative'][:levels].tolist(),
+            'timestamp': book.timestamp
         }
         
     except Exception as e:
@@ -350,26 +226,7 @@ def aggregate_order_book_levels(levels, step, side):
     """Agrega niveles del libro de órdenes"""
     if not levels or step <= 0:
         return levels
-    
-    aggregated = {}
-    
-    for price, amount in levels:
-        # Redondear precio al step más cercano
-        if side == 'bid':
-            rounded_price = int(price / step) * step
-        else:  # ask
-            rounded_price = (int(price / step) + 1) * step
-        
-        if rounded_price in aggregated:
-            aggregated[rounded_price] += amount
-        else:
-            aggregated[rounded_price] = amount
-    
-    # Convertir de vuelta a lista ordenada
-    result = [[price, amount] for price, amount in aggregated.items()]
-    result.sort(key=lambda x: x[0], reverse=(side == 'bid'))
-    
-    return result
+    return _aggregate_pairs(levels, step, side)
 
 
 class VolatilityService:
@@ -377,8 +234,83 @@ class VolatilityService:
     Servicio para análisis de volatilidad y vencimientos
     """
     
-    def __init__(self):
-        pass
+    # Monedas con índice de volatilidad implícita DVOL en Deribit
+    DVOL_CURRENCIES = ('BTC', 'ETH')
+    
+    def __init__(self, market_service=None):
+        # Cadenas de opciones, curvas de futuros, funding y velas: capa de datos
+        # compartida con el backend del módulo de sentimiento (una sola caché)
+        self.data = default_derivatives_data()
+        self.chain_archive = self.data.chain_archive
+        # Velas para la volatilidad realizada
+        self.market_service = market_service
+        self.realized_engine = RealizedVolatilityEngine(market_service) if market_service else None
+        # Prima de riesgo de volatilidad (DVOL frente a la realizada)
+        self.vrp_engine = VRPEngine(market_service) if market_service else None
+    
+    def start_background_jobs(self):
+        """
+        Arranca la recolección periódica de OI, ratio long/short y funding de
+        Binance de las monedas configuradas (las rutas leen del almacén sin sincronizar)
+        """
+        default_sentiment_store().start(OPTION_CURRENCIES)
+    
+    def get_options_chain(self, currency='BTC'):
+        """
+        Devuelve la cadena de opciones cacheada de una moneda, refrescándola si ha expirado
+        
+        Args:
+            currency: Moneda (BTC, ETH, SOL, XRP...)
+            
+        Returns:
+            OptionsChain o None si Deribit no responde
+        """
+        return self.data.options_chain(currency)
+    
+    def data_version(self, kind, key='BTC', **params):
+        """
+        Versión de los datos detrás de un endpoint, sin construir la respuesta
+        (para el ETag de las rutas); None si no se conoce
+        
+        Args:
+            kind: chain, chains, futures, metrics, book, dvol o binance
+            key: Moneda, símbolo, instrumento (book) o monedas separadas por comas (chains)
+            params: resolution y days para dvol
+        """
+        key = key.upper()
+        if kind == 'chain':
+            chain = self.get_options_chain(key)
+            return chain.version if chain is not None else None
+        if kind == 'chains':
+            # key: monedas separadas por comas ('' = las configuradas)
+            chains = self.data.options_chains([c for c in key.split(',') if c] or None)
+            return tuple((currency, chain.version if chain is not None else None) for currency, chain in chains.items())
+        if kind == 'futures':
+            curve, chain = self.get_futures_curve(key), self.get_options_chain(key)
+            return (curve.version, chain.version) if chain is not None else None
+        if kind == 'metrics':
+            # Cadena más lo que get_derivatives_metrics añade de Binance: series del
+            # almacén de sentimiento, funding y máximos/mínimos semanales (cacheados)
+            chain = self.get_options_chain(key)
+            if chain is None:
+                return None
+            funding, weekly = self.data.funding_info(key), self.data.weekly_stats(key)
+            return (chain.version, default_sentiment_store().version(key, ['open_interest']),
+                    tuple(sorted(funding.items())) if funding else None,
+                    tuple(sorted(weekly.items())) if weekly else None)
+        if kind == 'book':
+            # Solo libros ya abiertos: la comprobación del ETag no arranca feeds
+            instrument = key if '-' in key else f"{key}-PERPETUAL"
+            book = default_book_manager().peek(instrument)
+            return book.version if book is not None else None
+        if kind == 'dvol':
+            # Misma ventana que get_deribit_dvol_history (con las 6 barras extra de la media)
+            resolution = params.get('resolution', '1D')
+            days = params.get('days', 90) + 6 * RESOLUTIONS[resolution][1] / 86400000.0
+            return default_dvol_store().version(key, resolution, days)
+        if kind == 'binance':
+            return default_sentiment_store().version(key)
+        return None
     
     def get_volatility_analysis(self, symbol='BTC', period='30'):
         """
@@ -386,29 +318,51 @@ class VolatilityService:
         
         Args:
             symbol: Símbolo a analizar (ej: 'BTC', 'ETH')
-            period: Período en días
+            period: Período en días (se usa la ventana configurada más cercana)
             
         Returns:
-            Dict con análisis de volatilidad
+            Dict con análisis de volatilidad (valores anualizados en tanto por uno)
         """
         try:
-            # Por ahora retornamos datos mock
-            import random
+            if self.realized_engine is None:
+                raise RuntimeError("MarketService no disponible para calcular la volatilidad realizada")
+            
+            symbol = symbol.upper()
+            windows = self.realized_engine.windows
+            window = min(windows, key=lambda w: abs(w - int(period)))
+            
+            analysis = self.realized_engine.analyze([symbol], '1d').get(symbol)
+            if not analysis:
+                raise RuntimeError(f"No hay velas suficientes para {symbol}")
+            
+            values = analysis['windows'][str(window)]
+            current = values['volatility']['yang_zhang']
+            history = self.realized_engine.state(symbol, '1d').recent(window, self.realized_engine.history_size)
+            yang_zhang_history = history[:, ESTIMATORS.index('yang_zhang')]
+            
+            # Tendencia: volatilidad actual frente a la de hace una semana
+            trend = 'stable'
+            if current is not None and len(yang_zhang_history) > 7:
+                previous = yang_zhang_history[-8]
+                if current > previous * 1.05:
+                    trend = 'increasing'
+                elif current < previous * 0.95:
+                    trend = 'decreasing'
             
-            volatility_data = {
+            return {
                 'symbol': symbol,
-                'period': period,
-                'current_volatility': round(random.uniform(0.4, 1.2), 2),
-                'avg_volatility': round(random.uniform(0.6, 1.0), 2),
-                'volatility_percentile': round(random.uniform(0.3, 0.9), 2),
-                'realized_volatility': round(random.uniform(0.5, 1.1), 2),
-                'implied_volatility': round(random.uniform(0.6, 1.3), 2),
-                'volatility_trend': random.choice(['increasing', 'decreasing', 'stable']),
+                'period': str(window),
+                'current_volatility': current,
+                'avg_volatility': float(np.mean(yang_zhang_history)) if len(yang_zhang_history) else None,
+                'volatility_percentile': values['percentile']['yang_zhang'],
+                'realized_volatility': values['volatility']['close_to_close'],
+                'implied_volatility': self.get_implied_volatility(symbol),
+                'volatility_trend': trend,
+                'estimators': values['volatility'],
+                'percentiles': values['percentile'],
                 'last_updated': datetime.now().isoformat()
             }
             
-            return volatility_data
-            
         except Exception as e:
             print(f"Error en análisis de volatilidad: {e}")
             return {
@@ -417,6 +371,51 @@ class VolatilityService:
                 'period': period
             }
     
+    def get_realized_volatility(self, symbols, timeframe='1d'):
+        """
+        Volatilidad realizada de varios símbolos (cuatro estimadores, todas las ventanas)
+        
+        Args:
+            symbols: Lista de símbolos base (BTC, ETH, SOL...)
+            timeframe: Temporalidad de las velas ('1h', '1d'...)
+        """
+        try:
+            if self.realized_engine is None:
+                return {}
+            return self.realized_engine.analyze([s.upper() for s in symbols], timeframe)
+        except Exception as e:
+            print(f"Error calculando volatilidad realizada: {e}")
+            return {}
+    
+    def get_volatility_risk_premium(self, currency='BTC', timeframe='1d', estimator='close_to_close', points=90,
+                                    labels=True, since=None):
+        """
+        Prima de riesgo de volatilidad: DVOL menos volatilidad realizada a 7, 30 y
+        90 días, con z-score y percentiles sobre el histórico (ver VRPEngine.analyze)
+        
+        Raises:
+            ValueError: Si la temporalidad o el estimador no son válidos
+        """
+        try:
+            if self.vrp_engine is None:
+                return {}
+            return self.vrp_engine.analyze(currency, timeframe, estimator, points, labels, since) or {}
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error calculando la prima de riesgo de volatilidad: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_implied_volatility(self, currency='BTC'):
+        """Último valor del índice DVOL de Deribit en tanto por uno (None si no existe)"""
+        if currency.upper() not in self.DVOL_CURRENCIES:
+            return None
+        df = get_deribit_dvol_history(currency.upper(), days=10)
+        if df is None or df.empty:
+            return None
+        return float(df['close'].iloc[-1]) / 100.0
+    
     def get_expirations(self, date=None):
         """
         Obtiene vencimientos de derivados para una fecha
@@ -431,71 +430,12 @@ class VolatilityService:
             if not date:
                 date = datetime.now().strftime('%Y-%m-%d')
             
-            # Obtener datos de Deribit usando llamadas directas a la API
-            def get_raw_deribit_data(currency):
-                url = f"https://www.deribit.com/api/v2/public/get_book_summary_by_currency?currency={currency}&kind=option"
-                try:
-                    response = requests.get(url, timeout=10)
-                    response.raise_for_status()
-                    return response.json()
-                except Exception as e:
-                    print(f"Error obtaining {currency} data: {e}")
-                    return None
-            
-            btc_data = get_raw_deribit_data('BTC')
-            eth_data = get_raw_deribit_data('ETH')
-            
+            # Cadenas de todas las monedas configuradas, descargadas en paralelo
             expirations = []
-            
-            # Procesar datos BTC
-            if btc_data and 'result' in btc_data:
-                for option in btc_data['result'][:10]:  # Limitar a 10 resultados
-                    if 'instrument_name' in option:
-                        # Extraer información del nombre del instrumento
-                        parts = option['instrument_name'].split('-')
-                        if len(parts) >= 4:
-                            exp_date = parts[1]  # e.g., "11JUL25"
-                            strike = parts[2]    # e.g., "106000"
-                            option_type = parts[3]  # e.g., "C" or "P"
-                            
-                            expirations.append({
-                                'symbol': 'BTC',
-                                'instrument': option.get('instrument_name', ''),
-                                'expiration_date': exp_date,
-                                'strike_price': float(strike) if strike.isdigit() else 0,
-                                'option_type': 'call' if option_type == 'C' else 'put',
-                                'open_interest': option.get('open_interest', 0),
-                                'volume': option.get('volume', 0),
-                                'last_price': option.get('last', 0),
-                                'mark_price': option.get('mark_price', 0),
-                                'underlying_price': option.get('underlying_price', 0),
-                                'mark_iv': option.get('mark_iv', 0)
-                            })
-            
-            # Procesar datos ETH
-            if eth_data and 'result' in eth_data:
-                for option in eth_data['result'][:10]:  # Limitar a 10 resultados
-                    if 'instrument_name' in option:
-                        # Extraer información del nombre del instrumento
-                        parts = option['instrument_name'].split('-')
-                        if len(parts) >= 4:
-                            exp_date = parts[1]  # e.g., "11JUL25"
-                            strike = parts[2]    # e.g., "106000"
-                            option_type = parts[3]  # e.g., "C" or "P"
-                            
-                            expirations.append({
-                                'symbol': 'ETH',
-                                'instrument': option.get('instrument_name', ''),
-                                'expiration_date': exp_date,
-                                'strike_price': float(strike) if strike.isdigit() else 0,
-                                'option_type': 'call' if option_type == 'C' else 'put',
-                                'open_interest': option.get('open_interest', 0),
-                                'volume': option.get('volume', 0),
-                                'last_price': option.get('last', 0),
-                                'mark_price': option.get('mark_price', 0),
-                                'underlying_price': option.get('underlying_price', 0),
-                                'mark_iv': option.get('mark_iv', 0)
-                            })
+            for chain in self.data.options_chains().values():
+                if chain is None or chain.empty:
+                    continue
+                expirations.extend(expiration_records(chain))
             
             return expirations
             
@@ -509,32 +449,28 @@ class VolatilityService:
         Obtiene datos de opciones de Deribit con fechas de vencimiento
         """
         try:
-            df = get_deribit_option_data(currency)
-            if df is None or df.empty:
+            chain = self.get_options_chain(currency)
+            if chain is None or chain.empty:
                 return {}
             
-            # Obtener fechas de vencimiento únicas
-            expiry_dates = sorted(df['expiration_date'].unique())
-            expiry_list = [date.strftime('%Y-%m-%d') for date in expiry_dates]
-            
-            # Agrupar datos por fecha de vencimiento
+            # Cada vencimiento ocupa un rango contiguo de filas
+            expiry_index = chain.expiry_index()
+            expiry_list = list(expiry_index)
             expiry_data = {}
-            for date in expiry_dates:
-                date_str = date.strftime('%Y-%m-%d')
-                date_df = df[df['expiration_date'] == date]
-                
+            for date_str, (start, stop) in expiry_index.items():
                 expiry_data[date_str] = {
-                    'strikes': sorted(date_df['strike'].unique().tolist()),
-                    'options_count': len(date_df),
-                    'total_oi': int(date_df['open_interest'].sum()),
-                    'total_volume': int(date_df['volume'].sum())
+                    'strikes': as_float64(np.unique(chain['strike'][start:stop])).tolist(),
+                    'options_count': int(stop - start),
+                    'total_oi': int(np.nansum(chain['open_interest'][start:stop], dtype=np.float64)),
+                    'total_volume': int(np.nansum(chain['volume'][start:stop], dtype=np.float64))
                 }
-            print(expiry_data)
+            
             return {
-                'currency': currency,
+                'currency': chain.currency,
                 'expiry_dates': expiry_list,
                 'expiry_data': expiry_data,
-                'raw_data': df.to_dict('records') if len(df) < 1000 else [],
+                # Cadenas grandes: paginadas con get_chain_query (/api/derivatives/chain/<currency>)
+                'raw_data': chain.to_records() if len(chain) < 1000 else [],
                 'timestamp': datetime.now().isoformat()
             }
             
@@ -542,25 +478,94 @@ class VolatilityService:
             print(f"Error obteniendo datos de opciones: {e}")
             return {}
     
+    def get_chain_query(self, currency, filters=None, fields=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """
+        Consulta paginada de la cadena cacheada (índices ordenados por snapshot)
+        
+        Args:
+            currency: Moneda de las opciones
+            filters: expiry_from, expiry_to, strike_min/max, moneyness_min/max,
+                     delta_min/max, type y min_oi (ver query.parse_query)
+            fields: Columnas a devolver
+            offset: Primera fila de la página
+            limit: Filas por página
+            
+        Raises:
+            ValueError: Si los filtros, las columnas o la paginación no son válidos
+        """
+        try:
+            chain = self.get_options_chain(currency)
+            if chain is None or chain.empty:
+                return {}
+            return query_chain(chain, filters, fields, offset, limit)
+            
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error consultando la cadena de opciones: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_options_summary(self, currencies=None):
+        """
+        Resumen de opciones de varias monedas a partir de los snapshots cacheados
+        (las que falten se descargan en paralelo)
+        
+        Args:
+            currencies: Lista de monedas (por defecto, OPTION_CURRENCIES)
+        """
+        try:
+            rows = []
+            for currency, chain in self.data.options_chains(currencies).items():
+                if chain is None or chain.empty:
+                    rows.append({'currency': currency, 'settlement': option_settlement(currency), 'available': False})
+                    continue
+                rows.append(chain.memoize(('summary',), lambda chain=chain: chain_summary(chain, self.data.chain_aggregates(chain))))
+            
+            available = [row for row in rows if row['available']]
+            total_notional = sum(row['notional_value_usd'] for row in available)
+            for row in available:
+                row['notional_share'] = row['notional_value_usd'] / total_notional if total_notional > 0 else 0.0
+            
+            return {
+                'currencies': rows,
+                'totals': {
+                    'currencies': len(available),
+                    'instruments': sum(row['instruments'] for row in available),
+                    'notional_value_usd': total_notional,
+                    'volume_usd': sum(row['volume_usd'] for row in available)
+                },
+                'timestamp': datetime.now().isoformat()
+            }
+            
+        except Exception as e:
+            print(f"Error obteniendo resumen de opciones: {e}")
+            traceback.print_exc()
+            return {}
+    
     def get_derivatives_metrics(self, currency='BTC', expiry_date=None):
         """
         Obtiene métricas de derivados para una fecha específica
         """
         try:
-            df = get_deribit_option_data(currency)
-            if df is None or df.empty:
+            chain = self.get_options_chain(currency)
+            if chain is None or chain.empty:
                 return {}
+            # OI, volumen y max pain actualizados solo en las filas que cambian entre snapshots
+            aggregates = self.data.chain_aggregates(chain)
             
-            # Filtrar por fecha de vencimiento si se especifica
+            # Filtrar por fecha de vencimiento si se especifica (vista sin copia)
             if expiry_date:
                 try:
-                    target_date = pd.to_datetime(expiry_date).normalize()
-                    df = df[df['expiration_date'] == target_date]
+                    chain = chain.for_expiry(expiry_date)
                 except:
                     pass
             
-            # Calcular métricas usando la función existente
-            metrics = calculate_deribit_metrics(df)
+            metrics = chain_metrics(chain, aggregates=aggregates)
+            metrics = {key: metrics[key] for key in (
+                'call_oi', 'put_oi', 'total_oi', 'put_call_ratio_oi', 'put_call_ratio_volume',
+                'max_pain', 'notional_value_usd', 'underlying_price'
+            )}
             
             # Agregar datos de Binance
             binance_data = get_binance_sentiment_data(currency)
@@ -571,7 +576,7 @@ class VolatilityService:
                 })
             
             # Agregar datos de funding
-            funding_data = get_binance_funding_info(currency)
+            funding_data = self.data.funding_info(currency)
             if funding_data:
                 next_funding_time = datetime.fromtimestamp(funding_data['next_funding_time_ms'] / 1000)
                 metrics.update({
@@ -581,7 +586,7 @@ class VolatilityService:
                 })
             
             # Agregar datos de precio semanal
-            weekly_data = get_binance_klines(currency, '1d', 7)
+            weekly_data = self.data.weekly_stats(currency)
             if weekly_data:
                 metrics.update({
                     'week_high': weekly_data.get('week_high', 0),
@@ -595,6 +600,196 @@ class VolatilityService:
             print(f"Error obteniendo métricas de derivados: {e}")
             return {}
     
+    def get_gex_profile(self, currency='BTC', expiry_date=None):
+        """
+        Obtiene el perfil de exposición gamma (GEX) por strike y vencimiento
+        
+        Args:
+            currency: Moneda (BTC, ETH)
+            expiry_date: Fecha 'YYYY-MM-DD' para limitar a un vencimiento (opcional)
+            
+        Returns:
+            Dict con GEX por strike, por vencimiento, total y nivel de gamma cero.
+            Se calcula una vez por snapshot de la cadena.
+        """
+        try:
+            chain = self.get_options_chain(currency)
+            if chain is None or chain.empty:
+                return {}
+            
+            if not expiry_date:
+                return chain.memoize(('gex', None), lambda: compute_gex_profile(chain))
+            
+            expiry = str(pd.Timestamp(expiry_date).date())
+            return chain.memoize(('gex', expiry), lambda: compute_gex_profile(chain.for_expiry(expiry)))
+            
+        except Exception as e:
+            print(f"Error calculando perfil GEX: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_scenario(self, currency, positions, grid=None, fields=SCENARIO_GREEKS):
+        """
+        P&L y griegas de una cartera de opciones en una rejilla de movimientos del
+        subyacente, desplazamientos de IV y días (ver ScenarioEngine.evaluate)
+        
+        Args:
+            currency: Moneda de las opciones
+            positions: Lista de {'instrument', 'quantity', ['entry_price']}
+            grid: Parámetros de la rejilla (price_range, price_steps, iv_range,
+                  iv_steps, days, time_steps)
+            fields: Griegas a incluir
+            
+        Raises:
+            ValueError: Si la cartera o la rejilla no son válidas
+        """
+        try:
+            chain = self.get_options_chain(currency)
+            if chain is None or chain.empty:
+                return {}
+            return default_scenario_engine().evaluate(chain, positions, grid, fields)
+            
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error calculando escenarios: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_iv_surface(self, currency='BTC', view='grid', moneyness=1.0, days=None, expiry_date=None):
+        """
+        Consulta la superficie de volatilidad implícita (cacheada por snapshot)
+        
+        Args:
+            currency: Moneda (BTC, ETH)
+            view: 'grid' (rejilla completa), 'point', 'slice' o 'term'
+            moneyness: K/F para 'point' y 'term'
+            days: Plazo en días para 'point' y 'slice'
+            expiry_date: Alternativa a days, fecha 'YYYY-MM-DD'
+            
+        Returns:
+            Dict con la parte de la superficie solicitada
+        """
+        try:
+            chain = self.get_options_chain(currency)
+            if chain is None or chain.empty:
+                return {}
+            
+            surface = chain.memoize(('iv_surface',), lambda: IVSurface.build(chain))
+            if view == 'grid':
+                return surface.to_dict()
+            
+            if days is None and expiry_date:
+                expiry = np.array([pd.Timestamp(expiry_date).date()], dtype='datetime64[D]')
+                days = float(years_to_expiry(expiry, chain.timestamp)[0] * 365.0)
+            
+            if view == 'term':
+                result = surface.term_structure(moneyness)
+            elif view == 'point':
+                result = surface.point(moneyness, days if days is not None else 30.0)
+            elif view == 'slice':
+                result = surface.smile(days if days is not None else 30.0)
+            else:
+                return {'error': f"Vista no soportada: {view}"}
+            
+            result.update({'currency': surface.currency, 'version': surface.version})
+            return result
+            
+        except Exception as e:
+            print(f"Error consultando superficie de volatilidad: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_archived_snapshot(self, currency='BTC', at=None, columns=None):
+        """
+        Cadena archivada tal como estaba en un momento dado
+        
+        Args:
+            currency: Moneda
+            at: Momento (str ISO o ms); por defecto, el último snapshot archivado
+            columns: Columnas de valores a devolver (por defecto, todas)
+        """
+        try:
+            if self.chain_archive is None:
+                return {}
+            frame = self.chain_archive.snapshot(currency.upper(), at, columns)
+            if frame is None:
+                return {}
+            data = {
+                'instrument_name': frame['instrument_name'].tolist(),
+                'expiration_date': frame['expiration_date'].astype(str).tolist(),
+                'strike': as_float64(frame['strike']).tolist(),
+                'type': frame['type'].astype(str).tolist(),
+            }
+            for field in frame.columns.difference(['snapshot', *data], sort=False):
+                values = as_float64(frame[field])
+                data[field] = np.where(np.isnan(values), None, values).tolist()
+            keys = list(data)
+            return {
+                'currency': currency.upper(),
+                'snapshot': int(frame['snapshot'].max()),
+                'data': [dict(zip(keys, row)) for row in zip(*data.values())]
+            }
+            
+        except Exception as e:
+            print(f"Error leyendo snapshot archivado: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_instrument_history(self, instrument_name, start=None, end=None, columns=None):
+        """
+        Serie temporal archivada de un instrumento (un punto por cada cambio)
+        """
+        try:
+            if self.chain_archive is None:
+                return {}
+            frame = self.chain_archive.instrument_series(instrument_name, start, end, columns)
+            if frame is None:
+                return {}
+            fields = frame.columns.difference(['snapshot', 'removed', 'timestamp'], sort=False)
+            series = series_payload(frame['snapshot'].to_numpy(), {
+                'removed': frame['removed'].to_numpy(),
+                **{field: as_float64(frame[field]) for field in fields}
+            })
+            return {'instrument_name': instrument_name, 'series': series}
+            
+        except Exception as e:
+            print(f"Error leyendo la serie archivada de {instrument_name}: {e}")
+            traceback.print_exc()
+            return {}
+    
+    def get_futures_curve(self, currency='BTC'):
+        """Curva de futuros cacheada de una moneda (Deribit y Binance COIN-M)"""
+        return self.data.futures_curve(currency)
+    
+    def get_futures_term_structure(self, currency='BTC'):
+        """
+        Estructura temporal de futuros con basis anualizado frente a spot y al
+        perpetuo, alineada con los vencimientos de opciones y la IV ATM
+        
+        Args:
+            currency: Moneda (BTC, ETH)
+            
+        Returns:
+            Dict con los contratos de la curva y las columnas alineadas ('options')
+        """
+        try:
+            curve = self.get_futures_curve(currency)
+            result = curve.to_dict()
+            
+            chain = self.get_options_chain(currency)
+            if chain is not None and not chain.empty:
+                surface = chain.memoize(('iv_surface',), lambda: IVSurface.build(chain))
+                result['options'] = chain.memoize(
+                    ('basis', curve.version), lambda: align_with_options(curve, chain, surface)
+                )
+            return result
+            
+        except Exception as e:
+            print(f"Error obteniendo estructura temporal de futuros: {e}")
+            traceback.print_exc()
+            return {}
+    
     def get_orderbook_data(self, currency='BTC', level=1):
         """
         Obtiene datos del libro de órdenes
@@ -603,30 +798,56 @@ class VolatilityService:
             return get_deribit_orderbook_data(currency, level)
         except Exception as e:
             print(f"Error obteniendo libro de órdenes: {e}")
-            return {'bids': [], 'asks': [], 'timestamp': datetime.now().timestamp() * 1000}
+            return {'bids': [], 'asks': [], 'timestamp': now_ms()}
+
     
-    def get_volatility_history(self, currency='BTC', days=90):
+    def get_book_query(self, instrument, levels=20, price=None, side='bids'):
         """
-        Obtiene historial de volatilidad
+        Consulta al libro local de un instrumento: mejores niveles, cantidad en
+        un precio y profundidad acumulada hasta ese precio
         """
         try:
-            df = get_deribit_dvol_history(currency, days)
+            manager = default_book_manager()
+            book = manager.book(instrument)
+            result = book.top(levels)
+            result.update({'instrument': instrument, 'mid': book.mid(), 'version': book.version})
+            if price is not None:
+                result.update({
+                    'price': price,
+                    'side': side,
+                    'depth_at_price': book.depth_at(price, side),
+                    'cumulative_depth': book.cumulative_depth(side, price)
+                })
+            result['feed'] = manager.status().get(instrument)
+            return result
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"Error consultando el libro de {instrument}: {e}")
+            return {}
+    
+    def get_volatility_history(self, currency='BTC', days=90, resolution='1D', labels=True, since=None):
+        """
+        Obtiene historial de volatilidad (DVOL) a resolución 1m, 1h o 1D en formato
+        de series (ver series_payload); labels añade las fechas como texto y since
+        (ms) deja solo los puntos nuevos
+        """
+        try:
+            df = get_deribit_dvol_history(currency, days, resolution)
             if df is None or df.empty:
                 return {}
             
-            # Convertir DataFrame a formato JSON-serializable
-            history_data = []
-            for _, row in df.iterrows():
-                history_data.append({
-                    'timestamp': int(row['timestamp'].timestamp() * 1000),
-                    'date': row['timestamp'].strftime('%Y-%m-%d'),
-                    'volatility': float(row['close']),
-                    'sma_7': float(row['sma_7']) if not pd.isna(row['sma_7']) else None
-                })
+            history_data = series_payload(
+                df['timestamp'].to_numpy(dtype='datetime64[ms]'),
+                {'volatility': df['close'].to_numpy(), 'sma_7': df['sma_7'].to_numpy()},
+                labels=labels and ('D' if resolution == '1D' else 'm'),
+                since=since
+            )
             
             return {
                 'currency': currency,
                 'days': days,
+                'resolution': resolution,
                 'data': history_data,
                 'timestamp': datetime.now().isoformat()
             }
@@ -635,54 +856,38 @@ class VolatilityService:
             print(f"Error obteniendo historial de volatilidad: {e}")
             return {}
     
-    def get_binance_metrics(self, symbol='BTC'):
+    def get_binance_metrics(self, symbol='BTC', points=50, funding_points=100, labels=True, since=None):
         """
-        Obtiene métricas de Binance (OI, Long/Short ratio, etc.)
+        Obtiene métricas de Binance (OI, Long/Short ratio, etc.) con los históricos
+        en formato de series (ver series_payload); since (ms) deja solo los puntos nuevos
         """
         try:
-            # Obtener datos de sentimiento
-            sentiment_data = get_binance_sentiment_data(symbol)
-            funding_history = get_binance_funding_rate_history(symbol, 100)
-            
+            store = default_sentiment_store()
+            label_unit = 'm' if labels else None
             result = {}
             
-            if sentiment_data:
-                # Procesar historial de OI para gráfico
-                oi_history = []
-                for item in sentiment_data.get('oi_history', []):
-                    oi_history.append({
-                        'timestamp': int(item['timestamp']),
-                        'date': datetime.fromtimestamp(int(item['timestamp'])/1000).strftime('%Y-%m-%d %H:%M'),
-                        'open_interest': float(item['sumOpenInterest'])
-                    })
-                
-                # Procesar ratio Long/Short
-                ls_history = []
-                for item in sentiment_data.get('long_short_ratio', []):
-                    ls_history.append({
-                        'timestamp': int(item['timestamp']),
-                        'date': datetime.fromtimestamp(int(item['timestamp'])/1000).strftime('%Y-%m-%d %H:%M'),
-                        'long_short_ratio': float(item['longShortRatio'])
-                    })
-                
+            oi = store.last(symbol, 'open_interest', max(points, 49))
+            if len(oi):
+                current_oi, oi_change_4h = open_interest_change(oi)
+                oi = oi[-points:]
+                ls = store.last(symbol, 'long_short', points)
                 result.update({
-                    'current_oi': sentiment_data.get('current_oi_binance', 0),
-                    'oi_change_4h': sentiment_data.get('oi_change_4h_percent', 0),
-                    'oi_history': oi_history[-50:],  # Últimos 50 puntos
-                    'long_short_history': ls_history[-50:]  # Últimos 50 puntos
+                    'current_oi': current_oi,
+                    'oi_change_4h': oi_change_4h,
+                    'oi_history': series_payload(
+                        oi['timestamp'], {'open_interest': oi['sum_open_interest']}, label_unit, since
+                    ),
+                    'long_short_history': series_payload(
+                        ls['timestamp'], {'long_short_ratio': ls['long_short_ratio']}, label_unit, since
+                    )
                 })
             
-            if funding_history:
-                # Procesar historial de funding rate
-                funding_chart = []
-                for item in funding_history:
-                    funding_chart.append({
-                        'timestamp': int(item['timestamp']),
-                        'date': datetime.fromtimestamp(int(item['timestamp'])/1000).strftime('%Y-%m-%d %H:%M'),
-                        'funding_rate': float(item['funding_rate']) * 100  # Convert to percentage
-                    })
-                
-                result['funding_history'] = funding_chart
+            funding = store.last(symbol, 'funding', funding_points)
+            if len(funding):
+                # Funding en porcentaje
+                result['funding_history'] = series_payload(
+                    funding['timestamp'], {'funding_rate': funding['funding_rate'] * 100}, label_unit, since
+                )
             
             result['timestamp'] = datetime.now().isoformat()
             return result
@@ -691,6 +896,37 @@ class VolatilityService:
             print(f"Error obteniendo métricas de Binance: {e}")
             return {}
     
+    def get_binance_series(self, symbol='BTC', series='open_interest', days=7, since=None):
+        """
+        Ventana de una serie de sentimiento de Binance servida desde el almacén local
+        
+        Args:
+            symbol: Símbolo base (BTC, ETH...)
+            series: open_interest, long_short o funding
+            days: Días hacia atrás (puede superar el límite de la API de Binance
+                  si el histórico local ya los cubre)
+            since: Si se indica (ms), solo los puntos posteriores
+        """
+        try:
+            if series not in SERIES:
+                print(f"Serie de Binance no soportada: {series}")
+                return {}
+            start_ms = now_ms() - int(days * 86400 * 1000)
+            if since is not None:
+                start_ms = max(start_ms, since + 1)
+            records = default_sentiment_store().window(symbol.upper(), series, start_ms)
+            data = series_payload(records['timestamp'], {field: records[field] for field in records.dtype.names[1:]})
+            return {
+                'symbol': symbol.upper(),
+                'series': series,
+                'days': days,
+                'data': data
+            }
+            
+        except Exception as e:
+            print(f"Error obteniendo serie {series} de Binance: {e}")
+            return {}
+    
     def get_expiration_dates(self, currency='BTC'):
         """
         Obtiene las fechas de vencimiento disponibles para una moneda específica
@@ -704,38 +940,18 @@ class VolatilityService:
         try:
             currency = currency.upper()
             
-            # Obtener datos de Deribit
-            def get_raw_deribit_data(curr):
-                url = f"https://www.deribit.com/api/v2/public/get_book_summary_by_currency?currency={curr}&kind=option"
-                try:
-                    response = requests.get(url, timeout=10)
-                    response.raise_for_status()
-                    return response.json()
-                except Exception as e:
-                    print(f"Error obtaining {curr} data: {e}")
-                    return None
-            
-            data = get_raw_deribit_data(currency)
-            
-            if not data or 'result' not in data:
+            chain = self.get_options_chain(currency)
+            if chain is None:
                 return {"success": False, "data": []}
             
-            # Extraer fechas de vencimiento únicas
-            expiration_dates = set()
-            
-            for option in data['result']:
-                if 'instrument_name' in option:
-                    parts = option['instrument_name'].split('-')
-                    if len(parts) >= 2:
-                        exp_date = parts[1]  # e.g., "11JUL25"
-                        expiration_dates.add(exp_date)
-            
-            # Convertir a lista y ordenar
-            sorted_dates = sorted(list(expiration_dates))
+            # El índice de vencimientos ya está en orden cronológico
+            expiry_index = chain.expiry_index()
+            sorted_dates = [deribit_expiry_code(date) for date in expiry_index]
             
             return {
                 "success": True,
                 "data": sorted_dates,
+                "dates": list(expiry_index),
                 "currency": currency,
                 "count": len(sorted_dates)
             }
@@ -0,0 +1,357 @@
+"""
+Prima de riesgo de volatilidad (VRP): DVOL menos volatilidad realizada a
+varios horizontes, con z-scores y percentiles sobre el histórico guardado.
+El histórico se calcula en bloque una vez; después cada vela cerrada nueva
+se incorpora con sumas móviles y búsqueda binaria, sin recorrer la serie.
+"""
+import math
+import threading
+from bisect import bisect_left, insort
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from modules.replay.clock import now_ms
+from modules.volatility.dvol_store import default_dvol_store
+from modules.volatility.realized import (
+    ESTIMATORS, TIMEFRAME_SECONDS, RollingVolatilityState, closed_candles, periods_per_year, rolling_volatility
+)
+from modules.volatility.series import series_payload
+
+# Horizontes de la volatilidad realizada (días)
+VRP_HORIZONS = (7, 30, 90)
+# Temporalidad de las velas -> (resolución DVOL, puntos de historial para z-scores y percentiles)
+VRP_TIMEFRAMES = {'1d': ('1D', 365), '1h': ('1h', 24 * 60)}
+# Cuantiles de la distribución histórica de la VRP que se devuelven
+VRP_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Velas por petición al exchange y máximo de páginas por descarga
+CANDLES_PER_REQUEST = 1000
+MAX_CANDLE_PAGES = 10
+
+
+class RollingStats:
+    """
+    Media, desviación típica y percentiles de los últimos `size` valores.
+    Cada punto nuevo se incorpora con sumas móviles y una inserción binaria en
+    la ventana ordenada.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.window = deque()
+        self.sorted = []
+        self.total = 0.0
+        self.total_sq = 0.0
+        self._pushes = 0
+
+    def __len__(self):
+        return len(self.window)
+
+    def push(self, value):
+        """Añade un valor (los no finitos se ignoran)"""
+        value = float(value)
+        if not math.isfinite(value):
+            return
+        if len(self.window) == self.size:
+            old = self.window.popleft()
+            del self.sorted[bisect_left(self.sorted, old)]
+            self.total -= old
+            self.total_sq -= old * old
+        self.window.append(value)
+        insort(self.sorted, value)
+        self.total += value
+        self.total_sq += value * value
+        # Las sumas móviles se recalculan de vez en cuando para no acumular error
+        self._pushes += 1
+        if self._pushes % self.size == 0:
+            self.total = math.fsum(self.window)
+            self.total_sq = math.fsum(v * v for v in self.window)
+
+    def mean(self):
+        return self.total / len(self.window) if self.window else None
+
+    def std(self):
+        n = len(self.window)
+        if n < 2:
+            return None
+        return math.sqrt(max(self.total_sq - self.total * self.total / n, 0.0) / (n - 1))
+
+    def zscore(self, value):
+        std = self.std()
+        return (value - self.mean()) / std if std else None
+
+    def percentile(self, value):
+        """Fracción (0-1) del historial por debajo de value"""
+        return bisect_left(self.sorted, value) / len(self.sorted) if self.sorted else None
+
+    def quantiles(self, levels):
+        """Cuantiles del historial (interpolación lineal), como {'p5': ..., 'p50': ...}"""
+        if not self.sorted:
+            return {}
+        values = self.sorted
+        result = {}
+        for level in levels:
+            pos = level * (len(values) - 1)
+            lo = int(pos)
+            hi = min(lo + 1, len(values) - 1)
+            result[f"p{round(level * 100):g}"] = values[lo] + (values[hi] - values[lo]) * (pos - lo)
+        return result
+
+
+def align_dvol(dvol, timestamps, step_ms):
+    """
+    Cierre de la barra DVOL que abre en el mismo instante que cada vela (o la
+    última anterior dentro del mismo periodo); NaN si no hay barra
+
+    Args:
+        dvol: Array estructurado del DVOLStore (ordenado por timestamp)
+        timestamps: Apertura de las velas en ms
+        step_ms: Duración de la vela en ms
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(dvol) == 0:
+        return np.full(len(timestamps), np.nan)
+    pos = np.searchsorted(dvol['timestamp'], timestamps, side='right') - 1
+    found = pos >= 0
+    pos = np.maximum(pos, 0)
+    values = dvol['close'][pos].astype(np.float64)
+    values[~found | (timestamps - dvol['timestamp'][pos] >= step_ms)] = np.nan
+    return values
+
+
+def fetch_candles(market_service, symbol, timeframe, since, source='binance'):
+    """Velas cerradas desde since (ms) hasta ahora, paginando hacia delante"""
+    period_ms = TIMEFRAME_SECONDS[timeframe] * 1000
+    chunks = []
+    for _ in range(MAX_CANDLE_PAGES):
+        candles = market_service.get_ohlcv_arrays(symbol, timeframe, CANDLES_PER_REQUEST, source, since=since)
+        if candles is None or len(candles['timestamp']) == 0:
+            break
+        chunks.append(candles)
+        since = int(candles['timestamp'][-1]) + 1
+        if len(candles['timestamp']) < CANDLES_PER_REQUEST or since + period_ms > now_ms():
+            break
+    if not chunks:
+        return None
+    merged = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    # Las páginas pueden solaparse en la vela de frontera
+    _, first = np.unique(merged['timestamp'], return_index=True)
+    return closed_candles({name: values[first] for name, values in merged.items()}, timeframe)
+
+
+class VRPState:
+    """
+    Estado incremental de una moneda y temporalidad: sumas móviles de la
+    volatilidad realizada (RollingVolatilityState), últimos puntos de la
+    serie y estadísticas móviles de la VRP por horizonte y estimador
+    """
+
+    def __init__(self, timeframe, horizons, lookback):
+        self.timeframe = timeframe
+        self.period_ms = TIMEFRAME_SECONDS[timeframe] * 1000
+        self.horizons = tuple(horizons)
+        bars_per_day = 86400 // TIMEFRAME_SECONDS[timeframe]
+        self.windows = tuple(h * bars_per_day for h in self.horizons)
+        self.realized = RollingVolatilityState(self.windows, periods_per_year(timeframe), history_size=1)
+        self.stats = {(h, name): RollingStats(lookback) for h in self.horizons for name in ESTIMATORS}
+        # (timestamp, dvol, volatilidad realizada en % [estimadores, horizontes])
+        self.points = deque(maxlen=lookback)
+        self.last_timestamp = None
+
+    def _push(self, timestamp, dvol, realized):
+        self.points.append((int(timestamp), float(dvol), realized))
+        for j, h in enumerate(self.horizons):
+            for i, name in enumerate(ESTIMATORS):
+                self.stats[(h, name)].push(dvol - realized[i, j])
+
+    def seed(self, candles, dvol):
+        """
+        Histórico inicial calculado en bloque (sumas acumuladas vectorizadas)
+
+        Args:
+            candles: Velas cerradas (más de max(windows) + 1)
+            dvol: Serie DVOL que cubre las velas
+        """
+        ppy = periods_per_year(self.timeframe)
+        rolling = {
+            w: rolling_volatility(candles['open'][None], candles['high'][None], candles['low'][None],
+                                  candles['close'][None], w, ppy)
+            for w in self.windows
+        }
+        self.realized.seed(candles, {w: {name: rolling[w][name][0] for name in ESTIMATORS} for w in self.windows})
+
+        # Volatilidad realizada de cada vela desde la primera con todas las ventanas completas
+        start = self.windows[-1]
+        realized = np.stack([
+            np.stack([rolling[w][name][0][start - w:] for w in self.windows], axis=-1)
+            for name in ESTIMATORS
+        ], axis=1) * 100.0
+        timestamps = candles['timestamp'][start:]
+        aligned = align_dvol(dvol, timestamps, self.period_ms)
+        for timestamp, value, row in zip(timestamps.tolist(), aligned.tolist(), realized):
+            if math.isfinite(value):
+                self._push(timestamp, value, row)
+        self.last_timestamp = int(candles['timestamp'][-1])
+
+    def update(self, timestamp, open_, high, low, close, dvol):
+        """Incorpora una vela cerrada nueva con el DVOL de su mismo periodo"""
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            return
+        self.realized.update(timestamp, open_, high, low, close)
+        current = {w: self.realized.current(w) for w in self.windows}
+        realized = np.array([
+            [np.nan if current[w][name] is None else current[w][name] for w in self.windows]
+            for name in ESTIMATORS
+        ]) * 100.0
+        self.last_timestamp = int(timestamp)
+        if math.isfinite(dvol):
+            self._push(timestamp, dvol, realized)
+
+    def summary(self, estimator, points, labels=True, since=None):
+        """VRP actual por horizonte con su z-score y percentiles, y la serie reciente"""
+        if not self.points:
+            return None
+        timestamp, dvol, realized = self.points[-1]
+        e = ESTIMATORS.index(estimator)
+        horizons = {}
+        for j, h in enumerate(self.horizons):
+            stats = self.stats[(h, estimator)]
+            rv = float(realized[e, j])
+            vrp = dvol - rv
+            horizons[str(h)] = {
+                'realized': rv,
+                'vrp': vrp,
+                'iv_rv_ratio': dvol / rv if rv > 0 else None,
+                'zscore': stats.zscore(vrp),
+                'percentile': stats.percentile(vrp),
+                'mean': stats.mean(),
+                'std': stats.std(),
+                'quantiles': stats.quantiles(VRP_QUANTILES)
+            }
+
+        recent = list(islice(self.points, max(len(self.points) - points, 0), None))
+        dvol_values = np.array([point[1] for point in recent])
+        rv_values = np.array([point[2][e] for point in recent]).reshape(len(recent), len(self.horizons))
+        columns = {'dvol': dvol_values}
+        for j, h in enumerate(self.horizons):
+            columns[f"realized_{h}"] = rv_values[:, j]
+            columns[f"vrp_{h}"] = dvol_values - rv_values[:, j]
+        series = series_payload(
+            np.array([point[0] for point in recent], dtype=np.int64), columns,
+            labels=labels and ('D' if self.timeframe == '1d' else 'm'), since=since
+        )
+        return {
+            'timeframe': self.timeframe,
+            'estimator': estimator,
+            'last_timestamp': timestamp,
+            'dvol': dvol,
+            'history_points': len(self.stats[(self.horizons[0], estimator)]),
+            'horizons': horizons,
+            'series': series
+        }
+
+
+class VRPEngine:
+    """
+    VRP de varias monedas a partir del DVOLStore y de las velas de MarketService.
+    La primera consulta de una moneda calcula el histórico; las siguientes solo
+    piden las velas y los puntos DVOL nuevos.
+    """
+
+    def __init__(self, market_service, source='binance', horizons=VRP_HORIZONS, dvol_store=None):
+        self.market_service = market_service
+        self.source = source
+        self.horizons = tuple(sorted(horizons))
+        self.dvol_store = dvol_store
+        self._states = {}
+        # Un lock por (moneda, temporalidad): la descarga de una serie no bloquea las demás
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _market_symbol(currency):
+        return f"{currency}/USDT"
+
+    def _dvol(self, currency, timeframe, since_ms):
+        store = self.dvol_store or default_dvol_store()
+        days = (now_ms() - since_ms) / 86400000.0 + 1
+        return store.history(currency, VRP_TIMEFRAMES[timeframe][0], days)
+
+    def _seed(self, currency, timeframe):
+        lookback = VRP_TIMEFRAMES[timeframe][1]
+        state = VRPState(timeframe, self.horizons, lookback)
+        count = lookback + state.windows[-1] + 1
+        since = now_ms() - (count + 1) * state.period_ms
+        candles = fetch_candles(self.market_service, self._market_symbol(currency), timeframe, since, self.source)
+        dvol = self._dvol(currency, timeframe, since)
+        if candles is None or dvol is None or len(dvol) == 0:
+            return None
+        # Las velas posteriores al último DVOL se incorporan cuando llegue su punto
+        candles = {name: values[candles['timestamp'] <= dvol['timestamp'][-1]] for name, values in candles.items()}
+        if len(candles['close']) <= state.windows[-1] + 1:
+            return None
+        state.seed(candles, dvol)
+        return state
+
+    def _refresh(self, currency, timeframe, state):
+        # Solo hay vela cerrada nueva si ha pasado un periodo completo desde la última
+        if now_ms() < state.last_timestamp + 2 * state.period_ms:
+            return
+        candles = fetch_candles(self.market_service, self._market_symbol(currency), timeframe,
+                                state.last_timestamp + 1, self.source)
+        if candles is None:
+            return
+        dvol = self._dvol(currency, timeframe, state.last_timestamp)
+        if dvol is None or len(dvol) == 0:
+            return
+        keep = candles['timestamp'] <= dvol['timestamp'][-1]
+        aligned = align_dvol(dvol, candles['timestamp'][keep], state.period_ms)
+        for ts, o, h, l, c, value in zip(candles['timestamp'][keep].tolist(), candles['open'][keep].tolist(),
+                                         candles['high'][keep].tolist(), candles['low'][keep].tolist(),
+                                         candles['close'][keep].tolist(), aligned.tolist()):
+            state.update(ts, o, h, l, c, value)
+
+    def analyze(self, currency, timeframe='1d', estimator='close_to_close', points=90, labels=True, since=None):
+        """
+        VRP (DVOL - volatilidad realizada, en puntos de volatilidad) de una moneda
+
+        Args:
+            currency: Moneda con índice DVOL (BTC, ETH)
+            timeframe: '1d' o '1h'
+            estimator: Estimador de la volatilidad realizada (ver ESTIMATORS)
+            points: Puntos de la serie reciente a devolver
+            labels: Añadir fechas como texto a la serie
+            since: Si se indica (ms), solo los puntos de la serie posteriores
+
+        Returns:
+            Dict con la VRP por horizonte (valor, z-score, percentil, cuantiles)
+            y la serie reciente, o None si no hay datos suficientes
+
+        Raises:
+            ValueError: Si la temporalidad o el estimador no son válidos
+        """
+        if timeframe not in VRP_TIMEFRAMES:
+            raise ValueError(f"Temporalidad no soportada: {timeframe} ({', '.join(VRP_TIMEFRAMES)})")
+        if estimator not in ESTIMATORS:
+            raise ValueError(f"Estimador no soportado: {estimator} ({', '.join(ESTIMATORS)})")
+        currency = currency.upper()
+
+        with self._lock((currency, timeframe)):
+            state = self._states.get((currency, timeframe))
+            if state is None:
+                state = self._seed(currency, timeframe)
+                if state is None:
+                    return None
+                self._states[(currency, timeframe)] = state
+            else:
+                self._refresh(currency, timeframe, state)
+
+            summary = state.summary(estimator, max(int(points), 1), labels, since)
+            if summary is not None:
+                summary['currency'] = currency
+            return summary
@@ -0,0 +1,89 @@
+"""
+Cadena de opciones: caché de nombres decodificados y agregados incrementales
+"""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from modules.volatility import chain as chain_module
+from modules.volatility.aggregates import ChainAggregates
+from modules.volatility.chain import CALL, PUT, OptionsChain, parse_instrument_names
+
+NAMES = [
+    f"BTC-{expiry}-{strike}-{kind}"
+    for expiry in ('27DEC30', '28MAR31')
+    for strike in (90000, 100000, 110000)
+    for kind in ('C', 'P')
+]
+
+
+@pytest.fixture
+def small_parse_cache(monkeypatch):
+    monkeypatch.setattr(chain_module, 'PARSE_CACHE_MAX', 3)
+    monkeypatch.setattr(chain_module, '_parsed_names', None)
+
+
+def test_parse_cache_overflow_keeps_known_names(small_parse_cache):
+    parse_instrument_names(['BTC-1AUG25-100000-C', 'ETH-1AUG25-4000-P'])
+    parsed = parse_instrument_names(['BTC-1AUG25-100000-C', 'ETH-1AUG25-4000-P', 'SOL-1AUG25-200-C',
+                                     'XRP_USDC-1AUG25-2d5-P'])
+    assert parsed['currency'].tolist() == ['BTC', 'ETH', 'SOL', 'XRP']
+    assert parsed['strike'].tolist() == [100000.0, 4000.0, 200.0, 2.5]
+    assert parsed['type_code'].tolist() == [CALL, PUT, CALL, PUT]
+    assert parsed['settlement'].tolist()[3] == 'USDC'
+
+
+def test_parse_cache_overflow_with_duplicates_and_invalid_names(small_parse_cache):
+    parse_instrument_names(['BTC-1AUG25-100000-C', 'ETH-1AUG25-4000-P', 'SOL-1AUG25-200-C'])
+    parsed = parse_instrument_names(['BTC-1AUG25-100000-C', 'no-valido', 'ETH-2AUG25-1-C', 'BTC-1AUG25-100000-C'])
+    assert parsed['currency'].tolist()[0] == 'BTC' and parsed['currency'].tolist()[3] == 'BTC'
+    assert parsed['strike'].tolist()[2] == 1.0
+    assert np.isnan(parsed['strike'].tolist()[1])
+
+
+def snapshot(timestamp, open_interest, volume):
+    records = [
+        {'instrument_name': name, 'mark_iv': 50.0, 'mark_price': 0.05, 'underlying_price': 100000.0,
+         'open_interest': oi, 'volume': vol, 'volume_usd': vol * 100.0, 'bid_price': 0.04, 'ask_price': 0.06,
+         'last': 0.05, 'interest_rate': 0.0}
+        for name, oi, vol in zip(NAMES, open_interest, volume)
+    ]
+    return OptionsChain.from_deribit(records, 'BTC', timestamp)
+
+
+def assert_same_aggregates(left, right):
+    np.testing.assert_allclose(left.oi_grid, right.oi_grid)
+    np.testing.assert_allclose(left.volume_grid, right.volume_grid)
+    np.testing.assert_allclose(left.pain, right.pain)
+    assert np.array_equal(left.listed, right.listed)
+
+
+def test_advance_matches_build():
+    start = datetime(2026, 10, 19, tzinfo=timezone.utc)
+    open_interest = np.arange(1.0, len(NAMES) + 1.0)
+    volume = np.full(len(NAMES), 2.0)
+    first = snapshot(start, open_interest, volume)
+
+    open_interest[3], volume[7] = 40.5, 9.0
+    second = snapshot(start + timedelta(minutes=1), open_interest, volume)
+
+    advanced = ChainAggregates.build(first).advance(second)
+    assert advanced is not None
+    assert advanced.changed_rows == 2
+    assert advanced.version == second.version
+    rebuilt = ChainAggregates.build(second)
+    assert_same_aggregates(advanced, rebuilt)
+    assert advanced.totals(second) == rebuilt.totals(second)
+
+
+def test_advance_rebuilds_when_instruments_change():
+    start = datetime(2026, 10, 19, tzinfo=timezone.utc)
+    first = snapshot(start, np.ones(len(NAMES)), np.ones(len(NAMES)))
+    fewer = OptionsChain.from_deribit(
+        [{'instrument_name': name, 'open_interest': 1.0, 'volume': 1.0} for name in NAMES[:-1]],
+        'BTC', start + timedelta(minutes=1)
+    )
+    aggregates = ChainAggregates.build(first)
+    assert aggregates.advance(fewer) is None
+    assert_same_aggregates(ChainAggregates.from_snapshot(fewer, aggregates), ChainAggregates.build(fewer))
@@ -0,0 +1,97 @@
+"""
+Libro local (BookSide, OrderBook) y agregación por escalones
+"""
+import numpy as np
+import pytest
+
+from modules.orderbook.aggregate import bucket_levels
+from modules.orderbook.book import BookSide, OrderBook, SequenceGap
+
+
+def make_side(prices, amounts):
+    side = BookSide(descending=False)
+    side.replace(prices, amounts)
+    return side
+
+
+def test_apply_last_change_per_price_wins():
+    side = make_side([100.0, 101.0], [1.0, 2.0])
+    side.apply([101.0, 101.0, 102.0, 102.0], [5.0, 6.0, 0.0, 3.0])
+    assert side.prices.tolist() == [100.0, 101.0, 102.0]
+    assert side.amounts.tolist() == [1.0, 6.0, 3.0]
+
+
+def test_apply_deletes_levels_with_zero_amount():
+    side = make_side([100.0, 101.0, 102.0], [1.0, 2.0, 3.0])
+    side.apply([101.0, 102.0], [0.0, 0.0])
+    assert side.prices.tolist() == [100.0]
+    assert side.amounts.tolist() == [1.0]
+
+
+def test_apply_ignores_deletes_of_unknown_levels():
+    side = make_side([100.0], [1.0])
+    side.apply([99.0, 105.0], [0.0, 0.0])
+    assert side.prices.tolist() == [100.0]
+
+
+def test_apply_inserts_keep_prices_sorted():
+    side = make_side([100.0, 104.0], [1.0, 1.0])
+    side.apply([106.0, 98.0, 102.0, 103.0], [1.0, 2.0, 3.0, 4.0])
+    assert side.prices.tolist() == [98.0, 100.0, 102.0, 103.0, 104.0, 106.0]
+    assert side.amounts.tolist() == [2.0, 1.0, 3.0, 4.0, 1.0, 1.0]
+
+
+def test_update_without_snapshot_raises_sequence_gap():
+    book = OrderBook('BTC-PERPETUAL')
+    with pytest.raises(SequenceGap):
+        book.apply_update([[100.0, 1.0]], [], change_id=2, prev_change_id=1)
+
+
+def test_update_with_wrong_prev_change_id_marks_book_out_of_sync():
+    book = OrderBook('BTC-PERPETUAL')
+    book.apply_snapshot([[100.0, 1.0]], [[101.0, 1.0]], change_id=10)
+    book.apply_update([['new', 99.0, 2.0]], [['delete', 101.0, 0.0]], change_id=11, prev_change_id=10)
+    assert book.best() == (100.0, None)
+
+    with pytest.raises(SequenceGap):
+        book.apply_update([[98.0, 1.0]], [], change_id=13, prev_change_id=12)
+    assert not book.in_sync
+    assert book.change_id == 11
+    assert 98.0 not in book.bids.prices
+
+
+def test_bucket_levels_floors_to_the_step():
+    prices, amounts, cumulative = bucket_levels([105.0, 104.0, 99.5, 90.0], [1.0, 2.0, 3.0, 4.0], 10)
+    assert prices.tolist() == [100.0, 90.0]
+    assert amounts.tolist() == [3.0, 7.0]
+    assert cumulative.tolist() == [3.0, 10.0]
+
+
+def test_bucket_levels_tolerates_float_error():
+    # 0.3 / 0.1 = 2.9999999999999996 debe caer en el escalón 0.3
+    prices, amounts, _ = bucket_levels([0.3, 0.35, 0.4], [1.0, 1.0, 1.0], 0.1)
+    assert prices.tolist() == [0.3, 0.4]
+    assert amounts.tolist() == [2.0, 1.0]
+
+
+def test_bucket_levels_round_up_uses_the_next_step():
+    prices, amounts, _ = bucket_levels([101.0, 109.0, 110.0], [1.0, 1.0, 1.0], 10, round_up=True)
+    assert prices.tolist() == [110.0, 120.0]
+    assert amounts.tolist() == [2.0, 1.0]
+
+
+def test_bucket_levels_rounds_prices_to_the_step_decimals():
+    prices, _, _ = bucket_levels([0.7, 1.2, 1.4], [1.0, 1.0, 1.0], 0.5)
+    assert prices.tolist() == [0.5, 1.0]
+
+
+def test_bucket_levels_without_step_returns_levels():
+    prices, amounts, cumulative = bucket_levels([100.0, 99.0], [1.0, 2.0], 0)
+    assert prices.tolist() == [100.0, 99.0]
+    assert cumulative.tolist() == [1.0, 3.0]
+
+
+def test_bucket_levels_sums_venue_columns():
+    _, amounts, cumulative = bucket_levels([101.0, 100.0, 95.0], np.array([[1.0, 0.0], [1.0, 2.0], [0.0, 1.0]]), 10)
+    assert amounts.tolist() == [[2.0, 2.0], [0.0, 1.0]]
+    assert cumulative.tolist() == [[2.0, 2.0], [2.0, 3.0]]